@@ -1,4 +1,5 @@
 import sys
+import time
 from pathlib import Path
 
 # Add the project root to sys.path to handle 'src' imports
@@ -6,7 +7,13 @@ root_path = Path(__file__).resolve().parent.parent
 if str(root_path) not in sys.path:
     sys.path.insert(0, str(root_path))
 
+# the engine and its dependencies are imported first, so the startup report shows what the import costs
+_import_started = time.perf_counter()
+import src.search_engine
+SEARCH_ENGINE_IMPORT_SECONDS = time.perf_counter() - _import_started
+
 import streamlit as st
+from src.hybrid_search import HybridSearch, BACKEND_OK
 from src.indexing.elasticsearch_indexing import ElasticSearchIndexing
 from src.search_engine import SearchEngine
 from src.util import constant
@@ -14,9 +21,11 @@ from src.util import constant
 
 @st.cache_resource
 def get_engines():
-    search_engine = SearchEngine()
+    search_engine = SearchEngine(import_seconds=SEARCH_ENGINE_IMPORT_SECONDS)
     try:
         search_engine.load_prebuilt_index()
+        # recurring questions are answered from the result cache from the first request on
+        search_engine.warm_result_cache()
     except Exception as e:
         st.warning(f"Note: Some local models might not be built yet. Error: {e}")
     
@@ -25,14 +34,20 @@ def get_engines():
     except Exception as e:
         st.error(f"Failed to connect to Elasticsearch: {e}")
         es_engine = None
-        
-    return search_engine, es_engine
+
+    try:
+        hybrid_engine = HybridSearch.from_engines(search_engine, es_engine)
+    except Exception as e:
+        st.warning(f"Hybrid search is not available. Error: {e}")
+        hybrid_engine = None
+
+    return search_engine, es_engine, hybrid_engine
 
 class LawRetrievalApp:
     def __init__(self):
         self._setup_page()
         self._setup_styles()
-        self.search_engine, self.es_engine = get_engines()
+        self.search_engine, self.es_engine, self.hybrid_engine = get_engines()
 
     def _setup_page(self):
         st.set_page_config(
@@ -87,44 +102,68 @@ class LawRetrievalApp:
                     "Vector Space Model (VSM)",
                     "BM25",
                     "Elasticsearch (Normal)",
-                    "Elasticsearch (Processed)"
+                    "Elasticsearch (Processed)",
+                    "Hybrid (BM25 + VSM + Elasticsearch)"
                 ],
                 index=2
             )
             top_n = st.number_input("Top N Results", min_value=1, max_value=100, value=10)
+            stats = self.search_engine.result_cache.stats()
+            st.caption(f"Result cache: {stats.entries} queries, {stats.hits} hits, {stats.misses} misses")
             st.divider()
             st.info("This demo retrieves documents from the Vietnamese law corpus.")
             return method, top_n
 
-    def _perform_search(self, query, method, top_n):
-        results = []
+    def _perform_search(self, query, method, top_n, cursor=None):
+        """Search a page of top_n results, returning them with the cursor of the next page"""
+        results, next_cursor = [], None
+        local_methods = {
+            "Boolean": constant.BOOLEAN_RETRIEVAL_NAME,
+            "Vector Space Model (VSM)": constant.VSM_MODEL_NAME,
+            "BM25": constant.BM25_MODEL_NAME,
+        }
         with st.spinner(f"Searching using {method}..."):
-            if method == "Boolean":
-                results = self.search_engine.search(query, method=constant.BOOLEAN_RETRIEVAL_NAME, top_n=top_n)
-            elif method == "Vector Space Model (VSM)":
-                results = self.search_engine.search(query, method=constant.VSM_MODEL_NAME, top_n=top_n)
-            elif method == "BM25":
-                results = self.search_engine.search(query, method=constant.BM25_MODEL_NAME, top_n=top_n)
+            if method in local_methods:
+                results, next_cursor = self.search_engine.search_page(query, method=local_methods[method],
+                                                                      page_size=top_n, cursor=cursor)
+                if cursor is None:
+                    self.search_engine.log_query(query, local_methods[method], top_n)
             elif "Elasticsearch" in method:
                 if self.es_engine:
                     is_normal = "Normal" in method
-                    es_results = self.es_engine.search(query, top_n=top_n, is_normal_index=is_normal)
+                    es_results, next_cursor = self.es_engine.search_page(query, page_size=top_n, cursor=cursor,
+                                                                         is_normal_index=is_normal)
                     results = [(hit["_id"], hit["_score"]) for hit in es_results]
                 else:
                     st.error("Elasticsearch engine is not available.")
-        return results
+            elif "Hybrid" in method:
+                if self.hybrid_engine:
+                    results, reports = self.hybrid_engine.search_with_report(query, top_n=top_n)
+                    failed = [f"{report.name} ({report.status})" for report in reports if report.status != BACKEND_OK]
+                    if failed:
+                        st.warning(f"Results without: {', '.join(failed)}")
+                else:
+                    st.error("Hybrid search is not available.")
+        return results, next_cursor
+
+    def _load_more(self):
+        search = st.session_state.search
+        try:
+            results, search["cursor"] = self._perform_search(search["query"], search["method"], search["top_n"],
+                                                             search["cursor"])
+        except Exception as e:
+            st.error(f"Could not load more results: {e}")
+            search["cursor"] = None
+            return
+        search["results"] = search["results"] + results
 
     def _display_results(self, results, method):
         if results:
             st.subheader(f"Found {len(results)} results")
+            raw_texts = self.search_engine.get_raw_documents([doc_id for doc_id, _ in results])
             for i, (doc_id, score) in enumerate(results):
-                raw_text = self.search_engine.raw_documents.get(doc_id)
-                if raw_text is None:
-                    try:
-                        raw_text = self.search_engine.raw_documents.get(int(doc_id))
-                    except (ValueError, TypeError):
-                        raw_text = self.search_engine.raw_documents.get(str(doc_id))
-                
+                # the document store normalizes ids, so ES string ids and index ids find the same document
+                raw_text = raw_texts[i]
                 if raw_text is None:
                     raw_text = "Document text not found."
                 
@@ -151,11 +190,19 @@ class LawRetrievalApp:
 
         if search_button:
             if query:
-                results = self._perform_search(query, method, top_n)
-                self._display_results(results, method)
+                results, cursor = self._perform_search(query, method, top_n)
+                # kept across reruns, so further pages are appended to the results shown
+                st.session_state.search = {"query": query, "method": method, "top_n": top_n,
+                                           "results": results, "cursor": cursor}
             else:
                 st.warning("Please enter a query first.")
 
+        search = st.session_state.get("search")
+        if search:
+            self._display_results(search["results"], search["method"])
+            if search["cursor"]:
+                st.button("Load more", on_click=self._load_more)
+
         st.divider()
         st.caption("Developed by Duong Vu with the help of Antigravity IDE, Github Copilot and reviewed by CodeRabbit")
 
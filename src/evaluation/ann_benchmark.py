@@ -0,0 +1,57 @@
+import time
+from typing import Sequence
+
+import numpy as np
+import pandas as pd
+
+from src.evaluation.evaluator_service import EvaluatorService
+from src.util import constant
+
+
+class ANNBenchmark:
+    """Measure the latency and recall@k of the LSI model's IVF search against brute force on the evaluation questions"""
+    DEFAULT_N_PROBE_VALUES = (1, 2, 4, 8, 16, 32, 64)
+    def __init__(self, evaluator: EvaluatorService):
+        self.evaluator = evaluator
+        self.search_engine = evaluator.search_engine
+    def run(self, k: int = 10, n_probe_values: Sequence[int] = DEFAULT_N_PROBE_VALUES) -> pd.DataFrame:
+        """
+        Search every evaluation question exactly, then through IVF with each number of probed lists
+        :param k: Depth of the compared rankings.
+        :param n_probe_values: Numbers of IVF lists probed per query.
+        :return: One row per setting with the mean and 95th percentile latency in ms and the mean recall@k
+        """
+        lsi = self.search_engine.lsi
+        if lsi is None:
+            raise RuntimeError("LSI model not loaded. Call load_prebuilt_index() or _build_index() first.")
+        questions = [question for question in self.evaluator.raw_documents.values() if question is not None]
+        query_vectors = [lsi.query_vector(query_terms) for query_terms in self.search_engine.processor.process_texts(questions)]
+        query_vectors = [vector for vector in query_vectors if vector is not None]
+        exact, latencies = [], []
+        for query in query_vectors:
+            start = time.perf_counter()
+            top, _ = lsi.exact_top(query, k)
+            latencies.append(time.perf_counter() - start)
+            exact.append(set(top.tolist()))
+        rows = [self._row("brute_force", latencies, [1.0] * len(exact))]
+        for n_probe in n_probe_values:
+            latencies, recalls = [], []
+            for query, expected in zip(query_vectors, exact):
+                start = time.perf_counter()
+                top, _ = lsi.ivf.search(lsi.doc_vectors, query, k, n_probe)
+                latencies.append(time.perf_counter() - start)
+                recalls.append(len(expected & set(top.tolist())) / len(expected) if expected else 1.0)
+            rows.append(self._row(f"ivf n_probe={n_probe}", latencies, recalls))
+        return pd.DataFrame(rows)
+    @staticmethod
+    def _row(method: str, latencies, recalls) -> dict:
+        latencies_ms = np.array(latencies) * 1000
+        return {"method": method,
+                "mean_latency_ms": float(latencies_ms.mean()) if len(latencies_ms) else 0.0,
+                "p95_latency_ms": float(np.percentile(latencies_ms, 95)) if len(latencies_ms) else 0.0,
+                "recall": EvaluatorService.mean(recalls)}
+    def run_and_save(self, **kwargs) -> pd.DataFrame:
+        df = self.run(**kwargs)
+        df.to_csv(constant.LSI_ANN_BENCHMARK_FILE_PATH, index = False)
+        print(df.to_string(index=False))
+        return df
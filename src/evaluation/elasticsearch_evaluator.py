@@ -30,24 +30,38 @@ class ElasticsearchEvaluator:
             raise FileNotFoundError(
                 "Ground-truth evaluation files not found. Run build_ground_truth() first."
             ) from e
+    def _search_all(self, questions: Dict, top_n: int, is_normal_index: bool) -> List[List[Dict]]:
+        """Search every question in one multi-search. If it fails, the questions are searched one by one, so only
+        the failing ones have no hits."""
+        try:
+            return self.es.search_batch(list(questions.values()), top_n=top_n, is_normal_index=is_normal_index)
+        except Exception:
+            logging.exception("Batch search failed, searching the queries one by one")
+        hits = []
+        for qid, question in questions.items():
+            try:
+                hits.append(self.es.search(question, top_n=top_n, is_normal_index=is_normal_index))
+            except Exception:
+                logging.exception(f"Search failed for qid={qid}")
+                hits.append([])
+        return hits
     def evaluate(self, top_n: int = 10, is_normal_index = True) -> Dict:
         all_retrieved: List[List[str]] = []
         all_relevant: List[List[str]] = []
         per_query_results: List[Dict] = []
         total = 0
+        questions = {}
         for qid, question in self.raw_documents.items():
-            true_ids = self.ground_truth.get(qid, [])
-            if not true_ids:
+            if not self.ground_truth.get(qid, []):
                 logging.warning(f"No ground truth found for qid={qid}, skipping")
                 continue
+            questions[qid] = question
+        batch_hits = self._search_all(questions, top_n, is_normal_index)
+        for (qid, question), hits in zip(questions.items(), batch_hits):
+            true_ids = self.ground_truth[qid]
             total += 1
             all_relevant.append(true_ids)
-            try:
-                results = self.es.search(question, top_n=top_n, is_normal_index=is_normal_index)
-                retrieved_ids = [str(hit["_id"]) for hit in results]
-            except Exception:
-                logging.warning(f"Search failed for qid={qid}")
-                retrieved_ids = []
+            retrieved_ids = [str(hit["_id"]) for hit in hits]
             all_retrieved.append(retrieved_ids)
 
             query_metrics: Dict = {"qid": qid, "query": question}
@@ -1,6 +1,6 @@
 import ast
 import logging
-from typing import List, Dict
+from typing import List, Dict, Optional, Tuple
 
 import pandas as pd
 
@@ -9,7 +9,7 @@ from src.evaluation.evaluation_metrics import calculate_precision_at_k, calculat
 from src.preprocessing.text_processor import TextProcessor
 from src.search_engine import SearchEngine
 from src.util import constant
-from src.util.constant import VSM_MODEL_NAME, BM25_MODEL_NAME, BOOLEAN_RETRIEVAL_NAME
+from src.util.constant import VSM_MODEL_NAME, BM25_MODEL_NAME, BOOLEAN_RETRIEVAL_NAME, BM25_IMPACT_MODEL_NAME
 from src.util.pickle_handling import save_to_pickle_file, load_pickle_file
 
 
@@ -60,23 +60,37 @@ class EvaluatorService:
             raise FileNotFoundError(
                 "Processed documents not found. Run build_ground_truth() first."
             ) from e
+    def _search_all(self, questions: Dict, method: str, top_n: int) -> List[Optional[List[Tuple[str, float]]]]:
+        """Search every question in one batch. If the batch fails, the questions are searched one by one, so only
+        the failing ones have no results: None, in the order of the questions."""
+        try:
+            return self.search_engine.search_batch(list(questions.values()), method=method, top_n=top_n)
+        except Exception:
+            logging.exception(f"Batch search failed for method={method}, searching the queries one by one")
+        results = []
+        for qid, question in questions.items():
+            try:
+                results.append(self.search_engine.search(question, method=method, top_n=top_n))
+            except Exception:
+                logging.exception(f"Search failed for qid={qid}, method={method}")
+                results.append(None)
+        return results
     def evaluate(self, method: str = BM25_MODEL_NAME, top_n: int = 10) -> Dict:
         all_retrieved: List[List[str]] = []
         all_relevant: List[List[str]] = []
         per_query_results: List[Dict] = []
         total = len(self.raw_documents)
+        questions = {}
         for qid, question in self.raw_documents.items():
-            true_ids = self.ground_truth.get(qid, [])
-            if not true_ids:
+            if not self.ground_truth.get(qid, []):
                 logging.warning(f"No ground truth found for qid={qid}, skipping")
                 continue
+            questions[qid] = question
+        batch_results = [results or [] for results in self._search_all(questions, method, top_n)]
+        for (qid, question), results in zip(questions.items(), batch_results):
+            true_ids = self.ground_truth[qid]
             all_relevant.append(true_ids)
-            try:
-                results = self.search_engine.search(question, method=method, top_n=top_n)
-                retrieved_ids = [str(doc_id) for doc_id, _ in results]
-            except Exception:
-                logging.warning(f"Search failed for qid={qid}, method={method}")
-                retrieved_ids = []
+            retrieved_ids = [str(doc_id) for doc_id, _ in results]
             all_retrieved.append(retrieved_ids)
 
             query_metrics: Dict = {"qid": qid, "query": question}
@@ -118,6 +132,39 @@ class EvaluatorService:
             results.append(result)
         df = pd.DataFrame(results)
         df.to_csv(constant.EVALUATION_RESULT_FILE_PATH, index = False)
+    def report_quality_loss(self, method: str = BM25_IMPACT_MODEL_NAME, baseline: str = BM25_MODEL_NAME,
+                            top_n: int = 10) -> Dict:
+        """
+        Compare an approximate method with its exact baseline on the ground truth and save the report
+        :param method: Approximate method, defaults to the impact-ordered BM25.
+        :param baseline: Exact method it approximates. Defaults to 'bm25'.
+        :param top_n: Depth of the rankings compared.
+        :return: Metrics of both methods, their difference and the mean overlap of their top_n rankings.
+        """
+        exact = self.evaluate(method=baseline, top_n=top_n)
+        approximate = self.evaluate(method=method, top_n=top_n)
+        overlaps = []
+        for exact_results, approximate_results in zip(self._search_all(self.raw_documents, baseline, top_n),
+                                                      self._search_all(self.raw_documents, method, top_n)):
+            if exact_results is None or approximate_results is None:
+                continue
+            exact_ids = {doc_id for doc_id, _ in exact_results}
+            approximate_ids = {doc_id for doc_id, _ in approximate_results}
+            if exact_ids:
+                overlaps.append(len(exact_ids & approximate_ids) / len(exact_ids))
+        report = {"metric": [], baseline: [], method: [], "delta": []}
+        for metric, value in exact.items():
+            if metric == "total_queries":
+                continue
+            report["metric"].append(metric)
+            report[baseline].append(value)
+            report[method].append(approximate[metric])
+            report["delta"].append(approximate[metric] - value)
+        df = pd.DataFrame(report)
+        df.to_csv(constant.IMPACT_QUALITY_REPORT_PATH, index = False)
+        print(df.to_string(index=False))
+        print(f"Mean top-{top_n} overlap of {method} with {baseline}: {self.mean(overlaps):.4f}")
+        return {"metrics": df, "overlap": self.mean(overlaps)}
 
 
     @staticmethod
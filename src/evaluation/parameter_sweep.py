@@ -0,0 +1,218 @@
+import itertools
+import time
+from collections import Counter
+from typing import List, Dict, Tuple, Sequence
+
+import numpy as np
+import pandas as pd
+
+from src.evaluation.evaluator_service import EvaluatorService
+from src.model.model import top_k
+from src.util import constant
+
+BM25_VARIANT = "bm25"
+BM25_PLUS_VARIANT = "bm25+"
+BM25L_VARIANT = "bm25l"
+# the lower-bounding deltas recommended by Lv and Zhai for BM25+ and BM25L
+DEFAULT_DELTAS = {BM25_VARIANT: 0.0, BM25_PLUS_VARIANT: 1.0, BM25L_VARIANT: 0.5}
+# queries are scored in chunks holding about this many postings, which bounds the memory of the sweep
+SWEEP_CHUNK_POSTINGS = 1 << 23
+
+
+class BM25ParameterSweep:
+    """Evaluate a grid of BM25 parameters and variants without searching once per setting.
+
+    Query tokenization, the postings of every query term (tf and doc id) and the relevance of every candidate
+    document are gathered once. Each setting then only rescores those arrays with NumPy and re-selects the top
+    n per query. Term weights use the engine's BM25 idf for every variant, so only the tf normalization varies.
+    """
+    DEFAULT_K1_VALUES = (0.4, 0.6, 0.8, 1.0, 1.2, 1.4, 1.6, 1.8, 2.0, 2.2)
+    DEFAULT_B_VALUES = (0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0)
+    def __init__(self, evaluator: EvaluatorService):
+        self.evaluator = evaluator
+        self.search_engine = evaluator.search_engine
+        self.k_values = evaluator.k_values
+    def _gather(self) -> Tuple[List[Dict], np.ndarray]:
+        """Get the postings of every query with ground truth, and the number of relevant documents of each"""
+        index = self.search_engine.inverted_index
+        bm25 = self.search_engine.bm25
+        questions = [
+            (qid, question) for qid, question in self.evaluator.raw_documents.items()
+            if self.evaluator.ground_truth.get(qid, [])
+        ]
+        tokenized = self.search_engine.processor.process_texts([question for _, question in questions if question is not None])
+        tokens_by_position = iter(tokenized)
+        # the ground truth holds string ids while the corpus may be keyed by integers, as in evaluate()
+        internal_ids = {str(doc_id): internal_id for internal_id, doc_id in enumerate(index.doc_ids)}
+        queries = []
+        num_relevant = np.zeros(len(questions))
+        # scratch arrays indexed by internal doc id, to deduplicate the candidates of a query in linear time
+        seen = np.zeros(len(index.doc_lengths), dtype=bool)
+        slots = np.zeros(len(index.doc_lengths), dtype=np.int64)
+        for position, (qid, question) in enumerate(questions):
+            query_terms = next(tokens_by_position) if question is not None else []
+            true_ids = self.evaluator.ground_truth[qid]
+            num_relevant[position] = len(true_ids)
+            relevant_ids = np.array(sorted({internal_ids[cid] for cid in true_ids if cid in internal_ids}),
+                                    dtype=np.int64)
+            doc_ids, tfs, weights = [], [], []
+            for term, count in Counter(query_terms).items():
+                term_doc_ids, term_tfs = index.get_postings(term)
+                if len(term_doc_ids) == 0:
+                    continue
+                doc_ids.append(term_doc_ids)
+                tfs.append(term_tfs)
+                weights.append(np.full(len(term_doc_ids), count * bm25.compute_idf(term)))
+            if not doc_ids:
+                queries.append({"postings": 0})
+                continue
+            doc_ids = np.concatenate(doc_ids)
+            # candidates are the documents containing a query term, in ascending internal id as ties are broken
+            seen[doc_ids] = True
+            candidates = np.flatnonzero(seen)
+            seen[candidates] = False
+            slots[candidates] = np.arange(len(candidates))
+            posting_candidates = slots[doc_ids]
+            queries.append({
+                "postings": len(doc_ids),
+                "doc_ids": doc_ids,
+                "tfs": np.concatenate(tfs).astype(np.float64),
+                "weights": np.concatenate(weights),
+                "posting_candidates": posting_candidates,
+                "candidates": candidates,
+                "relevant": np.isin(candidates, relevant_ids),
+            })
+        return queries, num_relevant
+    @staticmethod
+    def _normalized_tfs(variant: str, k1: float, delta: float, tfs: np.ndarray, length_norms: np.ndarray) -> np.ndarray:
+        """Get the factor multiplying the term weight; ``length_norms`` is 1 - b + b * doc_length / avg_doc_length"""
+        if variant == BM25_VARIANT:
+            return tfs * (k1 + 1) / (tfs + k1 * length_norms)
+        if variant == BM25_PLUS_VARIANT:
+            return tfs * (k1 + 1) / (tfs + k1 * length_norms) + delta
+        if variant == BM25L_VARIANT:
+            normalized = tfs / length_norms + delta
+            return (k1 + 1) * normalized / (k1 + normalized)
+        raise ValueError(f"Unknown BM25 variant: {variant}")
+    def run(self, k1_values: Sequence[float] = DEFAULT_K1_VALUES, b_values: Sequence[float] = DEFAULT_B_VALUES,
+            variants: Sequence[str] = (BM25_VARIANT, BM25_PLUS_VARIANT, BM25L_VARIANT), top_n: int = 10) -> pd.DataFrame:
+        """
+        Evaluate every (variant, k1, b) setting on the ground truth of the evaluator
+        :param k1_values: Term frequency saturation values.
+        :param b_values: Length normalization values.
+        :param variants: BM25 variants among 'bm25', 'bm25+' and 'bm25l'.
+        :param top_n: Depth of the evaluated rankings.
+        :return: One row of metrics per setting, as EvaluatorService.evaluate computes them
+        """
+        start = time.perf_counter()
+        queries, num_relevant = self._gather()
+        settings = list(itertools.product(variants, k1_values, b_values))
+        # relevance of the top n of every query under every setting; the metrics only depend on it
+        ranked_relevance = np.zeros((len(settings), len(queries), top_n), dtype=bool)
+        chunk_start = 0
+        while chunk_start < len(queries):
+            chunk_end, postings = chunk_start, 0
+            while chunk_end < len(queries) and (chunk_end == chunk_start or postings < SWEEP_CHUNK_POSTINGS):
+                postings += queries[chunk_end]["postings"]
+                chunk_end += 1
+            chunk = [(position, queries[position]) for position in range(chunk_start, chunk_end)
+                     if queries[position]["postings"]]
+            chunk_start = chunk_end
+            if not chunk:
+                continue
+            self._rank_chunk(chunk, settings, top_n, ranked_relevance)
+        rows = [
+            dict(variant=variant, k1=k1, b=b, delta=DEFAULT_DELTAS[variant],
+                 **self._metrics(ranked_relevance[setting], num_relevant))
+            for setting, (variant, k1, b) in enumerate(settings)
+        ]
+        print(f"Evaluated {len(settings)} settings on {len(queries)} queries in {time.perf_counter() - start:.1f}s")
+        return pd.DataFrame(rows)
+    def _rank_chunk(self, chunk: List[Tuple[int, Dict]], settings: List[Tuple[str, float, float]], top_n: int,
+                    ranked_relevance: np.ndarray) -> None:
+        """Rank the candidates of a chunk of (position, query) under every setting, recording the relevance of the top n"""
+        index = self.search_engine.inverted_index
+        doc_ids = np.concatenate([query["doc_ids"] for _, query in chunk])
+        weights = np.concatenate([query["weights"] for _, query in chunk])
+        relevant = np.concatenate([query["relevant"] for _, query in chunk])
+        # a posting's normalized tf only depends on its (tf, doc length) pair, and far fewer pairs than postings
+        # exist, so each setting normalizes the distinct pairs and gathers them
+        lengths = index.doc_lengths[doc_ids].astype(np.int64)
+        stride = int(lengths.max()) + 1
+        pairs, posting_pairs = _unique_inverse(np.concatenate([query["tfs"] for _, query in chunk]).astype(np.int64)
+                                               * stride + lengths)
+        pair_tfs = (pairs // stride).astype(np.float64)
+        pair_lengths = pairs % stride / index.avg_doc_length if index.avg_doc_length else np.zeros(len(pairs))
+        # one score slot per (query, candidate), so a setting accumulates every score with a single bincount
+        slot_offsets = np.cumsum([0] + [len(query["candidates"]) for _, query in chunk])
+        posting_slots = np.concatenate([query["posting_candidates"] + offset
+                                        for (_, query), offset in zip(chunk, slot_offsets)])
+        for variant in dict.fromkeys(variant for variant, _, _ in settings):
+            delta = DEFAULT_DELTAS[variant]
+            variant_settings = [(setting, k1, b) for setting, (name, k1, b) in enumerate(settings) if name == variant]
+            def pair_scores(k1: float, b: float) -> np.ndarray:
+                return self._normalized_tfs(variant, k1, delta, pair_tfs, 1 - b + b * pair_lengths)
+            lowest = np.minimum.reduce([pair_scores(k1, b) for _, k1, b in variant_settings])
+            highest = np.maximum.reduce([pair_scores(k1, b) for _, k1, b in variant_settings])
+            # every setting scores a candidate between these bounds, summed in the same order, so a candidate whose
+            # upper bound is below the n-th best lower bound of its query cannot reach the top n of any setting
+            lower = np.bincount(posting_slots, weights=weights * lowest[posting_pairs], minlength=slot_offsets[-1])
+            upper = np.bincount(posting_slots, weights=weights * highest[posting_pairs], minlength=slot_offsets[-1])
+            keep = np.ones(slot_offsets[-1], dtype=bool)
+            for start, end in zip(slot_offsets[:-1].tolist(), slot_offsets[1:].tolist()):
+                if end - start > top_n:
+                    threshold = np.partition(lower[start:end], end - start - top_n)[end - start - top_n]
+                    keep[start:end] = upper[start:end] >= threshold
+            kept_postings = keep[posting_slots]
+            kept_before = np.cumsum(keep)
+            slots = kept_before[posting_slots[kept_postings]] - 1
+            kept_pairs, kept_weights = posting_pairs[kept_postings], weights[kept_postings]
+            kept_offsets = np.concatenate(([0], kept_before[slot_offsets[1:] - 1]))
+            kept_relevant = relevant[keep]
+            # a kept candidate keeps all its postings in their order, so its scores are the unpruned ones
+            for setting, k1, b in variant_settings:
+                scores = np.bincount(slots, weights=kept_weights * pair_scores(k1, b)[kept_pairs], minlength=kept_offsets[-1])
+                for (position, _), start, end in zip(chunk, kept_offsets[:-1].tolist(), kept_offsets[1:].tolist()):
+                    top = top_k(scores[start:end], np.arange(end - start), top_n)
+                    ranked_relevance[setting, position, :len(top)] = kept_relevant[start:end][top]
+    def _metrics(self, relevance: np.ndarray, num_relevant: np.ndarray) -> Dict:
+        """Aggregate the metrics of EvaluatorService from the relevance of every ranked position"""
+        if len(relevance) == 0:
+            return {}
+        hits = np.cumsum(relevance, axis=1)
+        ranks = np.arange(1, relevance.shape[1] + 1)
+        metrics: Dict = {}
+        for k in self.k_values:
+            hits_at_k = hits[:, min(k, relevance.shape[1]) - 1]
+            precision = hits_at_k / k
+            recall = np.divide(hits_at_k, num_relevant, out=np.zeros(len(hits_at_k)), where=num_relevant > 0)
+            f1 = np.divide(2 * precision * recall, precision + recall, out=np.zeros(len(hits_at_k)),
+                           where=precision + recall > 0)
+            metrics[f"precision@{k}"] = float(precision.mean())
+            metrics[f"recall@{k}"] = float(recall.mean())
+            metrics[f"f1@{k}"] = float(f1.mean())
+        first = np.where(relevance.any(axis=1), relevance.argmax(axis=1) + 1, np.inf)
+        metrics["mrr"] = float((1 / first).mean())
+        average_precision = (relevance * hits / ranks).sum(axis=1)
+        metrics["map"] = float(np.divide(average_precision, num_relevant, out=np.zeros(len(relevance)),
+                                         where=num_relevant > 0).mean())
+        return metrics
+    def run_and_save(self, **kwargs) -> pd.DataFrame:
+        """Run the sweep, save the grid and print the best settings by MAP"""
+        df = self.run(**kwargs)
+        df.to_csv(constant.BM25_SWEEP_RESULT_FILE_PATH, index = False)
+        print(df.sort_values("map", ascending=False).head(10).to_string(index=False))
+        return df
+
+
+def _unique_inverse(keys: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """np.unique(keys, return_inverse=True) for non-negative keys, through a lookup table when their range is small"""
+    size = int(keys.max()) + 1
+    if size > 4 * len(keys):
+        return np.unique(keys, return_inverse=True)
+    present = np.zeros(size, dtype=bool)
+    present[keys] = True
+    unique = np.flatnonzero(present)
+    ranks = np.zeros(size, dtype=np.int64)
+    ranks[unique] = np.arange(len(unique))
+    return unique, ranks[keys]
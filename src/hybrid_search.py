@@ -0,0 +1,131 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Callable, List, NamedTuple, Optional, Tuple, TYPE_CHECKING
+
+from src.indexing.document_store import normalize_doc_id
+from src.model.fusion import reciprocal_rank_fusion, weighted_score_fusion, DEFAULT_RRF_K
+from src.search_engine import SearchEngine
+from src.util import constant
+
+if TYPE_CHECKING:
+    from src.indexing.elasticsearch_indexing import ElasticSearchIndexing
+
+DEFAULT_BACKEND_TIMEOUT_SECONDS = 1.0
+# every backend is asked for at least this many results, deeper lists give fusion more to agree on
+DEFAULT_CANDIDATE_DEPTH = 50
+RRF_FUSION = "rrf"
+SCORE_FUSION = "score"
+BACKEND_OK = "ok"
+BACKEND_TIMEOUT = "timeout"
+BACKEND_ERROR = "error"
+
+
+class Backend(NamedTuple):
+    """A retrieval backend: search(query, top_n) returns (doc_id, score) tuples, best first"""
+    name: str
+    search: Callable[[str, int], List[Tuple[str, float]]]
+    weight: float = 1.0
+    timeout_seconds: float = DEFAULT_BACKEND_TIMEOUT_SECONDS
+
+
+class BackendReport(NamedTuple):
+    name: str
+    status: str  # BACKEND_OK, BACKEND_TIMEOUT or BACKEND_ERROR
+    seconds: float  # time until the results arrived, or until the backend was given up on
+    num_results: int
+
+
+class HybridSearch:
+    """Search several backends in parallel and fuse their rankings.
+
+    Every backend runs on a shared thread pool under its own timeout, so a query takes about as long as its
+    slowest backend within budget. Backends that time out or fail are left out of the fusion, which then
+    ranks with the others. A timed out search keeps its worker until it returns, so the pool has spare workers.
+    """
+    def __init__(self, backends: List[Backend], fusion: str = RRF_FUSION, rrf_k: int = DEFAULT_RRF_K,
+                 candidate_depth: int = DEFAULT_CANDIDATE_DEPTH, max_workers: Optional[int] = None):
+        """
+        :param backends: Backends to fan out to.
+        :param fusion: 'rrf' (reciprocal-rank fusion) or 'score' (weighted sum of min-max scaled scores).
+        :param rrf_k: Rank offset of reciprocal-rank fusion.
+        :param candidate_depth: Minimum number of results requested from every backend.
+        :param max_workers: Threads of the pool. Defaults to four per backend.
+        """
+        if fusion not in (RRF_FUSION, SCORE_FUSION):
+            raise ValueError(f"Unknown fusion: {fusion}")
+        self.backends = backends
+        self.fusion = fusion
+        self.rrf_k = rrf_k
+        self.candidate_depth = candidate_depth
+        self.executor = ThreadPoolExecutor(max_workers=max_workers or 4 * len(backends),
+                                           thread_name_prefix="hybrid-search")
+    @classmethod
+    def from_engines(cls, search_engine: SearchEngine, es_engine: Optional["ElasticSearchIndexing"] = None,
+                     timeout_seconds: float = DEFAULT_BACKEND_TIMEOUT_SECONDS, **kwargs) -> "HybridSearch":
+        """Fuse BM25 and VSM of a loaded search engine, and the processed Elasticsearch index when given"""
+        bm25, vsm = search_engine.bm25, search_engine.vsm
+        if bm25 is None or vsm is None:
+            raise RuntimeError("Models not loaded. Call load_prebuilt_index() or _build_index() first.")
+        # the models, their statistics and the text processor are loaded now rather than within the timeout of
+        # the first query. Searches then only read the shared tables, so both backends score at the same time
+        # as long as the index does not change
+        if bm25.term_idf is None or bm25.bounds is None:
+            bm25.precompute()
+        if vsm.doc_norms is None:
+            vsm.precompute()
+        search_engine.processor
+        def engine_search(method: str) -> Callable[[str, int], List[Tuple[str, float]]]:
+            return lambda query, top_n: search_engine.search(query, method, top_n)
+        backends = [
+            Backend(constant.BM25_MODEL_NAME, engine_search(constant.BM25_MODEL_NAME), timeout_seconds=timeout_seconds),
+            Backend(constant.VSM_MODEL_NAME, engine_search(constant.VSM_MODEL_NAME), timeout_seconds=timeout_seconds),
+        ]
+        if es_engine is not None:
+            backends.append(Backend(constant.PROCESSED_INDEX_NAME, lambda query, top_n: [
+                (hit["_id"], hit["_score"]) for hit in es_engine.search(query, top_n, is_normal_index=False)
+            ], timeout_seconds=timeout_seconds))
+        return cls(backends, **kwargs)
+    def search(self, query: str, top_n: int = 10) -> List[Tuple[str, float]]:
+        """
+        Search every backend and fuse the results
+        :param query: Search query string.
+        :param top_n: Top n results to return. Defaults to 10.
+        :return: List of (doc_id, fused score) tuples. Empty when every backend failed.
+        """
+        return self.search_with_report(query, top_n)[0]
+    def search_with_report(self, query: str, top_n: int = 10) -> Tuple[List[Tuple[str, float]],
+                                                                         List[BackendReport]]:
+        """Search like search(), also returning how every backend fared, in the order of the backends"""
+        depth = max(top_n, self.candidate_depth)
+        start = time.perf_counter()
+        futures = [self.executor.submit(_timed_search, backend, query, depth, start) for backend in self.backends]
+        rankings, weights, reports = [], [], []
+        for backend, future in zip(self.backends, futures):
+            # every backend has been running since start, so its remaining budget is measured from there
+            remaining = max(0.0, backend.timeout_seconds - (time.perf_counter() - start))
+            try:
+                ranking, seconds = future.result(remaining)
+            except FutureTimeoutError:
+                future.cancel()
+                logging.warning(f"Backend {backend.name} timed out after {backend.timeout_seconds}s")
+                reports.append(BackendReport(backend.name, BACKEND_TIMEOUT, backend.timeout_seconds, 0))
+                continue
+            except Exception as e:
+                logging.warning(f"Backend {backend.name} failed: {e}")
+                reports.append(BackendReport(backend.name, BACKEND_ERROR, time.perf_counter() - start, 0))
+                continue
+            reports.append(BackendReport(backend.name, BACKEND_OK, seconds, len(ranking)))
+            rankings.append(ranking)
+            weights.append(backend.weight)
+        if self.fusion == RRF_FUSION:
+            return reciprocal_rank_fusion(rankings, weights, self.rrf_k, top_n), reports
+        return weighted_score_fusion(rankings, weights, top_n), reports
+    def close(self) -> None:
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _timed_search(backend: Backend, query: str, top_n: int, start: float) -> Tuple[List[Tuple[str, float]], float]:
+    """Search one backend, with ids normalized across backends and the seconds since the fan-out started"""
+    ranking = [(normalize_doc_id(doc_id), float(score)) for doc_id, score in backend.search(query, top_n)]
+    return ranking, time.perf_counter() - start
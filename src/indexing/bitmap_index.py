@@ -0,0 +1,90 @@
+import json
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from src.indexing.index_segment import IndexSegment
+from src.indexing.index_storage import save_array
+from src.indexing.roaring_bitmap import RoaringBitmap, flatten_bitmaps, read_bitmap, CONTAINER_BITS, \
+    CONTAINER_SIZE, ARRAY_CONTAINER_LIMIT
+
+_ARRAYS = ("bitmap_offsets", "container_keys", "container_offsets", "container_is_bitmap", "data")
+
+
+class BitmapIndex:
+    """Roaring bitmaps of the documents of every term, of the live documents and of named filters.
+
+    Bitmap ``t`` holds the internal doc ids of term id ``t`` of the segment the index was built from, then
+    come the live documents and the filters in ``filter_names`` order, all laid out as by flatten_bitmaps.
+    Bitmaps are read as views of the arrays, which are memory-mapped once saved.
+    """
+    def __init__(self, arrays: Dict[str, np.ndarray], num_terms: int, filter_names: Tuple[str, ...] = ()):
+        self.arrays = arrays
+        self.num_terms = num_terms
+        self.filter_names = filter_names
+        self.live = read_bitmap(arrays, num_terms)
+        self.filters = {name: read_bitmap(arrays, num_terms + 1 + i) for i, name in enumerate(filter_names)}
+    @classmethod
+    def from_segment(cls, segment: IndexSegment, deleted: np.ndarray,
+                     filters: Optional[Dict[str, RoaringBitmap]] = None) -> "BitmapIndex":
+        """Build the bitmaps of every term of ``segment`` at once, from its postings in term order"""
+        filters = filters or {}
+        df = segment.doc_frequencies()
+        doc_ids = np.asarray(segment.postings_doc_ids, dtype=np.int64)
+        posting_terms = np.repeat(np.arange(len(df)), df)
+        high = doc_ids >> CONTAINER_BITS
+        # a container starts where the term or the high bits change; postings are sorted by doc id per term
+        new_container = np.ones(len(doc_ids), dtype=bool)
+        new_container[1:] = (posting_terms[1:] != posting_terms[:-1]) | (high[1:] != high[:-1])
+        starts = np.flatnonzero(new_container)
+        cardinalities = np.diff(np.append(starts, len(doc_ids)))
+        low = (doc_ids & (CONTAINER_SIZE - 1)).astype(np.uint16)
+        is_bitmap = cardinalities > ARRAY_CONTAINER_LIMIT
+        # array containers are the low bits as they are; the few dense ones are replaced by their bitmap
+        pieces, previous = [], 0
+        for container in np.flatnonzero(is_bitmap).tolist():
+            start, end = int(starts[container]), int(starts[container]) + int(cardinalities[container])
+            pieces.append(low[previous:start])
+            pieces.append(RoaringBitmap.from_sorted(low[start:end]).containers[0].view(np.uint16))
+            previous = end
+        pieces.append(low[previous:])
+        sizes = np.where(is_bitmap, CONTAINER_SIZE // 16, cardinalities)
+        container_offsets = np.zeros(len(starts) + 1, dtype=np.int64)
+        np.cumsum(sizes, out=container_offsets[1:])
+        bitmap_offsets = np.zeros(len(df) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(posting_terms[starts], minlength=len(df)), out=bitmap_offsets[1:])
+        arrays = {"bitmap_offsets": bitmap_offsets, "container_keys": high[starts],
+                  "container_offsets": container_offsets, "container_is_bitmap": is_bitmap,
+                  "data": np.concatenate(pieces)}
+        extra = flatten_bitmaps([RoaringBitmap.from_mask(~np.asarray(deleted))] + list(filters.values()))
+        return cls(_concatenate(arrays, extra), len(df), tuple(filters))
+    def term_bitmap(self, term_id: int) -> RoaringBitmap:
+        return read_bitmap(self.arrays, term_id)
+    def save(self, directory: str, meta: Dict) -> None:
+        path = Path(directory)
+        path.mkdir(parents=True, exist_ok=True)
+        for name in _ARRAYS:
+            save_array(path / f"{name}.npy", self.arrays[name])
+        meta = dict(meta, num_terms=self.num_terms, filter_names=list(self.filter_names))
+        (path / "meta.json").write_text(json.dumps(meta), encoding="utf-8")
+    @classmethod
+    def load(cls, directory: str) -> Tuple["BitmapIndex", Dict]:
+        """Memory-map a saved bitmap index and return it with the metadata it was saved with"""
+        path = Path(directory)
+        meta = json.loads((path / "meta.json").read_text(encoding="utf-8"))
+        arrays = {name: np.load(path / f"{name}.npy", mmap_mode="r") for name in _ARRAYS}
+        return cls(arrays, meta["num_terms"], tuple(meta["filter_names"])), meta
+
+
+def _concatenate(first: Dict[str, np.ndarray], second: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    """Append the bitmaps of one flat layout to another"""
+    return {
+        "bitmap_offsets": np.concatenate([first["bitmap_offsets"],
+                                          second["bitmap_offsets"][1:] + first["bitmap_offsets"][-1]]),
+        "container_keys": np.concatenate([first["container_keys"], second["container_keys"]]),
+        "container_offsets": np.concatenate([first["container_offsets"],
+                                             second["container_offsets"][1:] + first["container_offsets"][-1]]),
+        "container_is_bitmap": np.concatenate([first["container_is_bitmap"], second["container_is_bitmap"]]),
+        "data": np.concatenate([first["data"], second["data"]]),
+    }
@@ -0,0 +1,64 @@
+from typing import Dict, Iterable, Sequence
+
+import numpy as np
+
+from src.indexing.index_storage import write_sections, MappedSections
+from src.indexing.inverted_index import InvertedIndex
+
+STATS_MAGIC = b"VLRSTATS"
+STATS_FORMAT_VERSION = 1
+
+
+class CollectionStats:
+    """Document frequency of every term, number of documents and total length of a whole collection.
+
+    An index holding one shard of the collection scores with these instead of its own statistics, see
+    InvertedIndex.set_collection_stats, so idf and length normalization are those of the whole collection.
+    Terms are sorted UTF-8 bytes, looked up by binary search, and memory-mapped once saved.
+    """
+    def __init__(self, terms: np.ndarray, doc_frequencies: np.ndarray, total_docs: int, total_length: int):
+        self.terms = terms
+        self.doc_frequencies = doc_frequencies
+        self.total_docs = total_docs
+        self.total_length = total_length
+        self.avg_doc_length = total_length / total_docs if total_docs > 0 else 0
+        self.storage = None  # memory map backing the arrays when loaded from disk
+    @classmethod
+    def from_indexes(cls, indexes: Iterable[InvertedIndex]) -> "CollectionStats":
+        """Sum the statistics of the live documents of indexes holding disjoint parts of a collection, in one pass
+        so the indexes can be built and dropped one at a time"""
+        doc_frequencies: Dict[bytes, int] = {}
+        total_docs = total_length = 0
+        for index in indexes:
+            total_docs += index.total_docs
+            total_length += index.total_length
+            segment = index.merged_segment()
+            for term_id, df in enumerate(segment.doc_frequencies().tolist()):
+                if df:
+                    term = segment.terms[term_id].encode("utf-8")
+                    doc_frequencies[term] = doc_frequencies.get(term, 0) + df
+        terms = sorted(doc_frequencies)
+        return cls(np.array(terms, dtype=bytes), np.array([doc_frequencies[term] for term in terms], dtype=np.int64),
+                   total_docs, total_length)
+    def doc_frequency(self, term: str) -> int:
+        return int(self.lookup([term])[0])
+    def lookup(self, terms: Sequence[str]) -> np.ndarray:
+        """Get the collection DF of every term, 0 for terms not in the collection"""
+        encoded = np.array([term.encode("utf-8") for term in terms], dtype=bytes)
+        if len(self.terms) == 0 or len(encoded) == 0:
+            return np.zeros(len(encoded), dtype=np.int64)
+        positions = np.minimum(np.searchsorted(self.terms, encoded), len(self.terms) - 1)
+        return np.where(self.terms[positions] == encoded, self.doc_frequencies[positions], 0)
+    def fingerprint(self) -> Dict:
+        return {"num_terms": len(self.terms), "total_docs": self.total_docs, "total_length": self.total_length}
+    def save(self, file_path: str) -> None:
+        write_sections(file_path, STATS_MAGIC, STATS_FORMAT_VERSION,
+                       {"total_docs": self.total_docs, "total_length": self.total_length},
+                       {"terms": self.terms, "doc_frequencies": self.doc_frequencies})
+    @classmethod
+    def load(cls, file_path: str) -> "CollectionStats":
+        mapped = MappedSections(file_path, STATS_MAGIC, STATS_FORMAT_VERSION, "collection statistics")
+        stats = cls(mapped.section("terms"), mapped.section("doc_frequencies"), mapped.header["total_docs"],
+                    mapped.header["total_length"])
+        stats.storage = mapped.buffer
+        return stats
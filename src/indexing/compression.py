@@ -0,0 +1,152 @@
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+# Positions of one (term, doc) posting are stored as gaps, variable-byte encoded (7 bits per byte, high bit
+# set on every byte but the last). Lists longer than one block are prefixed with a skip table holding, for
+# every block, the gap between its last position and the previous block's last position and the byte
+# length of its data, so a reader can jump to the block holding a target position and decode only that.
+POSITION_BLOCK_SIZE = 64
+_MAX_VARBYTE_LENGTH = 5
+_EMPTY_POSITIONS = np.zeros(0, dtype=np.int64)
+
+
+def encode_varbyte(values: np.ndarray) -> np.ndarray:
+    """Variable-byte encode non-negative integers below 2**32"""
+    values = np.asarray(values, dtype=np.uint64)
+    lengths = varbyte_lengths(values)
+    starts = np.zeros(len(values), dtype=np.int64)
+    np.cumsum(lengths[:-1], out=starts[1:])
+    encoded = np.empty(int(lengths.sum()), dtype=np.uint8)
+    for k in range(_MAX_VARBYTE_LENGTH):
+        mask = lengths > k
+        if not mask.any():
+            break
+        chunk = (values[mask] >> np.uint64(7 * k)) & np.uint64(0x7F)
+        continuation = (lengths[mask] > k + 1).astype(np.uint64) << np.uint64(7)
+        encoded[starts[mask] + k] = chunk | continuation
+    return encoded
+
+
+def varbyte_lengths(values: np.ndarray) -> np.ndarray:
+    values = np.asarray(values, dtype=np.uint64)
+    lengths = np.ones(len(values), dtype=np.int64)
+    for k in range(1, _MAX_VARBYTE_LENGTH):
+        lengths += values >= np.uint64(1 << (7 * k))
+    return lengths
+
+
+def decode_varbyte(data: np.ndarray) -> np.ndarray:
+    """Decode a whole variable-byte stream"""
+    data = np.asarray(data, dtype=np.uint8)
+    if len(data) == 0:
+        return _EMPTY_POSITIONS
+    ends = np.flatnonzero(data < 0x80)
+    starts = np.zeros(len(ends), dtype=np.int64)
+    starts[1:] = ends[:-1] + 1
+    shifts = np.arange(len(data), dtype=np.int64) - np.repeat(starts, ends - starts + 1)
+    chunks = (data & 0x7F).astype(np.int64) << (7 * shifts)
+    return np.add.reduceat(chunks, starts)
+
+
+def _decode_varbyte_prefix(data: np.ndarray, count: int) -> Tuple[List[int], int]:
+    """Decode the first ``count`` values of a stream, returning them and the number of bytes consumed"""
+    values, value, shift, offset = [], 0, 0, 0
+    while len(values) < count:
+        byte = int(data[offset])
+        offset += 1
+        value |= (byte & 0x7F) << shift
+        shift += 7
+        if byte < 0x80:
+            values.append(value)
+            value, shift = 0, 0
+    return values, offset
+
+
+def encode_position_lists(positions: np.ndarray, counts: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Compress consecutive position lists (``counts[i]`` positions each, ascending within a list).
+
+    Returns the encoded bytes and the byte offset of every list (one more than the number of lists).
+    """
+    counts = np.asarray(counts, dtype=np.int64)
+    positions = np.asarray(positions, dtype=np.int64)
+    list_starts = np.zeros(len(counts), dtype=np.int64)
+    np.cumsum(counts[:-1], out=list_starts[1:])
+    gaps = positions.copy()
+    gaps[1:] -= positions[:-1]
+    gaps[list_starts[counts > 0]] = positions[list_starts[counts > 0]]
+    data = encode_varbyte(gaps)
+    value_offsets = np.zeros(len(gaps) + 1, dtype=np.int64)
+    np.cumsum(varbyte_lengths(gaps), out=value_offsets[1:])
+    list_sizes = value_offsets[list_starts + counts] - value_offsets[list_starts]
+
+    # long lists are rare, so their skip tables are spliced in one by one
+    chunks, cursor = [], 0
+    for i in np.flatnonzero(counts > POSITION_BLOCK_SIZE).tolist():
+        start, count = int(list_starts[i]), int(counts[i])
+        block_starts = np.arange(start, start + count, POSITION_BLOCK_SIZE)
+        block_ends = np.minimum(block_starts + POSITION_BLOCK_SIZE, start + count)
+        block_lasts = positions[block_ends - 1]
+        skip_table = np.empty(2 * len(block_starts), dtype=np.int64)
+        skip_table[0::2] = np.diff(block_lasts, prepend=0)
+        skip_table[1::2] = value_offsets[block_ends] - value_offsets[block_starts]
+        skip_bytes = encode_varbyte(skip_table)
+        list_start_byte = int(value_offsets[start])
+        chunks.extend((data[cursor:list_start_byte], skip_bytes))
+        cursor = list_start_byte
+        list_sizes[i] += len(skip_bytes)
+    chunks.append(data[cursor:])
+    offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(list_sizes, out=offsets[1:])
+    return np.concatenate(chunks), offsets
+
+
+class PositionReader:
+    """Lazily decodes one compressed position list, block by block.
+
+    ``skip_to`` uses the skip table to jump straight to the block that may hold the target, so positions
+    before it are never decoded.
+    """
+    def __init__(self, data: np.ndarray, count: int):
+        self.data = data
+        self.count = count
+        num_blocks = -(-count // POSITION_BLOCK_SIZE)
+        if num_blocks > 1:
+            skip_table, table_size = _decode_varbyte_prefix(data, 2 * num_blocks)
+            self.block_lasts = np.cumsum(skip_table[0::2])
+            self.block_offsets = table_size + np.concatenate(([0], np.cumsum(skip_table[1::2])))
+        else:
+            self.block_lasts = None
+            self.block_offsets = np.array([0, len(data)])
+        self._block = -1
+        self._values = _EMPTY_POSITIONS
+        self._index = 0
+    def _load_block(self, block: int) -> None:
+        start, end = self.block_offsets[block], self.block_offsets[block + 1]
+        base = int(self.block_lasts[block - 1]) if block > 0 else 0
+        self._values = base + np.cumsum(decode_varbyte(self.data[start:end]))
+        self._block = block
+        self._index = 0
+    def skip_to(self, target: int) -> Optional[int]:
+        """Advance to the first position >= target and return it, or None when the list is exhausted"""
+        if self.block_lasts is None:
+            block = 0
+        else:
+            block = max(self._block, int(np.searchsorted(self.block_lasts, target)))
+            if block >= len(self.block_lasts):
+                self._block, self._values, self._index = block, _EMPTY_POSITIONS, 0
+                return None
+        if block != self._block:
+            self._load_block(block)
+        self._index += int(np.searchsorted(self._values[self._index:], target))
+        if self._index >= len(self._values):
+            if self.block_lasts is None or self._block + 1 >= len(self.block_lasts):
+                return None
+            self._load_block(self._block + 1)
+        return int(self._values[self._index])
+    def to_array(self) -> np.ndarray:
+        """Decode the whole list"""
+        if self.count == 0:
+            return _EMPTY_POSITIONS
+        start = self.block_offsets[0]
+        return np.cumsum(decode_varbyte(self.data[start:]))
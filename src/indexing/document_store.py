@@ -0,0 +1,272 @@
+import os
+import threading
+import zlib
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from typing import Dict, Hashable, Iterable, Iterator, List, Optional, Set, Tuple, Union
+
+import numpy as np
+
+from src.indexing.index_storage import write_sections, encode_strings, MappedSections
+from src.util.pickle_handling import load_pickle_file
+
+try:
+    import zstandard
+except ImportError:  # zstd is optional, zlib is always available
+    zstandard = None
+
+# File layout: the sections of index_storage.write_sections. Documents are packed in order into blocks of about
+# block_size bytes, each compressed on its own; a lookup decompresses only the block holding the document.
+MAGIC = b"VLRDOCST"
+FORMAT_VERSION = 1
+DEFAULT_BLOCK_SIZE = 1 << 16
+DEFAULT_CACHED_BLOCKS = 16
+ZLIB_CODEC = "zlib"
+ZSTD_CODEC = "zstd"
+# stored length of a missing (None) document
+_MISSING = -1
+
+Document = Union[str, List[str], None]
+
+
+def normalize_doc_id(doc_id: Hashable) -> str:
+    """Documents are keyed by the string form of their id, so 12 and '12' are the same document"""
+    return str(doc_id)
+
+
+def _is_int_id(doc_id: Hashable) -> bool:
+    return isinstance(doc_id, (int, np.integer))
+
+
+def _hash(key: bytes) -> int:
+    return zlib.crc32(key)
+
+
+class DocumentStoreWriter:
+    """Write a document store one document at a time, without holding the uncompressed corpus"""
+    def __init__(self, file_path: str, codec: Optional[str] = None, block_size: int = DEFAULT_BLOCK_SIZE,
+                 tokenized: bool = False):
+        """
+        :param file_path: Store file, replaced atomically on close.
+        :param codec: 'zstd' or 'zlib'. Defaults to zstd when the zstandard package is installed.
+        :param block_size: Uncompressed bytes per block; larger blocks compress better but cost more per lookup.
+        :param tokenized: Documents are token lists rather than texts.
+        """
+        self.codec = codec or (ZSTD_CODEC if zstandard is not None else ZLIB_CODEC)
+        if self.codec == ZSTD_CODEC and zstandard is None:
+            raise ValueError("The zstd codec needs the zstandard package")
+        self.file_path = file_path
+        self.block_size = block_size
+        self.tokenized = tokenized
+        self._compress = zstandard.ZstdCompressor().compress if self.codec == ZSTD_CODEC else zlib.compress
+        self._keys: List[str] = []
+        self._key_is_int: List[bool] = []
+        self._entry_blocks: List[int] = []
+        self._entry_starts: List[int] = []
+        self._entry_lengths: List[int] = []
+        self._blocks: List[bytes] = []
+        self._pending: List[bytes] = []
+        self._pending_size = 0
+    def add(self, doc_id: Hashable, document: Document) -> None:
+        self._keys.append(normalize_doc_id(doc_id))
+        self._key_is_int.append(_is_int_id(doc_id))
+        self._entry_blocks.append(len(self._blocks))
+        self._entry_starts.append(self._pending_size)
+        if document is None:
+            self._entry_lengths.append(_MISSING)
+            return
+        encoded = (" ".join(document) if self.tokenized else document).encode("utf-8")
+        self._entry_lengths.append(len(encoded))
+        self._pending.append(encoded)
+        self._pending_size += len(encoded)
+        if self._pending_size >= self.block_size:
+            self._flush_block()
+    def _flush_block(self) -> None:
+        self._blocks.append(self._compress(b"".join(self._pending)))
+        self._pending, self._pending_size = [], 0
+    def close(self) -> None:
+        if self._pending:
+            self._flush_block()
+        if len(set(self._keys)) != len(self._keys):
+            raise ValueError("Duplicate document ids")
+        block_offsets = np.zeros(len(self._blocks) + 1, dtype=np.int64)
+        np.cumsum([len(block) for block in self._blocks], out=block_offsets[1:])
+        sections = {
+            "slots": _build_slots(self._keys),
+            "entry_blocks": np.array(self._entry_blocks, dtype=np.int32),
+            "entry_starts": np.array(self._entry_starts, dtype=np.int64),
+            "entry_lengths": np.array(self._entry_lengths, dtype=np.int64),
+            "block_offsets": block_offsets,
+            "blocks": np.frombuffer(b"".join(self._blocks), dtype=np.uint8),
+        }
+        sections["key_string_offsets"], sections["key_strings"] = encode_strings(self._keys)
+        if any(self._key_is_int):
+            # int ids come back as ints, as in the corpus they were read from
+            sections["key_is_int"] = np.array(self._key_is_int, dtype=bool).view(np.uint8)
+        header = {"version": FORMAT_VERSION, "codec": self.codec, "tokenized": self.tokenized}
+        write_sections(self.file_path, MAGIC, FORMAT_VERSION, header, sections)
+    def __enter__(self) -> "DocumentStoreWriter":
+        return self
+    def __exit__(self, exc_type, exc, traceback) -> None:
+        if exc_type is None:
+            self.close()
+
+
+def write_document_store(file_path: str, documents: Iterable[Tuple[Hashable, Document]], **kwargs) -> None:
+    """Write (doc id, document) pairs as a document store, see DocumentStoreWriter for the options"""
+    with DocumentStoreWriter(file_path, **kwargs) as writer:
+        for doc_id, document in documents:
+            writer.add(doc_id, document)
+
+
+def _build_slots(keys: List[str]) -> np.ndarray:
+    """Open-addressing hash table from key to entry, probed linearly; -1 marks an empty slot"""
+    num_slots = 1 << max(1, (2 * len(keys) - 1).bit_length())
+    slots = np.full(num_slots, -1, dtype=np.int64)
+    mask = num_slots - 1
+    for entry, key in enumerate(keys):
+        slot = _hash(key.encode("utf-8")) & mask
+        while slots[slot] != -1:
+            slot = (slot + 1) & mask
+        slots[slot] = entry
+    return slots
+
+
+class DocumentStore(MutableMapping):
+    """Documents by id, read from a memory-mapped store file with O(1) lookups.
+
+    Only the blocks holding requested documents are decompressed, and the last ``cached_blocks`` of them are
+    kept, so the corpus never counts against resident memory. Ids are normalized with normalize_doc_id for
+    lookups, and iterated with the type they were written with. Documents added, replaced or deleted after
+    opening are kept in memory until the store is saved.
+    """
+    def __init__(self, file_path: str, cached_blocks: int = DEFAULT_CACHED_BLOCKS):
+        self.file_path = file_path
+        self.mapped = MappedSections(file_path, MAGIC, FORMAT_VERSION, "document store")
+        header = self.mapped.header
+        self.codec = header["codec"]
+        self.tokenized = header["tokenized"]
+        if self.codec == ZSTD_CODEC:
+            if zstandard is None:
+                raise ValueError(f"{file_path} is compressed with zstd, which needs the zstandard package")
+            self._decompress = zstandard.ZstdDecompressor().decompress
+        else:
+            self._decompress = zlib.decompress
+        self.keys_table = self.mapped.string_table("key")
+        # entry -> whether its id is an int, None when every id is a string
+        self.key_is_int = self.mapped.section("key_is_int").view(bool) if "key_is_int" in header["sections"] else None
+        self.slots = self.mapped.section("slots")
+        self.entry_blocks = self.mapped.section("entry_blocks")
+        self.entry_starts = self.mapped.section("entry_starts")
+        self.entry_lengths = self.mapped.section("entry_lengths")
+        self.block_offsets = self.mapped.section("block_offsets")
+        self.blocks = self.mapped.section("blocks")
+        self.cached_blocks = cached_blocks
+        self._block_cache: "OrderedDict[int, bytes]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._changed: Dict[str, Document] = {}
+        self._added_ids: Dict[str, Hashable] = {}  # key -> id as given, of the documents changed since opening
+        self._deleted: Set[str] = set()
+    def _entry(self, key: str) -> Optional[int]:
+        encoded = key.encode("utf-8")
+        mask = len(self.slots) - 1
+        slot = _hash(encoded) & mask
+        while True:
+            entry = int(self.slots[slot])
+            if entry == -1:
+                return None
+            if self.keys_table.encoded(entry) == encoded:
+                return entry
+            slot = (slot + 1) & mask
+    def _block(self, block: int) -> bytes:
+        with self._lock:
+            data = self._block_cache.get(block)
+            if data is not None:
+                self._block_cache.move_to_end(block)
+                return data
+        start, end = int(self.block_offsets[block]), int(self.block_offsets[block + 1])
+        data = self._decompress(self.blocks[start:end].tobytes())
+        with self._lock:
+            self._block_cache[block] = data
+            while len(self._block_cache) > self.cached_blocks:
+                self._block_cache.popitem(last=False)
+        return data
+    def _read(self, entry: int) -> Document:
+        length = int(self.entry_lengths[entry])
+        if length == _MISSING:
+            return None
+        start = int(self.entry_starts[entry])
+        text = self._block(int(self.entry_blocks[entry]))[start:start + length].decode("utf-8")
+        if self.tokenized:
+            return text.split(" ") if text else []
+        return text
+    def __getitem__(self, doc_id: Hashable) -> Document:
+        key = normalize_doc_id(doc_id)
+        if key in self._changed:
+            return self._changed[key]
+        entry = self._entry(key) if key not in self._deleted else None
+        if entry is None:
+            raise KeyError(doc_id)
+        return self._read(entry)
+    def get_many(self, doc_ids: Iterable[Hashable]) -> List[Document]:
+        """Get several documents, None for unknown ids, decompressing every block involved once"""
+        doc_ids = list(doc_ids)
+        results: List[Document] = [None] * len(doc_ids)
+        stored = []
+        for position, doc_id in enumerate(doc_ids):
+            key = normalize_doc_id(doc_id)
+            if key in self._changed:
+                results[position] = self._changed[key]
+            elif key not in self._deleted:
+                entry = self._entry(key)
+                if entry is not None:
+                    stored.append((int(self.entry_blocks[entry]), position, entry))
+        for _, position, entry in sorted(stored):
+            results[position] = self._read(entry)
+        return results
+    def __setitem__(self, doc_id: Hashable, document: Document) -> None:
+        key = normalize_doc_id(doc_id)
+        self._changed[key] = document
+        self._added_ids[key] = doc_id
+        self._deleted.discard(key)
+    def __delitem__(self, doc_id: Hashable) -> None:
+        key = normalize_doc_id(doc_id)
+        if key in self._changed:
+            del self._changed[key]
+            del self._added_ids[key]
+            if self._entry(key) is None:
+                return
+        elif key in self._deleted or self._entry(key) is None:
+            raise KeyError(doc_id)
+        self._deleted.add(key)
+    def __contains__(self, doc_id: object) -> bool:
+        key = normalize_doc_id(doc_id)
+        return key in self._changed or (key not in self._deleted and self._entry(key) is not None)
+    def __iter__(self) -> Iterator[Hashable]:
+        """Iterate over the stored ids in insertion order, then over the ids added since opening"""
+        for entry in range(len(self.keys_table)):
+            key = self.keys_table[entry]
+            if key not in self._deleted:
+                yield int(key) if self.key_is_int is not None and self.key_is_int[entry] else key
+        for key, doc_id in self._added_ids.items():
+            if self._entry(key) is None:
+                yield doc_id
+    def __len__(self) -> int:
+        added = sum(1 for key in self._changed if self._entry(key) is None)
+        return len(self.keys_table) - len(self._deleted) + added
+    def items(self):
+        """Iterate over (id, document) pairs, decompressing every block once"""
+        for key in self:
+            yield key, self[key]
+    def save(self, file_path: Optional[str] = None) -> None:
+        """Write the store with its changes, to its own file by default; this store keeps reading the old one"""
+        write_document_store(file_path or self.file_path, self.items(), codec=self.codec, tokenized=self.tokenized)
+
+
+def open_document_store(file_path: str, legacy_pickle_path: Optional[str] = None,
+                        tokenized: bool = False) -> DocumentStore:
+    """Open a document store, converting it once from the pickled dict of older versions when it is missing"""
+    if not os.path.exists(file_path) and legacy_pickle_path is not None and os.path.exists(legacy_pickle_path):
+        print(f"Converting {legacy_pickle_path} to a document store")
+        write_document_store(file_path, load_pickle_file(legacy_pickle_path).items(), tokenized=tokenized)
+    return DocumentStore(file_path)
@@ -1,18 +1,24 @@
+import base64
+import json
+import logging
 import os
-from typing import Optional, List, Tuple
+from typing import Optional, List, Tuple, Dict, TYPE_CHECKING
 
 from dotenv import load_dotenv
-from elasticsearch import Elasticsearch, helpers
 
+from src.indexing.document_store import DocumentStore, open_document_store
 from src.preprocessing.text_processor import TextProcessor
-from src.util.constant import PROCESSED_INDEX_NAME, NORMAL_INDEX_NAME, RAW_CORPUS_DICT_PATH, PROCESSED_CORPUS_DICT_PATH
-from src.util.pickle_handling import load_pickle_file
+from src.util.constant import PROCESSED_INDEX_NAME, NORMAL_INDEX_NAME, RAW_CORPUS_DICT_PATH, PROCESSED_CORPUS_DICT_PATH, \
+    TOKEN_CACHE_PATH, ES_MSEARCH_BATCH_SIZE, RAW_DOCUMENT_STORE_PATH, PROCESSED_DOCUMENT_STORE_PATH, ES_PIT_KEEP_ALIVE
+
+if TYPE_CHECKING:
+    from elasticsearch import Elasticsearch
 
 load_dotenv()
 class ElasticSearchIndexing:
     def __init__(self):
-        self.es: Optional[Elasticsearch] = None
-        self.processor = TextProcessor()
+        self.es: Optional["Elasticsearch"] = None
+        self.processor = TextProcessor(cache_path=TOKEN_CACHE_PATH)
         self.mapping = {
             "mappings": {
                 "properties": {
@@ -26,11 +32,22 @@ class ElasticSearchIndexing:
                 }
             }
         }
-        self.raw_documents = {}
-        self.processed_documents = {}
-        self._load_processed_documents()
+        # the corpora are only needed for ingestion, so they are loaded on first use
+        self._raw_documents: Optional[DocumentStore] = None
+        self._processed_documents: Optional[DocumentStore] = None
         self._connect_to_client()
+    @property
+    def raw_documents(self) -> DocumentStore:
+        if self._raw_documents is None:
+            self._load_processed_documents()
+        return self._raw_documents
+    @property
+    def processed_documents(self) -> DocumentStore:
+        if self._processed_documents is None:
+            self._load_processed_documents()
+        return self._processed_documents
     def _connect_to_client(self):
+        from elasticsearch import Elasticsearch
         elastic_host = os.getenv("ELASTIC_HOST", "http://localhost:9200")
         self.es = Elasticsearch(elastic_host)
         self._create_index_if_not_exists(PROCESSED_INDEX_NAME)
@@ -40,8 +57,9 @@ class ElasticSearchIndexing:
             self.es.indices.create(index = index_name, body = self.mapping)
     def _load_processed_documents(self):
         try:
-            self.raw_documents = load_pickle_file(RAW_CORPUS_DICT_PATH)
-            self.processed_documents = load_pickle_file(PROCESSED_CORPUS_DICT_PATH)
+            self._raw_documents = open_document_store(RAW_DOCUMENT_STORE_PATH, RAW_CORPUS_DICT_PATH)
+            self._processed_documents = open_document_store(PROCESSED_DOCUMENT_STORE_PATH, PROCESSED_CORPUS_DICT_PATH,
+                                                            tokenized=True)
         except FileNotFoundError as e:
             raise FileNotFoundError(
                 "Processed documents not found. Run process_documents() first."
@@ -65,6 +83,7 @@ class ElasticSearchIndexing:
                 }
             }
     def ingest_to_elasticsearch(self):
+        from elasticsearch import helpers
         success, failed = helpers.bulk(self.es, self.ingest_normal_index(), raise_on_error=False, stats_only=True)
         print(f"{success} documents index in normal index, {failed} failed")
         success, failed = helpers.bulk(self.es, self.ingest_processed_index(), raise_on_error=False, stats_only=True)
@@ -91,3 +110,69 @@ class ElasticSearchIndexing:
             explain=True
         )
         return resp["hits"]["hits"]
+
+    def search_page(self, query: str, page_size: int = 10, cursor: Optional[str] = None,
+                    is_normal_index = True) -> Tuple[List[Dict], Optional[str]]:
+        """
+        Get a page of hits, paging with search_after over a point in time, so every page sees the index as it
+        was at the first one and deep pages cost no more than the first
+        :param query: Search query string, the same for every page.
+        :param page_size: Number of hits per page. Defaults to 10.
+        :param cursor: Cursor returned with the previous page. Defaults to the first page.
+        :param is_normal_index: Search the normal index rather than the processed one.
+        :return: The hits of the page and the cursor of the next one, None on the last page
+        """
+        if not is_normal_index:
+            query = self.processor.process_text_join_for_es(query)
+        if not query:
+            return [], None
+        if cursor is None:
+            index_name = NORMAL_INDEX_NAME if is_normal_index else PROCESSED_INDEX_NAME
+            pit_id = self.es.open_point_in_time(index=index_name, keep_alive=ES_PIT_KEEP_ALIVE)["id"]
+            search_after = None
+        else:
+            state = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+            pit_id, search_after = state["pit"], state["search_after"]
+        body = {
+            "query": {"match": {"content": query}},
+            "pit": {"id": pit_id, "keep_alive": ES_PIT_KEEP_ALIVE},
+            # _shard_doc breaks score ties, so search_after resumes exactly after the last hit
+            "sort": [{"_score": "desc"}, {"_shard_doc": "asc"}],
+            "track_total_hits": False,
+        }
+        if search_after is not None:
+            body["search_after"] = search_after
+        resp = self.es.search(body=body, size=page_size)
+        hits = resp["hits"]["hits"]
+        if len(hits) < page_size:
+            self.es.close_point_in_time(id=resp.get("pit_id", pit_id))
+            return hits, None
+        # the point in time id may change between pages, the latest one must be used
+        state = {"pit": resp.get("pit_id", pit_id), "search_after": hits[-1]["sort"]}
+        return hits, base64.urlsafe_b64encode(json.dumps(state).encode("utf-8")).decode("ascii")
+
+    def search_batch(self, queries: List[Optional[str]], top_n: int = 10, is_normal_index = True) -> List[List[Dict]]:
+        """Search many queries with multi-search requests of ES_MSEARCH_BATCH_SIZE queries each.
+
+        Returns the hits of every query in order; a missing query, or one that failed on the server, has none.
+        """
+        hits: List[List[Dict]] = [[] for _ in queries]
+        positions = [position for position, query in enumerate(queries) if query]
+        texts = [queries[position] for position in positions]
+        if not is_normal_index:
+            texts = [" ".join(tokens) for tokens in self.processor.process_texts(texts)]
+        index_name = NORMAL_INDEX_NAME if is_normal_index else PROCESSED_INDEX_NAME
+        searches = [(position, text) for position, text in zip(positions, texts) if text]
+        for start in range(0, len(searches), ES_MSEARCH_BATCH_SIZE):
+            batch = searches[start:start + ES_MSEARCH_BATCH_SIZE]
+            body = []
+            for _, text in batch:
+                body.append({"index": index_name})
+                body.append({"query": {"match": {"content": text}}, "size": top_n})
+            resp = self.es.msearch(searches=body)
+            for (position, _), response in zip(batch, resp["responses"]):
+                if "error" in response:
+                    logging.warning(f"Search failed for query={queries[position]}: {response['error']}")
+                    continue
+                hits[position] = response["hits"]["hits"]
+        return hits
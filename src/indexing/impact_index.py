@@ -0,0 +1,156 @@
+import json
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from src.indexing.index_segment import IndexSegment
+from src.indexing.index_storage import save_array
+
+IMPACT_BITS = 8
+_ARRAYS = ("postings_doc_ids", "block_offsets", "block_starts", "block_impacts")
+
+
+class ImpactIndex:
+    """Postings with precomputed, quantized scores, sorted by decreasing impact within every term.
+
+    Every (term, doc) score is mapped to an integer impact in 1..2**bits - 1. The postings of a term are
+    cut into blocks of equal impact, sorted by internal doc id inside a block; the blocks of term id ``t``
+    are ``block_offsets[t]:block_offsets[t + 1]``, block ``i`` holding
+    ``postings_doc_ids[block_starts[i]:block_starts[i + 1]]`` with impact ``block_impacts[i]``.
+    """
+    def __init__(self, postings_doc_ids: np.ndarray, block_offsets: np.ndarray, block_starts: np.ndarray,
+                 block_impacts: np.ndarray, scale: float, num_docs: int):
+        self.postings_doc_ids = postings_doc_ids
+        self.block_offsets = block_offsets
+        self.block_starts = block_starts
+        self.block_impacts = block_impacts
+        self.scale = scale  # impact = round(score * scale)
+        self.num_docs = num_docs
+    @classmethod
+    def from_scores(cls, segment: IndexSegment, scores: np.ndarray, num_docs: int,
+                    bits: int = IMPACT_BITS) -> "ImpactIndex":
+        """Quantize one score per posting of ``segment`` (in its order) and lay the postings out by impact"""
+        max_impact = 2 ** bits - 1
+        max_score = float(scores.max()) if len(scores) else 0.0
+        scale = max_impact / max_score if max_score > 0 else 1.0
+        impacts = np.clip(np.rint(scores * scale), 1, max_impact).astype(np.int32)
+        df = segment.doc_frequencies()
+        posting_terms = np.repeat(np.arange(len(df)), df)
+        order = np.lexsort((segment.postings_doc_ids, -impacts, posting_terms))
+        impacts = impacts[order]
+        # posting terms are already in term order, so sorting leaves them unchanged
+        new_block = np.diff(posting_terms) != 0
+        new_block |= np.diff(impacts) != 0
+        block_starts = np.concatenate(([0], np.flatnonzero(new_block) + 1, [len(impacts)])).astype(np.int64)
+        if len(impacts) == 0:
+            block_starts = np.zeros(1, dtype=np.int64)
+        block_offsets = np.zeros(len(df) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(posting_terms[block_starts[:-1]], minlength=len(df)), out=block_offsets[1:])
+        return cls(segment.postings_doc_ids[order], block_offsets, block_starts,
+                   impacts[block_starts[:-1]].astype(np.uint8), scale, num_docs)
+    @property
+    def num_postings(self) -> int:
+        return len(self.postings_doc_ids)
+    def _query_blocks(self, term_weights: List[Tuple[int, int]]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Get (block ids, weighted impacts, query term slot) of every block of the query terms, highest first"""
+        block_ids, slots = [], []
+        for slot, (term_id, _) in enumerate(term_weights):
+            start, end = int(self.block_offsets[term_id]), int(self.block_offsets[term_id + 1])
+            block_ids.append(np.arange(start, end))
+            slots.append(np.full(end - start, slot))
+        block_ids = np.concatenate(block_ids)
+        slots = np.concatenate(slots)
+        weights = np.array([weight for _, weight in term_weights], dtype=np.int64)
+        weighted = self.block_impacts[block_ids].astype(np.int64) * weights[slots]
+        order = np.argsort(-weighted, kind="stable")
+        return block_ids[order], weighted[order], slots[order]
+    def search(self, term_weights: List[Tuple[int, int]], k: int, max_postings: Optional[int] = None,
+               batch_size: int = 4096) -> Tuple[np.ndarray, np.ndarray, int]:
+        """Score-at-a-time top-k over (term id, query weight) pairs.
+
+        Blocks of all query terms are accumulated in decreasing order of weighted impact. Evaluation stops
+        once the top-k set can no longer change: the k-th score beats the (k+1)-th by more than the impacts
+        still unread could add. It also stops after ``max_postings`` postings, for a fixed latency budget.
+        The documents kept are then rescored exactly by looking them up in the blocks left unread, so they are
+        ranked by their full quantized score, ties broken by internal id. Which of the documents tied with the
+        k-th one are kept is left to the partial sort.
+        Returns the top-k internal ids, their summed weighted impacts and the number of postings read.
+        """
+        if not term_weights or k <= 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), 0
+        block_ids, weighted, slots = self._query_blocks(term_weights)
+        # unread bound: the sum over query terms of the weighted impact of their next block. A term's blocks
+        # come in decreasing impact order, so reading one lowers the bound to the term's next block
+        by_term = np.lexsort((np.arange(len(slots)), slots))
+        following = np.zeros(len(slots), dtype=np.int64)
+        same_term = slots[by_term[1:]] == slots[by_term[:-1]]
+        following[by_term[:-1][same_term]] = weighted[by_term[1:][same_term]]
+        first = np.zeros(len(term_weights), dtype=np.int64)
+        np.maximum.at(first, slots, weighted)
+        remaining_after = int(first.sum()) - np.cumsum(weighted - following)
+        starts = self.block_starts[block_ids]
+        lengths = self.block_starts[block_ids + 1] - starts
+        # whole blocks are grouped into batches of about batch_size postings, so the per-step overhead is
+        # paid per few thousand postings rather than per block
+        posting_ends = np.cumsum(lengths)
+        batch_ends = np.unique(np.searchsorted(posting_ends, np.arange(batch_size, posting_ends[-1] + batch_size,
+                                                                      batch_size), side="left") + 1)
+        batch_ends = np.minimum(batch_ends, len(block_ids))
+        accumulator = np.zeros(self.num_docs, dtype=np.int64)
+        last_seen = np.zeros(self.num_docs, dtype=np.int64)
+        top = np.zeros(0, dtype=np.int64)
+        read = 0
+        batch_start = 0
+        for batch_end in batch_ends.tolist():
+            if batch_end <= batch_start:
+                continue
+            batch_lengths = lengths[batch_start:batch_end]
+            offsets = np.cumsum(batch_lengths) - batch_lengths
+            index = np.repeat(starts[batch_start:batch_end] - offsets, batch_lengths) + np.arange(batch_lengths.sum())
+            docs = self.postings_doc_ids[index]
+            # a document appears at most once per term, but a batch may hold several terms
+            np.add.at(accumulator, docs, np.repeat(weighted[batch_start:batch_end], batch_lengths))
+            read += len(docs)
+            remaining = int(remaining_after[batch_end - 1])
+            batch_start = batch_end
+            # keep one copy of every document of the batch, then re-select the top k + 1 among them and the
+            # previous top: no other document changed
+            positions = np.arange(len(docs))
+            last_seen[docs] = positions
+            docs = docs[last_seen[docs] == positions]
+            last_seen[docs] = -1
+            pool = np.concatenate([docs, top[last_seen[top] != -1]])
+            last_seen[docs] = 0
+            top = pool[np.argpartition(-accumulator[pool], k)[:k + 1]] if len(pool) > k + 1 else pool
+            if max_postings is not None and read >= max_postings:
+                break
+            if len(top) > k:
+                ranked = np.sort(accumulator[top])[::-1]
+                if ranked[k - 1] > ranked[k] + remaining:
+                    break
+        scores = accumulator[top] + self._unread_impacts(top, block_ids[batch_start:], weighted[batch_start:])
+        order = np.lexsort((top, -scores))[:k]
+        return top[order], scores[order], read
+    def _unread_impacts(self, doc_ids: np.ndarray, block_ids: np.ndarray, weighted: np.ndarray) -> np.ndarray:
+        """Sum the weighted impacts of the blocks holding each of a few documents, by binary search in every block"""
+        impacts = np.zeros(len(doc_ids), dtype=np.int64)
+        for block_id, weight in zip(block_ids.tolist(), weighted.tolist()):
+            block = self.postings_doc_ids[self.block_starts[block_id]:self.block_starts[block_id + 1]]
+            found = np.minimum(np.searchsorted(block, doc_ids), len(block) - 1)
+            impacts[block[found] == doc_ids] += weight
+        return impacts
+    def save(self, directory: str, meta: Dict) -> None:
+        path = Path(directory)
+        path.mkdir(parents=True, exist_ok=True)
+        for name in _ARRAYS:
+            save_array(path / f"{name}.npy", getattr(self, name))
+        meta = dict(meta, scale=self.scale, num_docs=self.num_docs)
+        (path / "meta.json").write_text(json.dumps(meta), encoding="utf-8")
+    @classmethod
+    def load(cls, directory: str) -> Tuple["ImpactIndex", Dict]:
+        """Memory-map a saved impact index and return it with the metadata it was saved with"""
+        path = Path(directory)
+        meta = json.loads((path / "meta.json").read_text(encoding="utf-8"))
+        arrays = [np.load(path / f"{name}.npy", mmap_mode="r") for name in _ARRAYS]
+        return cls(*arrays, meta["scale"], meta["num_docs"]), meta
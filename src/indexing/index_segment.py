@@ -0,0 +1,147 @@
+from array import array
+from collections import defaultdict
+from typing import Dict, List, Tuple, Iterable, Optional, Sequence
+
+import numpy as np
+
+from src.indexing.compression import encode_position_lists, PositionReader
+
+EMPTY_POSTINGS = np.zeros(0, dtype=np.int32)
+
+
+def new_term_postings() -> Dict[str, Tuple[array, array, array]]:
+    """term -> (internal doc ids, term frequencies, positions), grown doc by doc so ids stay sorted"""
+    return defaultdict(lambda: (array("i"), array("i"), array("i")))
+
+
+def add_to_term_postings(term_postings: Dict[str, Tuple[array, array, array]], internal_id: int,
+                         terms: List[str]) -> int:
+    """Append the postings of one document and return how many postings were added"""
+    term_positions = defaultdict(list)
+    for pos, term in enumerate(terms):
+        term_positions[term].append(pos)
+    for term, positions in term_positions.items():
+        ids, tfs, term_pos = term_postings[term]
+        ids.append(internal_id)
+        tfs.append(len(positions))
+        term_pos.extend(positions)
+    return len(term_positions)
+
+
+class IndexSegment:
+    """Immutable block of postings in CSR layout, covering the internal doc ids in ``doc_range``.
+
+    The postings of term id ``t`` are ``postings_doc_ids[term_offsets[t]:term_offsets[t + 1]]`` (sorted by
+    internal doc id) with the matching ``postings_tfs``. The positions of posting ``p`` are compressed in
+    ``positions[position_offsets[p]:position_offsets[p + 1]]`` and only decoded on demand.
+    """
+    def __init__(self, terms: Sequence[str], term_ids, term_offsets: np.ndarray, postings_doc_ids: np.ndarray,
+                 postings_tfs: np.ndarray, position_offsets: np.ndarray, positions: np.ndarray,
+                 doc_range: Tuple[int, int]):
+        self.terms = terms  # term id -> term
+        self.term_ids = term_ids  # term -> term id, anything with a dict-like get()
+        self.term_offsets = term_offsets
+        self.postings_doc_ids = postings_doc_ids
+        self.postings_tfs = postings_tfs
+        self.position_offsets = position_offsets
+        self.positions = positions
+        self.doc_range = doc_range
+    @classmethod
+    def from_documents(cls, documents: Iterable[List[str]], first_doc_id: int = 0) -> "IndexSegment":
+        term_postings = new_term_postings()
+        end_doc_id = first_doc_id
+        for internal_id, terms in enumerate(documents, first_doc_id):
+            end_doc_id = internal_id + 1
+            add_to_term_postings(term_postings, internal_id, terms)
+        return cls.from_term_postings(term_postings, (first_doc_id, end_doc_id))
+    @classmethod
+    def from_term_postings(cls, term_postings: Dict[str, Tuple[array, array, array]],
+                           doc_range: Tuple[int, int]) -> "IndexSegment":
+        """Lay out per-term growable arrays as contiguous CSR blocks ordered by term"""
+        terms = sorted(term_postings)
+        blocks = [term_postings[term] for term in terms]
+        term_offsets = np.zeros(len(blocks) + 1, dtype=np.int64)
+        np.cumsum([len(ids) for ids, _, _ in blocks], out=term_offsets[1:])
+        postings_tfs = _concat(tfs for _, tfs, _ in blocks)
+        positions, position_offsets = encode_position_lists(_concat(pos for _, _, pos in blocks), postings_tfs)
+        return cls(
+            terms, {term: term_id for term_id, term in enumerate(terms)}, term_offsets,
+            _concat(ids for ids, _, _ in blocks), postings_tfs, position_offsets, positions, doc_range,
+        )
+    @property
+    def num_postings(self) -> int:
+        return len(self.postings_doc_ids)
+    def doc_frequencies(self) -> np.ndarray:
+        """Get the number of postings of every term id"""
+        return np.diff(self.term_offsets)
+    def term_range(self, term: str) -> Tuple[int, int]:
+        term_id = self.term_ids.get(term)
+        if term_id is None:
+            return 0, 0
+        return int(self.term_offsets[term_id]), int(self.term_offsets[term_id + 1])
+    def get_postings(self, term: str) -> Tuple[np.ndarray, np.ndarray]:
+        start, end = self.term_range(term)
+        if start == end:
+            return EMPTY_POSTINGS, EMPTY_POSTINGS
+        return self.postings_doc_ids[start:end], self.postings_tfs[start:end]
+    def find_posting(self, term: str, internal_id: int) -> int:
+        """Get the posting offset of (term, internal_id), or -1 if the term does not occur in the document"""
+        if not self.doc_range[0] <= internal_id < self.doc_range[1]:
+            return -1
+        start, end = self.term_range(term)
+        offset = start + int(np.searchsorted(self.postings_doc_ids[start:end], internal_id))
+        if offset < end and self.postings_doc_ids[offset] == internal_id:
+            return offset
+        return -1
+    def position_reader(self, offset: int) -> PositionReader:
+        data = self.positions[self.position_offsets[offset]:self.position_offsets[offset + 1]]
+        return PositionReader(data, int(self.postings_tfs[offset]))
+    def get_positions(self, offset: int) -> np.ndarray:
+        return self.position_reader(offset).to_array()
+
+
+def merge_segments(segments: List[IndexSegment], deleted: Optional[np.ndarray] = None) -> IndexSegment:
+    """Merge segments with ascending, adjacent doc ranges into one, dropping postings of deleted documents"""
+    terms = sorted(set().union(*({segment.terms[i] for i in range(len(segment.terms))} for segment in segments)))
+    term_ids = {term: term_id for term_id, term in enumerate(terms)}
+    posting_terms, doc_ids, tfs, position_sizes, positions = [], [], [], [], []
+    for segment in segments:
+        segment_terms = np.array([term_ids[segment.terms[i]] for i in range(len(segment.terms))], dtype=np.int64)
+        keep = slice(None) if deleted is None else ~deleted[segment.postings_doc_ids]
+        posting_terms.append(np.repeat(segment_terms, segment.doc_frequencies())[keep])
+        doc_ids.append(segment.postings_doc_ids[keep])
+        tfs.append(segment.postings_tfs[keep])
+        # every compressed position list is self-contained, so lists are moved without decoding
+        position_sizes.append(np.diff(segment.position_offsets)[keep])
+        positions.append(_gather_ranges(segment.positions, segment.position_offsets[:-1][keep], position_sizes[-1]))
+    posting_terms = np.concatenate(posting_terms)
+    # segments are concatenated in doc id order, so a stable sort by term keeps each term's doc ids sorted
+    order = np.argsort(posting_terms, kind="stable")
+    position_sizes = np.concatenate(position_sizes)
+    position_offsets = np.zeros(len(position_sizes) + 1, dtype=np.int64)
+    np.cumsum(position_sizes, out=position_offsets[1:])
+    merged_positions = _gather_ranges(np.concatenate(positions), position_offsets[:-1][order], position_sizes[order])
+    merged_tfs = np.concatenate(tfs)[order]
+    np.cumsum(position_sizes[order], out=position_offsets[1:])
+    term_offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(posting_terms, minlength=len(terms)), out=term_offsets[1:])
+    return IndexSegment(
+        terms, term_ids, term_offsets, np.concatenate(doc_ids)[order], merged_tfs,
+        position_offsets, merged_positions, (segments[0].doc_range[0], segments[-1].doc_range[1]),
+    )
+
+
+def _gather_ranges(values: np.ndarray, starts: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+    """Concatenate ``values[start:start + length]`` for every (start, length) pair"""
+    total = int(lengths.sum())
+    if total == 0:
+        return np.zeros(0, dtype=values.dtype)
+    range_starts = np.zeros(len(lengths), dtype=np.int64)
+    np.cumsum(lengths[:-1], out=range_starts[1:])
+    index = np.repeat(starts - range_starts, lengths) + np.arange(total)
+    return values[index]
+
+
+def _concat(blocks: Iterable[array]) -> np.ndarray:
+    arrays = [np.frombuffer(block, dtype=np.int32) for block in blocks if len(block)]
+    return np.concatenate(arrays) if arrays else np.zeros(0, dtype=np.int32)
@@ -0,0 +1,205 @@
+import json
+import mmap
+import os
+import struct
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from src.indexing.index_segment import IndexSegment
+from src.indexing.inverted_index import InvertedIndex
+
+# File layout: MAGIC | version (u32) | header length (u32) | JSON header | 8-byte aligned sections.
+# The JSON header describes every section (offset, dtype, length) plus the collection statistics,
+# so a reader needs nothing but the file itself.
+MAGIC = b"VLRINDEX"
+FORMAT_VERSION = 3
+_PREAMBLE = struct.Struct("<8sII")
+_ALIGNMENT = 8
+
+
+class MappedStringTable:
+    """UTF-8 strings read straight from a memory map.
+
+    Strings are decoded only when touched. For sorted tables ``get`` binary-searches the encoded
+    bytes, which sort in the same order as Python strings.
+    """
+    def __init__(self, offsets: np.ndarray, data: memoryview):
+        self.offsets = offsets
+        self.data = data
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+    def encoded(self, i: int) -> bytes:
+        return bytes(self.data[self.offsets[i]:self.offsets[i + 1]])
+    def __getitem__(self, i: int) -> str:
+        return self.encoded(i).decode("utf-8")
+    def __contains__(self, value: str) -> bool:
+        return self.get(value) is not None
+    def get(self, value: str, default: Optional[int] = None) -> Optional[int]:
+        """Get the id of a string, or ``default`` if it is not in the table"""
+        target = value.encode("utf-8")
+        lo, hi = 0, len(self)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.encoded(mid) < target:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(self) and self.encoded(lo) == target:
+            return lo
+        return default
+
+
+class MappedDocIdTable(Sequence):
+    """Internal doc id -> external cid, backed by an int64 section or a string table.
+
+    When cids mix ints and strings, ``is_int`` flags the strings of the table that are the text of an int cid.
+    """
+    def __init__(self, values, is_int: Optional[np.ndarray] = None):
+        self.values = values
+        self.is_int = is_int
+    def __len__(self) -> int:
+        return len(self.values)
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        value = self.values[i]
+        if self.is_int is not None and self.is_int[i]:
+            return int(value)
+        return value.item() if isinstance(value, np.generic) else value
+
+
+def encode_strings(values: List[str]):
+    encoded = [value.encode("utf-8") for value in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(value) for value in encoded], out=offsets[1:])
+    return offsets, np.frombuffer(b"".join(encoded), dtype=np.uint8)
+
+
+def save_index(file_path: str, index: InvertedIndex) -> None:
+    """Write the live postings of all segments as one segment, keeping tombstones of deleted documents"""
+    index.wait_for_merges()
+    segment = index.merged_segment()
+    sections: Dict[str, np.ndarray] = {
+        "term_offsets": segment.term_offsets,
+        "postings_doc_ids": segment.postings_doc_ids,
+        "postings_tfs": segment.postings_tfs,
+        "position_offsets": segment.position_offsets,
+        "positions": segment.positions,
+        "doc_lengths": index.doc_lengths,
+        "deleted": index.deleted.view(np.uint8),
+    }
+    terms = [segment.terms[i] for i in range(len(segment.terms))]
+    sections["term_string_offsets"], sections["term_strings"] = encode_strings(terms)
+    doc_ids = [index.doc_ids[i] for i in range(len(index.doc_ids))]
+    is_int = np.array([isinstance(cid, (int, np.integer)) for cid in doc_ids], dtype=bool)
+    if is_int.all():
+        doc_id_type = "int"
+        sections["doc_ids"] = np.asarray(doc_ids, dtype=np.int64)
+    else:
+        # cids mixing ints and strings keep their type, so lookups by the original cids still hit once reloaded
+        doc_id_type = "mixed" if is_int.any() else "str"
+        sections["doc_id_string_offsets"], sections["doc_id_strings"] = encode_strings([str(cid) for cid in doc_ids])
+        if is_int.any():
+            sections["doc_id_is_int"] = is_int.view(np.uint8)
+
+    header = {
+        "version": FORMAT_VERSION,
+        "total_docs": index.total_docs,
+        "avg_doc_length": index.avg_doc_length,
+        "total_length": index.total_length,
+        "num_deleted": index.num_deleted,
+        "doc_id_type": doc_id_type,
+    }
+    write_sections(file_path, MAGIC, FORMAT_VERSION, header, sections)
+
+
+def write_sections(file_path: str, magic: bytes, version: int, header: Dict, sections: Dict[str, np.ndarray]) -> None:
+    """Write arrays as the aligned sections of a file described by its JSON header, replacing the file atomically"""
+    header = dict(header, sections={})
+    # offsets depend on the header size, so lay sections out until the header length is stable
+    header_bytes = b""
+    while True:
+        offset = _align(_PREAMBLE.size + len(header_bytes))
+        for name, values in sections.items():
+            header["sections"][name] = {"offset": offset, "dtype": values.dtype.str, "length": len(values)}
+            offset = _align(offset + values.nbytes)
+        encoded, previous_length = json.dumps(header).encode("utf-8"), len(header_bytes)
+        header_bytes = encoded
+        if len(encoded) == previous_length:
+            break
+
+    path = Path(file_path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # write next to the target and swap it in, so processes mapping the old file keep a consistent view
+    tmp_path = path.with_name(path.name + ".tmp")
+    with tmp_path.open("wb") as file:
+        file.write(_PREAMBLE.pack(magic, version, len(header_bytes)))
+        file.write(header_bytes)
+        for name, values in sections.items():
+            file.write(b"\0" * (header["sections"][name]["offset"] - file.tell()))
+            file.write(np.ascontiguousarray(values).tobytes())
+    os.replace(tmp_path, path)
+
+
+class MappedSections:
+    """The header and sections of a file written by write_sections, as zero-copy views of a memory map"""
+    def __init__(self, file_path: str, magic: bytes, version: int, kind: str):
+        with open(file_path, "rb") as file:
+            self.buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        file_magic, file_version, header_length = _PREAMBLE.unpack_from(self.buffer, 0)
+        if file_magic != magic:
+            raise ValueError(f"{file_path} is not a valid {kind} file")
+        if file_version != version:
+            raise ValueError(f"Unsupported {kind} format version {file_version}, expected {version}. Rebuild the {kind}.")
+        self.header = json.loads(self.buffer[_PREAMBLE.size:_PREAMBLE.size + header_length])
+    def section(self, name: str) -> np.ndarray:
+        spec = self.header["sections"][name]
+        return np.frombuffer(self.buffer, dtype=np.dtype(spec["dtype"]), count=spec["length"], offset=spec["offset"])
+    def string_table(self, prefix: str) -> MappedStringTable:
+        spec = self.header["sections"][f"{prefix}_strings"]
+        data = memoryview(self.buffer)[spec["offset"]:spec["offset"] + spec["length"]]
+        return MappedStringTable(self.section(f"{prefix}_string_offsets"), data)
+
+
+def load_index(file_path: str) -> InvertedIndex:
+    """Open an index file without reading it: every array is a zero-copy view of a shared memory map"""
+    mapped = MappedSections(file_path, MAGIC, FORMAT_VERSION, "index")
+    header, section, string_table = mapped.header, mapped.section, mapped.string_table
+
+    terms = string_table("term")
+    doc_lengths = section("doc_lengths")
+    segment = IndexSegment(
+        terms, terms, section("term_offsets"), section("postings_doc_ids"), section("postings_tfs"),
+        section("position_offsets"), section("positions"), (0, len(doc_lengths)),
+    )
+    index = InvertedIndex()
+    index.segments = [segment]
+    if header["doc_id_type"] == "int":
+        index.doc_ids = MappedDocIdTable(section("doc_ids"))
+    elif header["doc_id_type"] == "mixed":
+        index.doc_ids = MappedDocIdTable(string_table("doc_id"), section("doc_id_is_int").view(bool))
+    else:
+        index.doc_ids = MappedDocIdTable(string_table("doc_id"))
+    index.doc_lengths = doc_lengths
+    index.deleted = section("deleted").view(bool)
+    index.total_docs = header["total_docs"]
+    index.avg_doc_length = header["avg_doc_length"]
+    index.total_length = header["total_length"]
+    index.num_deleted = header["num_deleted"]
+    index._doc_id_map = None
+    index.storage = mapped.buffer
+    return index
+
+
+def save_array(file_path: Path, values: np.ndarray) -> None:
+    """np.save through a temporary file, so processes memory-mapping the previous array keep a consistent view"""
+    tmp_path = file_path.with_name(file_path.name + ".tmp")
+    with tmp_path.open("wb") as file:
+        np.save(file, values)
+    os.replace(tmp_path, file_path)
+
+
+def _align(offset: int) -> int:
+    return (offset + _ALIGNMENT - 1) // _ALIGNMENT * _ALIGNMENT
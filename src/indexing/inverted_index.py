@@ -1,46 +1,243 @@
-from collections import defaultdict, Counter
-from typing import Dict, List, Set
+import threading
+from typing import Dict, List, Set, Tuple, Hashable, Optional, Iterable, TYPE_CHECKING
+
+import numpy as np
+
+from src.indexing.compression import PositionReader
+from src.indexing.index_segment import IndexSegment, EMPTY_POSTINGS, merge_segments
+from src.indexing.merge_policy import TieredMergePolicy
+from src.indexing.spimi import build_segment_external, DEFAULT_MEMORY_BUDGET
+
+if TYPE_CHECKING:
+    from src.indexing.collection_stats import CollectionStats
 
 
 class InvertedIndex:
-    def __init__(self):
-        self.index = defaultdict(list)
-        self.doc_lengths = {}
-        self.doc_terms = defaultdict(Counter)
-        self.term_doc_freq = {}  # key: term, value: number of docs containing term
-        self.term_docs = {}  # term -> set of doc_ids
+    """Positional inverted index made of immutable CSR segments.
+
+    Documents get dense internal ids in insertion order and every segment covers a contiguous range of
+    them. Deleted documents are tombstoned in ``deleted`` and filtered out at read time until a merge
+    drops their postings, so collection statistics always describe the live documents only.
+    """
+    def __init__(self, merge_policy: Optional[TieredMergePolicy] = None):
+        self.segments: List[IndexSegment] = []
+        self.doc_ids: List[Hashable] = []  # internal doc id -> external cid
+        self._doc_id_map: Optional[Dict[Hashable, int]] = {}  # external cid -> internal doc id of live documents
+        self.doc_lengths = np.zeros(0, dtype=np.int32)  # internal doc id -> number of terms
+        self.deleted = np.zeros(0, dtype=bool)  # internal doc id -> tombstone
         self.total_docs = 0
         self.avg_doc_length = 0
+        self.total_length = 0
+        self.num_deleted = 0
+        self.version = 0  # bumped on every change of the indexed content
+        self.storage = None  # memory map backing the arrays when the index is loaded from disk
+        # statistics of the whole collection when this index holds one shard of it, see set_collection_stats()
+        self.collection_stats: Optional["CollectionStats"] = None
+        self.merge_policy = merge_policy or TieredMergePolicy()
+        self._lock = threading.RLock()
+        self._merge_thread: Optional[threading.Thread] = None
+        self._merged: Optional[Tuple[int, IndexSegment]] = None
+    @property
+    def doc_id_map(self) -> Dict[Hashable, int]:
+        if self._doc_id_map is None:
+            self._doc_id_map = {
+                cid: internal_id
+                for internal_id, (cid, deleted) in enumerate(zip(self.doc_ids, self.deleted.tolist()))
+                if not deleted
+            }
+        return self._doc_id_map
     def build(self, documents: Dict[str, List[str]]) -> None:
-        self.index = defaultdict(list)
-        self.doc_lengths = {}
-        self.doc_terms = defaultdict(Counter)
-        self.term_doc_freq = {}
-        self.term_docs = {}
-        self.total_docs = len(documents)
-        total_length = 0
-        term_docs = defaultdict(set)  # term -> set of doc_ids
-        for cid, terms in documents.items():
-            doc_length = len(terms)
-            self.doc_lengths[cid] = doc_length
-            total_length += doc_length
-
-            term_counts = Counter(terms)
-            self.doc_terms[cid] = term_counts
+        doc_lengths = np.array([len(terms) for terms in documents.values()], dtype=np.int32)
+        self._reset(IndexSegment.from_documents(documents.values()), list(documents), doc_lengths)
+    def build_external(self, documents: Iterable[Tuple[Hashable, List[str]]],
+                       memory_budget: int = DEFAULT_MEMORY_BUDGET, tmp_dir: Optional[str] = None) -> None:
+        """Build from a stream of (cid, terms) without holding the corpus in memory.
 
-            # build inverted index with positions
-            for pos, term in enumerate(terms):
-                self.index[term].append((cid, pos))
-                term_docs[term].add(cid)
-        self.avg_doc_length = total_length / self.total_docs if self.total_docs > 0 else 0
-        self.term_docs = dict(term_docs)
-        self.term_doc_freq = {term: len(docs) for term, docs in self.term_docs.items()}
+        Partial indexes are spilled to sorted runs under ``tmp_dir`` whenever ``memory_budget`` bytes of
+        postings accumulate, then merged. The result is identical to ``build``.
+        """
+        self._reset(*build_segment_external(documents, memory_budget, tmp_dir))
+    def _reset(self, segment: IndexSegment, doc_ids: List[Hashable], doc_lengths: np.ndarray) -> None:
+        self.wait_for_merges()
+        with self._lock:
+            self.segments = [segment]
+            self.doc_ids = doc_ids
+            self._doc_id_map = None
+            self.doc_lengths = doc_lengths
+            self.deleted = np.zeros(len(doc_ids), dtype=bool)
+            self.total_length = int(doc_lengths.sum(dtype=np.int64))
+            self.num_deleted = 0
+            self._update_statistics()
+    def _update_statistics(self) -> None:
+        self.total_docs = len(self.doc_ids) - self.num_deleted
+        self.avg_doc_length = self.total_length / self.total_docs if self.total_docs > 0 else 0
+        self.version += 1
+    def add_document(self, doc_id: Hashable, terms: List[str]) -> None:
+        self.add_documents({doc_id: terms})
+    def add_documents(self, documents: Dict[Hashable, List[str]]) -> None:
+        """Index new documents as one new immutable segment"""
+        with self._lock:
+            self._add_documents(documents)
+        self._maybe_merge()
+    def _add_documents(self, documents: Dict[Hashable, List[str]]) -> None:
+        already_indexed = [cid for cid in documents if cid in self.doc_id_map]
+        if already_indexed:
+            raise ValueError(f"Documents already indexed, use update_document() instead: {already_indexed}")
+        first_doc_id = len(self.doc_ids)
+        lengths = np.array([len(terms) for terms in documents.values()], dtype=np.int32)
+        segment = IndexSegment.from_documents(documents.values(), first_doc_id)
+        if not isinstance(self.doc_ids, list):
+            self.doc_ids = list(self.doc_ids)  # materialize the memory-mapped cid table before growing it
+        self.doc_ids.extend(documents)
+        self.doc_lengths = np.concatenate([self.doc_lengths, lengths])
+        self.deleted = np.concatenate([self.deleted, np.zeros(len(lengths), dtype=bool)])
+        for internal_id, cid in enumerate(documents, first_doc_id):
+            self.doc_id_map[cid] = internal_id
+        self.segments = self.segments + [segment]
+        self.total_length += int(lengths.sum(dtype=np.int64))
+        self._update_statistics()
+    def delete_document(self, doc_id: Hashable) -> None:
+        with self._lock:
+            self._delete_document(doc_id)
+    def _delete_document(self, doc_id: Hashable) -> None:
+        internal_id = self.doc_id_map.pop(doc_id, None)
+        if internal_id is None:
+            raise KeyError(f"Document {doc_id} is not indexed")
+        deleted = self.deleted.copy()  # the array may be a read-only view of the index file
+        deleted[internal_id] = True
+        self.deleted = deleted
+        self.num_deleted += 1
+        self.total_length -= int(self.doc_lengths[internal_id])
+        self._update_statistics()
+    def update_document(self, doc_id: Hashable, terms: List[str]) -> None:
+        """Replace a document: its old version is tombstoned and the new one goes into a new segment"""
+        with self._lock:
+            self._delete_document(doc_id)
+            self._add_documents({doc_id: terms})
+        self._maybe_merge()
+    def _maybe_merge(self) -> None:
+        with self._lock:
+            if self._merge_thread is not None:
+                return
+            window = self.merge_policy.find_merge(self.segments)
+            if window is None:
+                return
+            thread = threading.Thread(target=self._merge, args=window, daemon=True)
+            thread.start()
+            self._merge_thread = thread
+    def _merge(self, start: int, end: int) -> None:
+        try:
+            segments = self.segments[start:end]
+            merged = merge_segments(segments, self.deleted)
+            with self._lock:
+                # segments are only removed by merges and new ones are appended, so the window is unchanged
+                self.segments = self.segments[:start] + [merged] + self.segments[end:]
+        finally:
+            with self._lock:
+                # schedule the follow-up merge before releasing the lock, so waiters never see a gap
+                self._merge_thread = None
+                self._maybe_merge()
+    def wait_for_merges(self) -> None:
+        """Block until no background merge is running"""
+        while True:
+            with self._lock:
+                thread = self._merge_thread
+            if thread is None or thread is threading.current_thread():
+                return
+            thread.join()
+    def force_merge(self) -> None:
+        """Compact all segments into one and drop the postings of deleted documents"""
+        self.wait_for_merges()
+        with self._lock:
+            if len(self.segments) > 1 or self.num_deleted:
+                self.segments = [self.merged_segment()]
+    def merged_segment(self) -> IndexSegment:
+        """Get all live postings as a single segment, for passes over the whole index"""
+        segments = self.segments
+        if len(segments) == 1 and not self.num_deleted:
+            return segments[0]
+        if not segments:
+            return IndexSegment.from_documents([])
+        merged = self._merged
+        if merged is None or merged[0] != self.version:
+            merged = (self.version, merge_segments(segments, self.deleted if self.num_deleted else None))
+            self._merged = merged
+        return merged[1]
+    def _find_posting(self, term: str, doc_id) -> Tuple[Optional[IndexSegment], int]:
+        internal_id = self.doc_id_map.get(doc_id)
+        if internal_id is None:
+            return None, -1
+        for segment in self.segments:
+            offset = segment.find_posting(term, internal_id)
+            if offset >= 0:
+                return segment, offset
+        return None, -1
+    def get_postings(self, term: str) -> Tuple[np.ndarray, np.ndarray]:
+        """Get (internal doc ids, term frequencies) of a term in live documents, sorted by internal doc id"""
+        postings = [segment.get_postings(term) for segment in self.segments]
+        postings = [(doc_ids, tfs) for doc_ids, tfs in postings if len(doc_ids)]
+        if not postings:
+            return EMPTY_POSTINGS, EMPTY_POSTINGS
+        if len(postings) == 1:
+            doc_ids, tfs = postings[0]
+        else:
+            doc_ids = np.concatenate([doc_ids for doc_ids, _ in postings])
+            tfs = np.concatenate([tfs for _, tfs in postings])
+        if self.num_deleted:
+            live = ~self.deleted[doc_ids]
+            doc_ids, tfs = doc_ids[live], tfs[live]
+        return doc_ids, tfs
+    def get_positions(self, term: str, doc_id) -> np.ndarray:
+        """Get the positions of a term in a document"""
+        segment, offset = self._find_posting(term, doc_id)
+        if segment is None:
+            return EMPTY_POSTINGS
+        return segment.get_positions(offset)
+    def position_reader(self, term: str, internal_id: int) -> PositionReader:
+        """Get a lazy reader over the positions of a term in a document, by internal doc id"""
+        for segment in self.segments:
+            offset = segment.find_posting(term, internal_id)
+            if offset >= 0:
+                return segment.position_reader(offset)
+        return PositionReader(EMPTY_POSTINGS, 0)
+    def get_all_docs(self) -> Set[str]:
+        """Get the ids of all live documents"""
+        return set(self.doc_id_map)
     def get_docs_contain_term(self, term: str) -> Set[str]:
         """Get document ids containing the given term"""
-        return self.term_docs.get(term, set())
+        doc_ids, _ = self.get_postings(term)
+        return {self.doc_ids[internal_id] for internal_id in doc_ids.tolist()}
     def get_term_frequency(self, term: str, doc_id: str) -> int:
         """Get frequency of term (TF) in a document"""
-        return self.doc_terms[doc_id].get(term, 0)
+        segment, offset = self._find_posting(term, doc_id)
+        return int(segment.postings_tfs[offset]) if segment is not None else 0
     def get_doc_frequency(self, term: str) -> int:
         """Get the number of documents containing the given term (DF)"""
-        return self.term_doc_freq.get(term, 0)
+        if self.num_deleted:
+            return len(self.get_postings(term)[0])
+        return sum(end - start for start, end in (segment.term_range(term) for segment in self.segments))
+    def set_collection_stats(self, stats: Optional["CollectionStats"]) -> None:
+        """Score as one shard of a collection: idf and length normalization use the statistics of the whole
+        collection, so scores are those of an index of all of it. None goes back to the statistics of this index."""
+        with self._lock:
+            self.collection_stats = stats
+            self.version += 1
+    @property
+    def collection_total_docs(self) -> int:
+        return self.collection_stats.total_docs if self.collection_stats is not None else self.total_docs
+    @property
+    def collection_avg_doc_length(self) -> float:
+        return self.collection_stats.avg_doc_length if self.collection_stats is not None else self.avg_doc_length
+    def collection_doc_frequency(self, term: str) -> int:
+        """Get the DF of a term in the whole collection, this index unless it holds a shard of it"""
+        if self.collection_stats is not None:
+            return self.collection_stats.doc_frequency(term)
+        return self.get_doc_frequency(term)
+    def collection_doc_frequencies(self, segment: IndexSegment) -> np.ndarray:
+        """Get the DF of every term id of a segment of this index in the whole collection"""
+        if self.collection_stats is not None:
+            return self.collection_stats.lookup([segment.terms[i] for i in range(len(segment.terms))])
+        return segment.doc_frequencies()
+    def get_doc_length(self, doc_id: str) -> int:
+        """Get the number of terms in a document"""
+        return int(self.doc_lengths[self.doc_id_map[doc_id]])
@@ -0,0 +1,83 @@
+from pathlib import Path
+from typing import Tuple
+
+import numpy as np
+
+from src.indexing.index_storage import save_array
+from src.model.model import top_k
+
+DEFAULT_KMEANS_ITERATIONS = 10
+# k-means is trained on a sample of this many vectors per list, which is plenty to place the centroids
+_TRAINING_VECTORS_PER_LIST = 64
+# vectors are assigned to their nearest centroid in chunks of this many rows
+_ASSIGN_CHUNK = 1 << 14
+_ARRAYS = ("centroids", "list_offsets", "list_ids")
+
+
+class IVFIndex:
+    """Inverted-file approximate nearest-neighbour index over unit vectors, ranked by inner product.
+
+    Spherical k-means splits the vectors into lists around ``centroids``; list ``i`` holds the row ids
+    ``list_ids[list_offsets[i]:list_offsets[i + 1]]``. A query only scans the ``n_probe`` lists whose centroids
+    are closest, so ``n_probe`` trades recall for latency: probing every list is an exact search.
+    """
+    def __init__(self, centroids: np.ndarray, list_offsets: np.ndarray, list_ids: np.ndarray):
+        self.centroids = centroids
+        self.list_offsets = list_offsets
+        self.list_ids = list_ids
+    @property
+    def num_lists(self) -> int:
+        return len(self.centroids)
+    @classmethod
+    def build(cls, vectors: np.ndarray, num_lists: int, iterations: int = DEFAULT_KMEANS_ITERATIONS,
+              seed: int = 0) -> "IVFIndex":
+        if len(vectors) == 0:
+            # nothing to cluster: no lists, and every probe comes back empty
+            return cls(np.zeros((0, vectors.shape[1]), dtype=vectors.dtype), np.zeros(1, dtype=np.int64),
+                       np.zeros(0, dtype=np.int64))
+        rng = np.random.default_rng(seed)
+        num_lists = max(1, min(num_lists, len(vectors)))
+        sample_size = min(len(vectors), num_lists * _TRAINING_VECTORS_PER_LIST)
+        sample = np.asarray(vectors[np.sort(rng.choice(len(vectors), sample_size, replace=False))])
+        centroids = sample[rng.choice(len(sample), num_lists, replace=False)]
+        for _ in range(iterations):
+            assignment = _nearest(sample, centroids)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, sample)
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            # an empty list keeps its centroid
+            centroids = np.where(norms > 0, sums / np.where(norms > 0, norms, 1), centroids).astype(vectors.dtype)
+        assignment = np.concatenate([_nearest(np.asarray(vectors[start:start + _ASSIGN_CHUNK]), centroids)
+                                     for start in range(0, len(vectors), _ASSIGN_CHUNK)])
+        list_ids = np.argsort(assignment, kind="stable").astype(np.int64)
+        list_offsets = np.zeros(num_lists + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assignment, minlength=num_lists), out=list_offsets[1:])
+        return cls(centroids, list_offsets, list_ids)
+    def probe(self, query: np.ndarray, n_probe: int) -> np.ndarray:
+        """Get the sorted row ids of the n_probe lists closest to the query"""
+        n_probe = min(n_probe, self.num_lists)
+        if n_probe <= 0:
+            return self.list_ids[:0]
+        similarities = self.centroids @ query
+        lists = np.argpartition(-similarities, n_probe - 1)[:n_probe] if n_probe < self.num_lists else np.arange(self.num_lists)
+        ids = np.concatenate([self.list_ids[self.list_offsets[i]:self.list_offsets[i + 1]] for i in lists.tolist()])
+        return np.sort(ids)
+    def search(self, vectors: np.ndarray, query: np.ndarray, k: int, n_probe: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Get the (row ids, inner products) of the approximate top k rows of ``vectors``"""
+        ids = self.probe(query, n_probe)
+        scores = np.asarray(vectors[ids]) @ query
+        top = top_k(scores, np.arange(len(ids)), k)
+        return ids[top], scores[top]
+    def save(self, directory: str) -> None:
+        path = Path(directory)
+        path.mkdir(parents=True, exist_ok=True)
+        for name in _ARRAYS:
+            save_array(path / f"ivf_{name}.npy", getattr(self, name))
+    @classmethod
+    def load(cls, directory: str) -> "IVFIndex":
+        path = Path(directory)
+        return cls(*(np.load(path / f"ivf_{name}.npy") for name in _ARRAYS))
+
+
+def _nearest(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    return np.argmax(vectors @ centroids.T, axis=1)
@@ -0,0 +1,25 @@
+from typing import List, Optional, Tuple
+
+from src.indexing.index_segment import IndexSegment
+
+
+class TieredMergePolicy:
+    """Decide which segments to compact.
+
+    Once more than ``max_segments`` segments exist, the window of ``merge_factor`` adjacent segments with
+    the fewest postings is merged. Only adjacent segments are merged so that every segment keeps covering
+    a contiguous doc id range, and small fresh segments are compacted long before the large base segment.
+    """
+    def __init__(self, max_segments: int = 8, merge_factor: int = 4):
+        if merge_factor < 2:
+            raise ValueError("merge_factor must be at least 2")
+        self.max_segments = max_segments
+        self.merge_factor = merge_factor
+    def find_merge(self, segments: List[IndexSegment]) -> Optional[Tuple[int, int]]:
+        """Get the [start, end) window of segments to merge, or None if no merge is needed"""
+        if len(segments) <= self.max_segments:
+            return None
+        width = min(self.merge_factor, len(segments))
+        sizes = [segment.num_postings for segment in segments]
+        start = min(range(len(segments) - width + 1), key=lambda i: sum(sizes[i:i + width]))
+        return start, start + width
@@ -0,0 +1,228 @@
+from typing import Dict, List, Optional
+
+import numpy as np
+
+# ids are split into containers of 2**16 by their high bits; a container holding more than ARRAY_CONTAINER_LIMIT
+# ids is stored as a 65536-bit bitmap (8 KB), which is then smaller than the sorted array of its low bits
+CONTAINER_BITS = 16
+CONTAINER_SIZE = 1 << CONTAINER_BITS
+ARRAY_CONTAINER_LIMIT = 4096
+_BITMAP_WORDS = CONTAINER_SIZE // 64
+# below this size ratio, locating the shorter list's ids in the longer one by binary search beats a merge
+_GALLOP_RATIO = 8
+
+
+def intersect_sorted(first: np.ndarray, second: np.ndarray) -> np.ndarray:
+    """Intersect two sorted arrays of unique ids.
+
+    Every id of the shorter list is located in the longer one by binary search, which skips the runs of the
+    longer list between matches as galloping would. Lists of similar sizes are merged instead.
+    """
+    small, large = (first, second) if len(first) <= len(second) else (second, first)
+    if len(small) == 0:
+        return small
+    if len(small) * _GALLOP_RATIO < len(large):
+        return small[_contains(large, small)]
+    return np.intersect1d(small, large, assume_unique=True)
+
+
+def subtract_sorted(ids: np.ndarray, excluded: np.ndarray) -> np.ndarray:
+    """Remove the excluded ids from a sorted array of unique ids"""
+    if len(ids) == 0 or len(excluded) == 0:
+        return ids
+    return ids[~_contains(excluded, ids)]
+
+
+def union_sorted(first: np.ndarray, second: np.ndarray) -> np.ndarray:
+    if len(first) == 0:
+        return second
+    if len(second) == 0:
+        return first
+    return np.union1d(first, second)
+
+
+def _contains(haystack: np.ndarray, needles: np.ndarray) -> np.ndarray:
+    """Get whether every needle is in the sorted haystack"""
+    found = np.searchsorted(haystack, needles)
+    found[found == len(haystack)] = 0
+    return haystack[found] == needles
+
+
+class RoaringBitmap:
+    """Compressed set of non-negative ids in the roaring layout.
+
+    Container ``i`` holds the ids whose high bits are ``keys[i]``, as either the sorted uint16 array of their
+    low bits or, when dense, a bitmap of 1024 uint64 words; the dtype tells them apart. Set operations pair
+    containers by key and pick the cheapest kernel for each pair of representations.
+    """
+    def __init__(self, keys: np.ndarray, containers: List[np.ndarray]):
+        self.keys = keys
+        self.containers = containers
+        self._cardinality: Optional[int] = None
+    @classmethod
+    def from_sorted(cls, ids: np.ndarray) -> "RoaringBitmap":
+        """Build from a sorted array of unique ids"""
+        ids = np.asarray(ids, dtype=np.int64)
+        high = ids >> CONTAINER_BITS
+        starts = np.flatnonzero(np.concatenate(([len(ids) > 0], high[1:] != high[:-1])))
+        ends = np.append(starts[1:], len(ids))
+        low = (ids & (CONTAINER_SIZE - 1)).astype(np.uint16)
+        return cls(high[starts], [_container(low[start:end]) for start, end in zip(starts.tolist(), ends.tolist())])
+    @classmethod
+    def from_mask(cls, mask: np.ndarray) -> "RoaringBitmap":
+        """Build the set of positions where a boolean mask is true"""
+        keys, containers = [], []
+        for key, start in enumerate(range(0, len(mask), CONTAINER_SIZE)):
+            chunk = np.zeros(CONTAINER_SIZE, dtype=bool)
+            part = mask[start:start + CONTAINER_SIZE]
+            chunk[:len(part)] = part
+            words = np.packbits(chunk, bitorder="little").view(np.uint64)
+            container = _normalize(words)
+            if len(container):
+                keys.append(key)
+                containers.append(container)
+        return cls(np.array(keys, dtype=np.int64), containers)
+    def __len__(self) -> int:
+        if self._cardinality is None:
+            self._cardinality = sum(_cardinality(container) for container in self.containers)
+        return self._cardinality
+    def __contains__(self, doc_id: int) -> bool:
+        position = int(np.searchsorted(self.keys, doc_id >> CONTAINER_BITS))
+        if position == len(self.keys) or self.keys[position] != doc_id >> CONTAINER_BITS:
+            return False
+        return bool(_test(self.containers[position], np.array([doc_id & (CONTAINER_SIZE - 1)]))[0])
+    @property
+    def nbytes(self) -> int:
+        return self.keys.nbytes + sum(container.nbytes for container in self.containers)
+    def to_array(self, limit: Optional[int] = None) -> np.ndarray:
+        """Get the sorted ids, at most ``limit`` of them; containers past the limit are not decoded"""
+        parts, found = [], 0
+        for key, container in zip(self.keys.tolist(), self.containers):
+            if limit is not None and found >= limit:
+                break
+            low = _low_bits(container)
+            if limit is not None:
+                low = low[:limit - found]
+            parts.append((key << CONTAINER_BITS) + low.astype(np.int64))
+            found += len(low)
+        return np.concatenate(parts) if parts else np.zeros(0, dtype=np.int64)
+    def __and__(self, other: "RoaringBitmap") -> "RoaringBitmap":
+        keys, mine, theirs = np.intersect1d(self.keys, other.keys, assume_unique=True, return_indices=True)
+        return self._build(keys, [_and(self.containers[i], other.containers[j])
+                                  for i, j in zip(mine.tolist(), theirs.tolist())])
+    def __or__(self, other: "RoaringBitmap") -> "RoaringBitmap":
+        keys = np.union1d(self.keys, other.keys)
+        mine = dict(zip(self.keys.tolist(), self.containers))
+        theirs = dict(zip(other.keys.tolist(), other.containers))
+        containers = []
+        for key in keys.tolist():
+            first, second = mine.get(key), theirs.get(key)
+            containers.append(first if second is None else second if first is None else _or(first, second))
+        return RoaringBitmap(keys, containers)
+    def __sub__(self, other: "RoaringBitmap") -> "RoaringBitmap":
+        theirs = dict(zip(other.keys.tolist(), other.containers))
+        containers = [container if key not in theirs else _and_not(container, theirs[key])
+                      for key, container in zip(self.keys.tolist(), self.containers)]
+        return self._build(self.keys, containers)
+    @staticmethod
+    def _build(keys: np.ndarray, containers: List[np.ndarray]) -> "RoaringBitmap":
+        keep = [i for i, container in enumerate(containers) if len(container)]
+        return RoaringBitmap(keys[keep], [containers[i] for i in keep])
+
+
+def _is_bitmap(container: np.ndarray) -> bool:
+    return container.dtype == np.uint64
+
+
+def _cardinality(container: np.ndarray) -> int:
+    return int(np.bitwise_count(container).sum()) if _is_bitmap(container) else len(container)
+
+
+def _container(low: np.ndarray) -> np.ndarray:
+    """Store sorted low bits in the smaller representation"""
+    return low if len(low) <= ARRAY_CONTAINER_LIMIT else _container_words(low)
+
+
+def _normalize(words: np.ndarray) -> np.ndarray:
+    """Turn a bitmap container that became sparse back into an array container. Empty containers have length 0."""
+    if int(np.bitwise_count(words).sum()) > ARRAY_CONTAINER_LIMIT:
+        return words
+    return _low_bits(words)
+
+
+def _low_bits(container: np.ndarray) -> np.ndarray:
+    if not _is_bitmap(container):
+        return container
+    return np.flatnonzero(np.unpackbits(container.view(np.uint8), bitorder="little")).astype(np.uint16)
+
+
+def _test(words_or_low: np.ndarray, low: np.ndarray) -> np.ndarray:
+    """Get whether every low-bit value is in the container"""
+    if not _is_bitmap(words_or_low):
+        return _contains(words_or_low, low) if len(words_or_low) else np.zeros(len(low), dtype=bool)
+    shifts = (low & 63).astype(np.uint64)
+    return ((words_or_low[low >> 6] >> shifts) & np.uint64(1)).astype(bool)
+
+
+def _and(first: np.ndarray, second: np.ndarray) -> np.ndarray:
+    if _is_bitmap(first) and _is_bitmap(second):
+        return _normalize(first & second)
+    if _is_bitmap(first):
+        first, second = second, first
+    if _is_bitmap(second):
+        return first[_test(second, first)]
+    return intersect_sorted(first, second)
+
+
+def _or(first: np.ndarray, second: np.ndarray) -> np.ndarray:
+    if _is_bitmap(first) and _is_bitmap(second):
+        return first | second
+    if _is_bitmap(first):
+        first, second = second, first
+    if _is_bitmap(second):
+        return second | _container_words(first)
+    return _container(union_sorted(first, second))
+
+
+def _and_not(first: np.ndarray, second: np.ndarray) -> np.ndarray:
+    if _is_bitmap(first):
+        return _normalize(first & ~(second if _is_bitmap(second) else _container_words(second)))
+    return first[~_test(second, first)] if _is_bitmap(second) else subtract_sorted(first, second)
+
+
+def _container_words(low: np.ndarray) -> np.ndarray:
+    words = np.zeros(_BITMAP_WORDS, dtype=np.uint64)
+    np.bitwise_or.at(words, low >> 6, np.left_shift(np.uint64(1), (low & 63).astype(np.uint64)))
+    return words
+
+
+def flatten_bitmaps(bitmaps: List[RoaringBitmap]) -> Dict[str, np.ndarray]:
+    """Lay bitmaps out as flat arrays for saving: bitmap ``b`` has containers
+    ``bitmap_offsets[b]:bitmap_offsets[b + 1]``, container ``c`` the uint16 data
+    ``data[container_offsets[c]:container_offsets[c + 1]]``, a bitmap container when ``container_is_bitmap[c]``"""
+    containers = [container for bitmap in bitmaps for container in bitmap.containers]
+    bitmap_offsets = np.zeros(len(bitmaps) + 1, dtype=np.int64)
+    np.cumsum([len(bitmap.keys) for bitmap in bitmaps], out=bitmap_offsets[1:])
+    container_offsets = np.zeros(len(containers) + 1, dtype=np.int64)
+    np.cumsum([container.nbytes // 2 for container in containers], out=container_offsets[1:])
+    return {
+        "bitmap_offsets": bitmap_offsets,
+        "container_keys": np.concatenate([bitmap.keys for bitmap in bitmaps]).astype(np.int64)
+        if bitmaps else np.zeros(0, dtype=np.int64),
+        "container_offsets": container_offsets,
+        "container_is_bitmap": np.array([_is_bitmap(container) for container in containers], dtype=bool),
+        "data": np.concatenate([container.view(np.uint16) for container in containers])
+        if containers else np.zeros(0, dtype=np.uint16),
+    }
+
+
+def read_bitmap(arrays: Dict[str, np.ndarray], position: int) -> RoaringBitmap:
+    """Get bitmap ``position`` of flat arrays from flatten_bitmaps, as views of them"""
+    start, end = int(arrays["bitmap_offsets"][position]), int(arrays["bitmap_offsets"][position + 1])
+    offsets = arrays["container_offsets"][start:end + 1].tolist()
+    containers = []
+    for container_start, container_end, is_bitmap in zip(offsets, offsets[1:],
+                                                          arrays["container_is_bitmap"][start:end].tolist()):
+        data = arrays["data"][container_start:container_end]
+        containers.append(data.view(np.uint64) if is_bitmap else data)
+    return RoaringBitmap(np.asarray(arrays["container_keys"][start:end]), containers)
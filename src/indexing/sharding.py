@@ -0,0 +1,84 @@
+import json
+import zlib
+from array import array
+from pathlib import Path
+from typing import Dict, Hashable, Iterable, Iterator, List, Tuple
+
+import numpy as np
+
+from src.indexing.collection_stats import CollectionStats
+from src.indexing.document_store import normalize_doc_id
+from src.indexing.index_storage import save_index, load_index, save_array
+from src.indexing.inverted_index import InvertedIndex
+
+# Layout of a sharded index directory: shard_<i>.bin is the index of shard i, shard_<i>_order.npy the position in
+# the corpus of every internal doc id of shard i, collection_stats.bin the statistics of the whole collection and
+# meta.json, written last, the number of shards.
+SHARDS_VERSION = 1
+_STATS_FILE = "collection_stats.bin"
+_META_FILE = "meta.json"
+
+
+def shard_of(doc_id: Hashable, num_shards: int) -> int:
+    """Shard of a document, by a hash of its normalized id so every process agrees on it"""
+    return zlib.crc32(normalize_doc_id(doc_id).encode("utf-8")) % num_shards
+
+
+def shard_index_path(directory: str, shard: int) -> Path:
+    return Path(directory) / f"shard_{shard}.bin"
+
+
+def _shard_order_path(directory: str, shard: int) -> Path:
+    return Path(directory) / f"shard_{shard}_order.npy"
+
+
+def build_shards(documents: Iterable[Tuple[Hashable, List[str]]], num_shards: int, directory: str) -> CollectionStats:
+    """Partition (cid, terms) documents into shards by doc id, index and save every shard, then the statistics
+    of the whole collection. Returns the collection statistics."""
+    if num_shards < 1:
+        raise ValueError(f"num_shards must be at least 1, got {num_shards}")
+    # readers never open a half rebuilt directory: it has no metadata until every file is written
+    (Path(directory) / _META_FILE).unlink(missing_ok=True)
+    parts: List[Dict[Hashable, List[str]]] = [{} for _ in range(num_shards)]
+    # the corpus position of every document breaks score ties across shards as the unsharded index does
+    orders = [array("q") for _ in range(num_shards)]
+    for position, (cid, terms) in enumerate(documents):
+        shard = shard_of(cid, num_shards)
+        parts[shard][cid] = terms
+        orders[shard].append(position)
+    stats = CollectionStats.from_indexes(_build_shard_indexes(parts, orders, directory))
+    stats.save(str(Path(directory) / _STATS_FILE))
+    meta = {"version": SHARDS_VERSION, "num_shards": num_shards, "collection": stats.fingerprint()}
+    (Path(directory) / _META_FILE).write_text(json.dumps(meta), encoding="utf-8")
+    return stats
+
+
+def _build_shard_indexes(parts: List[Dict[Hashable, List[str]]], orders: List[array],
+                         directory: str) -> Iterator[InvertedIndex]:
+    """Index, save and yield the shards one at a time, dropping the documents of each once indexed"""
+    for shard in range(len(parts)):
+        index = InvertedIndex()
+        index.build(parts[shard])
+        parts[shard] = {}
+        save_index(str(shard_index_path(directory, shard)), index)
+        save_array(_shard_order_path(directory, shard), np.asarray(orders[shard], dtype=np.int64))
+        yield index
+
+
+def read_shards_meta(directory: str) -> Dict:
+    meta_path = Path(directory) / _META_FILE
+    if not meta_path.exists():
+        raise FileNotFoundError(f"No sharded index in {directory}. Run SearchEngine.build_shards() first.")
+    meta = json.loads(meta_path.read_text(encoding="utf-8"))
+    if meta["version"] != SHARDS_VERSION:
+        raise ValueError(f"Unsupported sharded index version {meta['version']}, expected {SHARDS_VERSION}. "
+                         f"Rebuild the shards.")
+    return meta
+
+
+def load_shard(directory: str, shard: int) -> Tuple[InvertedIndex, np.ndarray]:
+    """Open the index of a shard, scoring with the statistics of the whole collection, and the corpus position
+    of its documents by internal doc id"""
+    index = load_index(str(shard_index_path(directory, shard)))
+    index.set_collection_stats(CollectionStats.load(str(Path(directory) / _STATS_FILE)))
+    return index, np.load(_shard_order_path(directory, shard), mmap_mode="r")
@@ -0,0 +1,112 @@
+import heapq
+import tempfile
+from array import array
+from itertools import groupby
+from operator import itemgetter
+from pathlib import Path
+from typing import Hashable, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from src.indexing.index_segment import IndexSegment, new_term_postings, add_to_term_postings
+
+DEFAULT_MEMORY_BUDGET = 256 * 1024 * 1024
+# rough cost of one term entry while accumulating: dict slot, key string and three growable arrays
+_TERM_OVERHEAD_BYTES = 320
+_RUN_ARRAYS = ("term_offsets", "postings_doc_ids", "postings_tfs", "position_offsets", "positions")
+
+
+def build_segment_external(documents: Iterable[Tuple[Hashable, List[str]]],
+                           memory_budget: int = DEFAULT_MEMORY_BUDGET,
+                           tmp_dir: Optional[str] = None) -> Tuple[IndexSegment, List[Hashable], np.ndarray]:
+    """Single-pass in-memory indexing (SPIMI) over a stream of (cid, terms).
+
+    Postings are accumulated until their estimated size reaches ``memory_budget``, then written to disk as a
+    sorted run. The runs are memory-mapped and k-way merged into the final segment, which is identical to
+    the one built in memory. Returns the segment, the cid of every internal doc id and the doc lengths.
+    """
+    doc_ids: List[Hashable] = []
+    doc_lengths = array("i")
+    with tempfile.TemporaryDirectory(dir=tmp_dir, prefix="spimi-") as run_dir:
+        runs: List[IndexSegment] = []
+        term_postings = new_term_postings()
+        run_start = 0
+        estimated_bytes = 0
+        for internal_id, (cid, terms) in enumerate(documents):
+            doc_ids.append(cid)
+            doc_lengths.append(len(terms))
+            known_terms = len(term_postings)
+            new_postings = add_to_term_postings(term_postings, internal_id, terms)
+            new_terms = len(term_postings) - known_terms
+            estimated_bytes += 8 * new_postings + 4 * len(terms) + _TERM_OVERHEAD_BYTES * new_terms
+            if estimated_bytes >= memory_budget:
+                runs.append(_write_run(Path(run_dir) / str(len(runs)), term_postings, (run_start, internal_id + 1)))
+                term_postings = new_term_postings()
+                run_start = internal_id + 1
+                estimated_bytes = 0
+        last_run = IndexSegment.from_term_postings(term_postings, (run_start, len(doc_ids)))
+        del term_postings
+        segment = _merge_runs(runs + [last_run]) if runs else last_run
+        runs.clear()  # release the memory maps before the run files are removed
+    return segment, doc_ids, np.frombuffer(doc_lengths, dtype=np.int32).copy()
+
+
+def _write_run(directory: Path, term_postings, doc_range: Tuple[int, int]) -> IndexSegment:
+    segment = IndexSegment.from_term_postings(term_postings, doc_range)
+    directory.mkdir()
+    (directory / "terms.txt").write_text("\n".join(segment.terms), encoding="utf-8")
+    for name in _RUN_ARRAYS:
+        np.save(directory / f"{name}.npy", getattr(segment, name))
+    del segment
+    return _open_run(directory, doc_range)
+
+
+def _open_run(directory: Path, doc_range: Tuple[int, int]) -> IndexSegment:
+    # tokens never contain whitespace, so one term per line is unambiguous
+    text = (directory / "terms.txt").read_text(encoding="utf-8")
+    terms = text.split("\n") if text else []
+    arrays = [np.load(directory / f"{name}.npy", mmap_mode="r") for name in _RUN_ARRAYS]
+    return IndexSegment(terms, None, *arrays, doc_range)
+
+
+def _term_stream(run: IndexSegment, run_index: int) -> Iterator[Tuple[str, int, int]]:
+    for term_id, term in enumerate(run.terms):
+        yield term, run_index, term_id
+
+
+def _merge_runs(runs: List[IndexSegment]) -> IndexSegment:
+    """K-way merge of runs over ascending doc ranges into preallocated CSR arrays"""
+    postings_doc_ids = np.empty(sum(run.num_postings for run in runs), dtype=np.int32)
+    postings_tfs = np.empty_like(postings_doc_ids)
+    positions = np.empty(sum(len(run.positions) for run in runs), dtype=np.uint8)
+    position_ends = array("q")
+    terms: List[str] = []
+    term_ends = array("q")
+    posting_cursor = 0
+    position_cursor = 0
+    streams = [_term_stream(run, run_index) for run_index, run in enumerate(runs)]
+    # ties on a term are broken by run index, so each term's doc ids come out sorted
+    for term, entries in groupby(heapq.merge(*streams), key=itemgetter(0)):
+        terms.append(term)
+        for _, run_index, term_id in entries:
+            run = runs[run_index]
+            start, end = int(run.term_offsets[term_id]), int(run.term_offsets[term_id + 1])
+            count = end - start
+            postings_doc_ids[posting_cursor:posting_cursor + count] = run.postings_doc_ids[start:end]
+            postings_tfs[posting_cursor:posting_cursor + count] = run.postings_tfs[start:end]
+            # compressed position lists are self-contained, so their bytes are copied as they are
+            position_start, position_end = int(run.position_offsets[start]), int(run.position_offsets[end])
+            position_count = position_end - position_start
+            positions[position_cursor:position_cursor + position_count] = run.positions[position_start:position_end]
+            position_ends.extend((run.position_offsets[start + 1:end + 1] - position_start + position_cursor).tolist())
+            posting_cursor += count
+            position_cursor += position_count
+        term_ends.append(posting_cursor)
+    term_offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+    term_offsets[1:] = np.frombuffer(term_ends, dtype=np.int64)
+    position_offsets = np.zeros(len(postings_tfs) + 1, dtype=np.int64)
+    position_offsets[1:] = np.frombuffer(position_ends, dtype=np.int64)
+    return IndexSegment(
+        terms, {term: term_id for term_id, term in enumerate(terms)}, term_offsets, postings_doc_ids,
+        postings_tfs, position_offsets, positions, (runs[0].doc_range[0], runs[-1].doc_range[1]),
+    )
@@ -1,4 +1,6 @@
+from src.evaluation.ann_benchmark import ANNBenchmark
 from src.evaluation.evaluator_service import EvaluatorService
+from src.evaluation.parameter_sweep import BM25ParameterSweep
 from src.indexing.elasticsearch_indexing import ElasticSearchIndexing
 from src.search_engine import SearchEngine
 from src.util import constant
@@ -17,6 +19,9 @@ def main():
     # evaluator_service = EvaluatorService(search_engine)
     # evaluator_service.load_ground_truth()
     # evaluator_service.run_evaluation_and_save()
+    # evaluator_service.report_quality_loss()
+    # BM25ParameterSweep(evaluator_service).run_and_save()
+    # ANNBenchmark(evaluator_service).run_and_save()
 
 
     elasticsearch_index = ElasticSearchIndexing()
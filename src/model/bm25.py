@@ -1,23 +1,89 @@
 import math
-from typing import List, Tuple
+from collections import Counter
+from typing import List, Tuple, Optional, Set, Dict
+
+import numpy as np
 
 from src.indexing.inverted_index import InvertedIndex
-from src.model.model import Model
+from src.model.model import Model, top_k, score_batch
+from src.model.score_bounds import BlockMaxBounds, BOUND_SLACK
+
+# binary-searching one document costs about as much as scoring this many postings sequentially
+_PROBE_COST = 16
+# block bounds are looked up per document, so they are only used once this few candidates are left
+_BLOCK_BOUND_CANDIDATES = 1024
 
 
 class OkapiBM25(Model):
     """Okapi BM25 probabilistic retrieval model"""
-    def __init__(self, inverted_index: InvertedIndex, k1: float = 1.5, b: float = 0.75):
+    def __init__(self, inverted_index: InvertedIndex, k1: float = 1.5, b: float = 0.75,
+                 proximity_weight: float = 0.0, proximity_depth: int = 100):
         super().__init__()
         self.index = inverted_index
         self.k1 = k1 # Term frequency saturation parameter
         self.b = b # length normalization parameter
+        self.proximity_weight = proximity_weight # weight of the term proximity boost, 0 disables it
+        self.proximity_depth = proximity_depth # number of top BM25 results re-ranked with the boost
+        self.idf_cache = {}
+        self.term_idf: Optional[np.ndarray] = None  # term id of the merged segment -> idf, once precomputed
+        # internal doc id -> k1 * (1 - b + b * doc_length / avg_doc_length), for the (k1, b) it was computed with
+        self.doc_length_norms: Optional[np.ndarray] = None
+        self._length_norm_params: Optional[Tuple[float, float]] = None
+        # per-term and per-block score upper bounds used to prune documents that cannot reach the top k
+        self.bounds: Optional[BlockMaxBounds] = None
+        self._bounds_params: Optional[Tuple[float, float]] = None
+    def _reset_caches(self) -> None:
         self.idf_cache = {}
+        self.term_idf = None
+        self.doc_length_norms = None
+        self.bounds = None
+    def search_params(self) -> Dict:
+        return {"k1": self.k1, "b": self.b, "proximity_weight": self.proximity_weight,
+                "proximity_depth": self.proximity_depth}
+    def precompute(self) -> None:
+        self._sync_with_index()
+        segment = self.index.merged_segment()
+        df = self.index.collection_doc_frequencies(segment)
+        n = self.index.collection_total_docs
+        self.term_idf = np.where(df > 0, np.log((n - df + 0.5) / (df + 0.5) + 1), 0.0)
+        self.bounds = BlockMaxBounds.compute(segment, self._length_norms())
+        self._bounds_params = (self.k1, self.b)
+    def _length_norms(self) -> np.ndarray:
+        if self.doc_length_norms is None or self._length_norm_params != (self.k1, self.b):
+            avg_doc_length = self.index.collection_avg_doc_length
+            # an index of empty documents has no average length, nor any posting to normalize
+            relative_lengths = self.index.doc_lengths / avg_doc_length if avg_doc_length else np.zeros(
+                len(self.index.doc_lengths))
+            self.doc_length_norms = self.k1 * (1 - self.b + self.b * relative_lengths)
+            self._length_norm_params = (self.k1, self.b)
+        return self.doc_length_norms
+    def sidecar_state(self) -> Tuple[Dict, Dict[str, np.ndarray]]:
+        if self.term_idf is None:
+            self.precompute()
+        params = self.search_params()
+        if self.bounds is None or self._bounds_params != (self.k1, self.b):
+            self.precompute()
+        arrays = {"term_idf": self.term_idf, "doc_length_norms": self._length_norms()}
+        arrays.update({f"bounds_{name}": values for name, values in self.bounds._asdict().items()})
+        return params, arrays
+    def attach_sidecar(self, params: Dict, arrays: Dict[str, np.ndarray]) -> None:
+        self._sync_with_index()
+        self.k1, self.b = params["k1"], params["b"]
+        self.proximity_weight, self.proximity_depth = params["proximity_weight"], params["proximity_depth"]
+        self.term_idf = arrays["term_idf"]
+        self.doc_length_norms = arrays["doc_length_norms"]
+        self._length_norm_params = (self.k1, self.b)
+        self.bounds = BlockMaxBounds(*(arrays[f"bounds_{name}"] for name in BlockMaxBounds._fields))
+        self._bounds_params = (self.k1, self.b)
     def compute_idf(self, term) -> float:
         """Compute IDF of BM25 formula with smoothing(+1 inside log)"""
+        self._sync_with_index()
+        if self.term_idf is not None:
+            term_id = self.index.merged_segment().term_ids.get(term)
+            return float(self.term_idf[term_id]) if term_id is not None else 0
         if term not in self.idf_cache:
-            df = self.index.get_doc_frequency(term)
-            n = self.index.total_docs
+            df = self.index.collection_doc_frequency(term)
+            n = self.index.collection_total_docs
             if df > 0:
                 # BM25 idf formula with smoothing (+1)
                 self.idf_cache[term] = math.log((n - df + 0.5) / (df + 0.5) + 1)
@@ -29,31 +95,207 @@ class OkapiBM25(Model):
         tf = self.index.get_term_frequency(term, doc_id)
         if tf == 0:
             return 0
-        doc_length = self.index.doc_lengths[doc_id]
-        avg_length = self.index.avg_doc_length
+        doc_length = self.index.get_doc_length(doc_id)
+        avg_length = self.index.collection_avg_doc_length
 
         #BM25 formula
         idf = self.compute_idf(term)
         numerator = tf * (self.k1 + 1)
         denominator = tf + self.k1 * (1 - self.b + self.b * (doc_length / avg_length))
         return idf * (numerator / denominator)
-    def search(self, query_terms: List[str], top_n: int = 10) -> List[Tuple[str, float]]:
+    def compute_proximity_score(self, query_terms: List[str], doc_id: str) -> float:
+        """Compute the proximity boost: idf-weighted inverse squared distance of consecutive query terms"""
+        score = 0
+        for first, second in zip(query_terms, query_terms[1:]):
+            if first == second:
+                continue
+            first_positions = self.index.get_positions(first, doc_id)
+            second_positions = self.index.get_positions(second, doc_id)
+            if len(first_positions) == 0 or len(second_positions) == 0:
+                continue
+            distance = self._min_distance(first_positions, second_positions)
+            score += min(self.compute_idf(first), self.compute_idf(second)) / distance ** 2
+        return score
+    @staticmethod
+    def _min_distance(first: np.ndarray, second: np.ndarray) -> int:
+        following = np.searchsorted(second, first)
+        after = second[np.minimum(following, len(second) - 1)] - first
+        before = first - second[np.maximum(following - 1, 0)]
+        return int(min(np.abs(after).min(), np.abs(before).min()))
+    def _weighted_terms(self, query_terms: List[str]) -> List[Tuple[float, str]]:
+        """Get the distinct query terms with their weight count * idf * (k1 + 1), heaviest first.
+
+        Every scoring path adds term contributions in this order, so they all produce bit-identical scores.
+        """
+        weighted = [(count * self.compute_idf(term) * (self.k1 + 1), term) for term, count in Counter(query_terms).items()]
+        weighted.sort(key = lambda x : (-x[0], x[1]))
+        return weighted
+    def score_all(self, query_terms: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """Score every document containing a query term at once.
+
+        Returns the dense score array indexed by internal doc id and a mask of the documents touched.
+        A term repeated in the query counts once per occurrence, as in a sum of per-term scores.
+        """
+        self._sync_with_index()
+        length_norms = self._length_norms()
+        scores = np.zeros(len(length_norms))
+        touched = np.zeros(len(length_norms), dtype=bool)
+        for weight, term in self._weighted_terms(query_terms):
+            doc_ids, saturation = self._saturation(term)
+            if len(doc_ids) == 0:
+                continue
+            # doc ids are unique within a posting list, so fancy-index accumulation is safe
+            scores[doc_ids] += weight * saturation
+            touched[doc_ids] = True
+        return scores, touched
+    def _saturation(self, term: str) -> Tuple[np.ndarray, np.ndarray]:
+        """Get the internal doc ids of a term and their saturated term frequency tf / (tf + length norm).
+
+        A term contributes its query weight times this value, computed the same way by every scoring path.
+        """
+        doc_ids, tfs = self.index.get_postings(term)
+        return doc_ids, tfs / (tfs + self._length_norms()[doc_ids])
+    def _contributions(self, term: str, weight: float, doc_ids: np.ndarray) -> np.ndarray:
+        """Get the exact score contribution of a term to every (sorted) internal doc id, 0 where it is absent"""
+        postings_doc_ids, tfs = self.index.get_postings(term)
+        if len(postings_doc_ids) == 0:
+            return np.zeros(len(doc_ids))
+        # same expression as score_all either way, so every path produces bit-identical scores
+        if len(doc_ids) * _PROBE_COST < len(postings_doc_ids):
+            found = np.searchsorted(postings_doc_ids, doc_ids)
+            found[found == len(postings_doc_ids)] = 0
+            present = postings_doc_ids[found] == doc_ids
+            contributions = np.zeros(len(doc_ids))
+            term_tfs = tfs[found[present]]
+            contributions[present] = weight * (term_tfs / (term_tfs + self.doc_length_norms[doc_ids[present]]))
+            return contributions
+        # too many documents to binary-search them one by one: score the whole list into a dense array
+        term_scores = np.zeros(len(self.doc_length_norms))
+        term_scores[postings_doc_ids] = weight * (tfs / (tfs + self.doc_length_norms[postings_doc_ids]))
+        return term_scores[doc_ids]
+    def search_pruned(self, query_terms: List[str], k: int) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """MaxScore top-k over per-term and per-block upper bounds.
+
+        Query terms are fully scored, heaviest first, while the terms left could still lift an unseen
+        document into the top k. The remaining (frequent, low idf) terms are only probed for the documents
+        already seen whose bound can still reach the k-th best partial score. Returns the same (internal ids,
+        scores) as an exhaustive search, or None when the bounds are missing or stale.
+        """
+        self._sync_with_index()
+        if self.bounds is None or self._bounds_params != (self.k1, self.b) or k <= 0:
+            return None
+        length_norms = self._length_norms()
+        term_ids = self.index.merged_segment().term_ids
+        terms = []  # (upper bound, weight, term, term id)
+        for weight, term in self._weighted_terms(query_terms):
+            term_id = term_ids.get(term)
+            if term_id is None or self.bounds.term_max[term_id] == 0:
+                continue
+            terms.append((weight * float(self.bounds.term_max[term_id]), weight, term, term_id))
+        remaining = np.cumsum([upper for upper, _, _, _ in terms][::-1])[::-1] * BOUND_SLACK
+        scores = np.zeros(len(length_norms))
+        top = None  # the current top k, which only changes through the documents a term touches
+        updated = np.zeros(len(length_norms), dtype=np.int32)
+        threshold = 0.0
+        essential = 0
+        while essential < len(terms) and remaining[essential] >= threshold:
+            _, weight, term, _ = terms[essential]
+            doc_ids, saturation = self._saturation(term)
+            scores[doc_ids] += weight * saturation
+            essential += 1
+            if essential == len(terms) or remaining[essential] >= remaining[0] - remaining[essential]:
+                # no score can exceed the bounds of the terms added so far, so the threshold cannot stop the loop yet
+                continue
+            if top is None:
+                top = np.argpartition(-scores, k - 1)[:k] if len(scores) > k else np.arange(len(scores))
+            else:
+                updated[doc_ids] = essential
+                pool = np.concatenate([doc_ids, top[updated[top] != essential]])
+                top = pool[np.argpartition(-scores[pool], k - 1)[:k]] if len(pool) > k else pool
+            if len(top) == k:
+                threshold = float(scores[top].min())
+        # every contribution is positive, so the documents seen so far are exactly the non-zero scores
+        candidates = np.flatnonzero(scores)
+        partial = scores[candidates]
+        non_essential = terms[essential:]
+        block_bounds = None  # rows: block-max bounds of the terms not added yet, once candidates are few enough
+        for position, (_, weight, term, term_id) in enumerate(non_essential):
+            if block_bounds is None and len(candidates) <= _BLOCK_BOUND_CANDIDATES:
+                block_bounds = BOUND_SLACK * np.array([
+                    weight * self.bounds.doc_bounds(term_id, candidates)
+                    for _, weight, _, term_id in non_essential[position:]
+                ])
+            bound = remaining[essential + position] if block_bounds is None else block_bounds.sum(axis=0)
+            keep = partial + bound >= threshold
+            candidates, partial = candidates[keep], partial[keep]
+            if block_bounds is not None:
+                block_bounds = block_bounds[1:, keep]
+            partial = partial + self._contributions(term, weight, candidates)
+            threshold = max(threshold, _kth_largest(partial, k))
+        # terms were added in the same order as in score_all, so partial scores are now the exact scores
+        scores[candidates] = partial
+        top = top_k(scores, candidates, k)
+        return top, scores[top]
+    def _candidate_ids(self, candidates: Set[str]) -> np.ndarray:
+        doc_id_map = self.index.doc_id_map
+        return np.array(sorted(doc_id_map[cid] for cid in candidates if cid in doc_id_map), dtype=np.int64)
+    def search(self, query_terms: List[str], top_n: int = 10,
+               candidates: Optional[Set[str]] = None) -> List[Tuple[str, float]]:
         """Search using BM25 scoring"""
         if not query_terms:
             return []
-        # Get candidate documents
-        candidates = set()
-        for term in query_terms:
-            candidates.update(self.index.get_docs_contain_term(term))
-        if not candidates:
+        depth = max(top_n, self.proximity_depth) if self.proximity_weight > 0 else top_n
+        pruned = self.search_pruned(query_terms, depth) if candidates is None else None
+        if pruned is not None:
+            top, top_scores = pruned
+        else:
+            scores, touched = self.score_all(query_terms)
+            # candidate documents are the ones containing a query term, unless restricted by the caller
+            eligible = np.flatnonzero(touched) if candidates is None else self._candidate_ids(candidates)
+            top = top_k(scores, eligible, depth)
+            top_scores = scores[top]
+        return self._results(query_terms, top, top_scores, top_n)
+    def rank_all(self, query_terms: List[str],
+                 candidates: Optional[Set[str]] = None) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        # the proximity boost re-ranks the top proximity_depth documents only
+        if self.proximity_weight > 0:
+            return None
+        if not query_terms:
+            return np.zeros(0, dtype=np.int64), np.zeros(0)
+        scores, touched = self.score_all(query_terms)
+        eligible = np.flatnonzero(touched) if candidates is None else self._candidate_ids(candidates)
+        return eligible, scores[eligible]
+    def _results(self, query_terms: List[str], top: np.ndarray, top_scores: np.ndarray,
+                 top_n: int) -> List[Tuple[str, float]]:
+        """Map the top internal ids to doc ids and apply the proximity boost"""
+        if len(top) == 0:
             return []
-        # compute BM25 score for each candidate
-        scores = []
-        for doc_id in candidates:
-            score = 0
-            for term in query_terms:
-                score += self.compute_bm25_score(term, doc_id)
-            scores.append((doc_id, score))
-        # sort by score and return top n results
-        scores.sort(key = lambda x : x[1], reverse = True)
-        return scores[:top_n]
+        results = [(self.index.doc_ids[internal_id], score) for internal_id, score in zip(top.tolist(), top_scores.tolist())]
+        if self.proximity_weight > 0:
+            results = [
+                (doc_id, score + self.proximity_weight * self.compute_proximity_score(query_terms, doc_id))
+                for doc_id, score in results
+            ]
+            results.sort(key = lambda x : x[1], reverse = True)
+        return results[:top_n]
+    def search_batch(self, queries: List[List[str]], top_n: int = 10) -> List[List[Tuple[str, float]]]:
+        """Score a batch of queries together, fetching the postings of every distinct term once.
+
+        Returns the same results as searching the queries one by one.
+        """
+        self._sync_with_index()
+        depth = max(top_n, self.proximity_depth) if self.proximity_weight > 0 else top_n
+        weighted_queries = [self._weighted_terms(query_terms) for query_terms in queries]
+        results = []
+        for block_start, scores in score_batch(weighted_queries, self._saturation, len(self._length_norms())):
+            for query_terms, row in zip(queries[block_start:block_start + len(scores)], scores):
+                # every contribution is positive, so the documents containing a query term are the non-zero scores
+                top = top_k(row, np.flatnonzero(row), depth)
+                results.append(self._results(query_terms, top, row[top], top_n))
+        return results
+
+def _kth_largest(values: np.ndarray, k: int) -> float:
+    """Get the k-th largest value, or 0 when there are fewer than k"""
+    if len(values) < k:
+        return 0.0
+    return float(np.partition(values, len(values) - k)[len(values) - k])
@@ -0,0 +1,138 @@
+import re
+from typing import List, NamedTuple, Optional, Tuple, Union
+
+from src.preprocessing.text_processor import TextProcessor
+from src.util.constant import AND_OPERATOR, OR_OPERATOR, NOT_OPERATOR
+
+# Operators are matched case-insensitively as whole words; every other run of words between operators and
+# parentheses is processed as one text, so multi-syllable words are segmented as at indexing time.
+_BOOLEAN_TOKEN_PATTERN = re.compile(r"(?P<open>\()|(?P<close>\))|(?P<word>[^\s()]+)")
+_OPERATORS = (AND_OPERATOR, OR_OPERATOR, NOT_OPERATOR)
+_OPEN, _CLOSE = "(", ")"
+
+
+class TermNode(NamedTuple):
+    term: str
+
+
+class AndNode(NamedTuple):
+    children: Tuple["BooleanNode", ...]
+
+
+class OrNode(NamedTuple):
+    children: Tuple["BooleanNode", ...]
+
+
+class NotNode(NamedTuple):
+    child: "BooleanNode"
+
+
+BooleanNode = Union[TermNode, AndNode, OrNode, NotNode]
+# a parser item: an operator, a parenthesis, or the processed terms of a run of words
+_Item = Union[str, List[str]]
+
+
+def parse_boolean_query(query: str, processor: TextProcessor) -> Optional[BooleanNode]:
+    """
+    Parse a boolean query: NOT binds tighter than AND, AND tighter than OR, and parentheses group.
+    Adjacent words are implicitly ANDed, e.g. ``thuế (nhập_khẩu OR xuất_khẩu) NOT hoàn``.
+    :param query: Raw query string.
+    :param processor: Text processor applied to every run of words, as at indexing time.
+    :return: The query tree, or None when no term remains
+    """
+    items: List[_Item] = []
+    run: List[str] = []
+    for match in _BOOLEAN_TOKEN_PATTERN.finditer(query):
+        word = match.group("word")
+        if word is not None and word.lower() not in _OPERATORS:
+            run.append(word)
+            continue
+        if run:
+            items.append(processor.process_text(" ".join(run)))
+            run = []
+        items.append(word.lower() if word is not None else match.group())
+    if run:
+        items.append(processor.process_text(" ".join(run)))
+    return _Parser(items).parse()
+
+
+def compile_boolean_tokens(query_terms: List[str]) -> Optional[BooleanNode]:
+    """Build the query tree of already processed terms, where operators are the tokens 'and', 'or' and 'not'"""
+    items: List[_Item] = []
+    for term in query_terms:
+        if term in _OPERATORS:
+            items.append(term)
+        elif items and isinstance(items[-1], list):
+            items[-1].append(term)
+        else:
+            items.append([term])
+    return _Parser(items).parse()
+
+
+class _Parser:
+    """Recursive descent over parser items. User input is parsed leniently: dangling operators and unbalanced
+    parentheses are ignored, and operands without any term (e.g. only stopwords) are dropped."""
+    def __init__(self, items: List[_Item]):
+        self.items = items
+        self.position = 0
+    def _peek(self) -> Optional[_Item]:
+        return self.items[self.position] if self.position < len(self.items) else None
+    def parse(self) -> Optional[BooleanNode]:
+        node = self._parse_or()
+        # an unmatched closing parenthesis ends the expression early; the rest is ANDed with it
+        while self._peek() is not None:
+            self.position += 1
+            rest = self._parse_or()
+            node = _combine(AndNode, [node, rest])
+        return node
+    def _parse_or(self) -> Optional[BooleanNode]:
+        children = [self._parse_and()]
+        while self._peek() == OR_OPERATOR:
+            self.position += 1
+            children.append(self._parse_and())
+        return _combine(OrNode, children)
+    def _parse_and(self) -> Optional[BooleanNode]:
+        children = []
+        while True:
+            item = self._peek()
+            if item is None or item == OR_OPERATOR or item == _CLOSE:
+                break
+            if item == AND_OPERATOR:
+                self.position += 1
+                continue
+            children.append(self._parse_not())
+        return _combine(AndNode, children)
+    def _parse_not(self) -> Optional[BooleanNode]:
+        if self._peek() == NOT_OPERATOR:
+            self.position += 1
+            child = self._parse_not()
+            return NotNode(child) if child is not None else None
+        return self._parse_atom()
+    def _parse_atom(self) -> Optional[BooleanNode]:
+        item = self._peek()
+        if item == _OPEN:
+            self.position += 1
+            node = self._parse_or()
+            if self._peek() == _CLOSE:
+                self.position += 1
+            return node
+        if isinstance(item, list):
+            self.position += 1
+            return _combine(AndNode, [TermNode(term) for term in item])
+        # NOT without an operand, left for the enclosing rule to consume
+        return None
+
+
+def _combine(node_type, children: List[Optional[BooleanNode]]) -> Optional[BooleanNode]:
+    """Build an AND or OR node, flattening nested nodes of the same type and dropping empty operands"""
+    flat = []
+    for child in children:
+        if child is None:
+            continue
+        if isinstance(child, node_type):
+            flat.extend(child.children)
+        else:
+            flat.append(child)
+    if not flat:
+        return None
+    return flat[0] if len(flat) == 1 else node_type(tuple(flat))
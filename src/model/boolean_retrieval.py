@@ -1,63 +1,171 @@
-from typing import List
+import os
+from typing import List, Callable, Dict, NamedTuple, Optional, Tuple, Hashable, Iterable
 
+import numpy as np
+
+from src.indexing.bitmap_index import BitmapIndex
 from src.indexing.inverted_index import InvertedIndex
+from src.indexing.roaring_bitmap import RoaringBitmap
+from src.model.boolean_query import BooleanNode, TermNode, AndNode, OrNode, compile_boolean_tokens
+from src.model.doc_set import DocSet
 from src.util.constant import AND_OPERATOR, OR_OPERATOR, NOT_OPERATOR
 
+TERM_OPERATOR = "term"
+
+
+class PlanNode(NamedTuple):
+    """A query tree node with the estimated number of matching documents, AND operands ordered cheapest first"""
+    operator: str
+    estimate: int
+    term: Optional[str] = None
+    children: Tuple["PlanNode", ...] = ()
+
 
 class BooleanRetrieval:
-    """Boolean retrieval model"""
+    """Boolean retrieval model.
 
+    Queries are parsed into a tree (see boolean_query), planned with document frequencies and evaluated over
+    roaring bitmaps of internal doc ids. Matches are listed in index order. The bitmaps of every term are
+    precomputed and saved next to the index; until then, or once the index changed, the bitmaps of query
+    terms are built from their postings. ``filters`` are named bitmaps, e.g. of metadata values, that queries
+    can be restricted to.
+    """
     def __init__(self, inverted_index: InvertedIndex):
         self.index = inverted_index
+        self.bitmap_index: Optional[BitmapIndex] = None
+        self.filters: Dict[str, RoaringBitmap] = {}
+        self._index_version = None
+        self._live: Optional[RoaringBitmap] = None
+    def _sync_with_index(self) -> None:
+        """Drop the bitmaps computed before the index last changed"""
+        if self._index_version != self.index.version:
+            self.bitmap_index = None
+            self._live = None
+            self._index_version = self.index.version
+    def search_params(self) -> Dict:
+        """Matches only depend on the index and the query"""
+        return {}
+    def _fingerprint(self) -> Dict:
+        return {"num_docs": len(self.index.doc_ids), "total_docs": self.index.total_docs,
+                "total_length": self.index.total_length, "num_terms": len(self.index.merged_segment().terms)}
+    def precompute(self) -> None:
+        """Build the bitmaps of every term and of the live documents"""
+        self._sync_with_index()
+        self.bitmap_index = BitmapIndex.from_segment(self.index.merged_segment(), self.index.deleted, self.filters)
+        self.filters = dict(self.bitmap_index.filters)
+        self._live = self.bitmap_index.live
+    def save(self, directory: str) -> None:
+        self._sync_with_index()
+        # filters added since the bitmaps were built are saved with them
+        if self.bitmap_index is None or self.bitmap_index.filters != self.filters:
+            self.precompute()
+        self.bitmap_index.save(directory, self._fingerprint())
+    def load(self, directory: str) -> bool:
+        """Attach saved bitmaps. Returns False when they are missing or were built for other content."""
+        if not os.path.exists(os.path.join(directory, "meta.json")):
+            return False
+        self._sync_with_index()
+        bitmap_index, meta = BitmapIndex.load(directory)
+        if {key: meta.get(key) for key in self._fingerprint()} != self._fingerprint():
+            print(f"Ignoring stale bitmap index {directory}")
+            return False
+        self.bitmap_index = bitmap_index
+        self._live = bitmap_index.live
+        self.filters = dict(bitmap_index.filters)
+        return True
+    def add_filter(self, name: str, doc_ids: Iterable[Hashable]) -> None:
+        """Register the documents with the given ids as a named filter, e.g. every law of one issuing body"""
+        doc_id_map = self.index.doc_id_map
+        internal_ids = np.array(sorted({doc_id_map[cid] for cid in doc_ids if cid in doc_id_map}), dtype=np.int64)
+        self.filters[name] = RoaringBitmap.from_sorted(internal_ids)
     def search(self, query_terms: List[str]) -> List[str]:
         """Search using boolean operators
         Args:
-            query_terms (List[str]): list of query terms
+            query_terms (List[str]): list of processed query terms, where 'and', 'or' and 'not' are operators
+        """
+        return self.evaluate(compile_boolean_tokens(query_terms))
+    def search_batch(self, queries: List[List[str]]) -> List[List[str]]:
+        """Search several queries, looking up the bitmap of every distinct term once"""
+        return self.evaluate_batch([compile_boolean_tokens(query_terms) for query_terms in queries])
+    def evaluate(self, node: Optional[BooleanNode], limit: Optional[int] = None,
+                 filter_name: Optional[str] = None) -> List[str]:
+        """
+        Get the documents matching a query tree
+        :param node: Query tree, e.g. from parse_boolean_query. None matches nothing.
+        :param limit: Maximum number of documents to list. Defaults to all.
+        :param filter_name: Only match documents of this filter, see add_filter. Defaults to no filter.
+        :return: Ids of the matching documents, in index order
         """
-        query_term_set = {AND_OPERATOR, OR_OPERATOR, NOT_OPERATOR}
-        if not query_terms:
-            return []
-        first_term = []
-        second_term = []
-        is_first_term = True
-        operator = ""
-        for term in query_terms:
-            if term in query_term_set:
-                is_first_term = False
-                operator = term
+        return self.evaluate_batch([node], limit, filter_name)[0]
+    def evaluate_batch(self, nodes: List[Optional[BooleanNode]], limit: Optional[int] = None,
+                       filter_name: Optional[str] = None) -> List[List[str]]:
+        """Evaluate several query trees, looking up the bitmap of every distinct term once"""
+        return [[self.index.doc_ids[internal_id] for internal_id in matches.tolist()]
+                for matches in self._match_ids(nodes, limit, filter_name)]
+    def match_ids(self, node: Optional[BooleanNode], filter_name: Optional[str] = None) -> np.ndarray:
+        """Get the internal ids of every document matching a query tree, ascending, e.g. to page through them"""
+        return self._match_ids([node], None, filter_name)[0]
+    def _match_ids(self, nodes: List[Optional[BooleanNode]], limit: Optional[int],
+                   filter_name: Optional[str]) -> List[np.ndarray]:
+        self._sync_with_index()
+        if filter_name is not None and filter_name not in self.filters:
+            raise ValueError(f"Unknown filter: {filter_name}")
+        bitmaps: Dict[str, RoaringBitmap] = {}
+        def term_bitmap(term: str) -> RoaringBitmap:
+            if term not in bitmaps:
+                bitmaps[term] = self._term_bitmap(term)
+            return bitmaps[term]
+        results = []
+        for node in nodes:
+            if node is None:
+                results.append(np.zeros(0, dtype=np.int64))
                 continue
-            if is_first_term:
-                first_term.append(term)
+            doc_set = self._execute(self.plan(node), term_bitmap)
+            if filter_name is not None:
+                doc_set = doc_set.intersect(DocSet(self.filters[filter_name]))
+            results.append(self._list(doc_set, limit))
+        return results
+    def _term_bitmap(self, term: str) -> RoaringBitmap:
+        if self.bitmap_index is None:
+            return RoaringBitmap.from_sorted(self.index.get_postings(term)[0])
+        term_id = self.index.merged_segment().term_ids.get(term)
+        if term_id is None:
+            return RoaringBitmap.from_sorted(np.zeros(0, dtype=np.int64))
+        return self.bitmap_index.term_bitmap(term_id)
+    def plan(self, node: BooleanNode) -> PlanNode:
+        """Annotate a query tree with document frequency estimates and order every AND smallest operand first"""
+        if isinstance(node, TermNode):
+            return PlanNode(TERM_OPERATOR, self.index.get_doc_frequency(node.term), node.term)
+        if isinstance(node, (AndNode, OrNode)):
+            children = [self.plan(child) for child in node.children]
+            if isinstance(node, OrNode):
+                return PlanNode(OR_OPERATOR, min(self.index.total_docs, sum(child.estimate for child in children)),
+                                children=tuple(children))
+            # a complement is only cheap to apply by subtraction, so it comes after every positive operand
+            children.sort(key=lambda child: (child.operator == NOT_OPERATOR, child.estimate))
+            return PlanNode(AND_OPERATOR, min(child.estimate for child in children), children=tuple(children))
+        child = self.plan(node.child)
+        return PlanNode(NOT_OPERATOR, self.index.total_docs - child.estimate, children=(child,))
+    def _execute(self, plan: PlanNode, term_bitmap: Callable[[str], RoaringBitmap]) -> DocSet:
+        if plan.operator == TERM_OPERATOR:
+            return DocSet(term_bitmap(plan.term))
+        if plan.operator == NOT_OPERATOR:
+            return self._execute(plan.children[0], term_bitmap).complement()
+        result = self._execute(plan.children[0], term_bitmap)
+        for child in plan.children[1:]:
+            if plan.operator == AND_OPERATOR:
+                if result.is_empty():
+                    # the remaining operands are never read
+                    break
+                result = result.intersect(self._execute(child, term_bitmap))
             else:
-                second_term.append(term)
-        # print("first query terms: ", first_term, "second terms: ", second_term)
-        if operator == "":
-            operator = AND_OPERATOR
-        if operator == AND_OPERATOR:
-            # intersection all document sets
-            all_and_terms = first_term + second_term
-            if not all_and_terms:
-                return []
-
-            result = self.index.get_docs_contain_term(all_and_terms[0])
-            for term in all_and_terms[1:]:
-                result = result.intersection(self.index.get_docs_contain_term(term))
-            return list(result)
-        elif operator == OR_OPERATOR:
-            # Union
-            result = set()
-            for term in first_term:
-                result = result.union(self.index.get_docs_contain_term(term))
-            for term in second_term:
-                result = result.union(self.index.get_docs_contain_term(term))
-            return list(result)
-        elif operator == NOT_OPERATOR:
-            # All documents minus the ones containing the terms
-            all_docs = set(self.index.doc_lengths.keys())
-            excluded = set()
-            for term in first_term:
-                excluded = excluded.union(self.index.get_docs_contain_term(term))
-            for term in second_term:
-                excluded = excluded.union(self.index.get_docs_contain_term(term))
-            return list(all_docs - excluded)
-        return []
\ No newline at end of file
+                result = result.union(self._execute(child, term_bitmap))
+        return result
+    def _list(self, doc_set: DocSet, limit: Optional[int]) -> np.ndarray:
+        """Get the internal ids of a doc set in ascending order, at most ``limit`` of them"""
+        if not doc_set.negated:
+            return doc_set.ids.to_array(limit)
+        if self._live is None:
+            self._live = RoaringBitmap.from_mask(~np.asarray(self.index.deleted))
+        # the complement is a bitmap difference over at most one 8 KB container per 65536 documents
+        return (self._live - doc_set.ids).to_array(limit)
@@ -0,0 +1,34 @@
+from typing import NamedTuple
+
+from src.indexing.roaring_bitmap import RoaringBitmap
+
+
+class DocSet(NamedTuple):
+    """A set of internal doc ids: the ``ids`` bitmap, or when ``negated`` every live document except them.
+
+    A complement is kept as the (usually small) set it excludes, so NOT never enumerates the corpus; it is only
+    resolved when intersected with a positive set, or when results are finally listed.
+    """
+    ids: RoaringBitmap
+    negated: bool = False
+    def complement(self) -> "DocSet":
+        return DocSet(self.ids, not self.negated)
+    def is_empty(self) -> bool:
+        return not self.negated and len(self.ids) == 0
+    def intersect(self, other: "DocSet") -> "DocSet":
+        if not self.negated and not other.negated:
+            return DocSet(self.ids & other.ids)
+        if self.negated and other.negated:
+            # not a and not b = not (a or b)
+            return DocSet(self.ids | other.ids, True)
+        positive, negative = (other, self) if self.negated else (self, other)
+        return DocSet(positive.ids - negative.ids)
+    def union(self, other: "DocSet") -> "DocSet":
+        if not self.negated and not other.negated:
+            return DocSet(self.ids | other.ids)
+        if self.negated and other.negated:
+            # not a or not b = not (a and b)
+            return DocSet(self.ids & other.ids, True)
+        positive, negative = (other, self) if self.negated else (self, other)
+        # a or not b = not (b and not a)
+        return DocSet(negative.ids - positive.ids, True)
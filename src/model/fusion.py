@@ -0,0 +1,43 @@
+from collections import defaultdict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+# the k of Cormack et al.: a document ranked r scores 1 / (k + r), so the first ranks do not dominate
+DEFAULT_RRF_K = 60
+
+Ranking = List[Tuple[str, float]]
+
+
+def _top(fused: Dict[str, float], top_n: Optional[int]) -> Ranking:
+    # ties are broken by doc id, so the fused ranking does not depend on which backend answered first
+    ranking = sorted(fused.items(), key=lambda item: (-item[1], item[0]))
+    return ranking if top_n is None else ranking[:top_n]
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Ranking], weights: Optional[Sequence[float]] = None,
+                           k: int = DEFAULT_RRF_K, top_n: Optional[int] = None) -> Ranking:
+    """Fuse rankings by the weighted sum of 1 / (k + rank) of every document, ranks starting at 1.
+
+    Only ranks are used, so rankings with incomparable scores (BM25, cosine, Elasticsearch) fuse as they are.
+    """
+    weights = weights or [1.0] * len(rankings)
+    fused: Dict[str, float] = defaultdict(float)
+    for ranking, weight in zip(rankings, weights):
+        for rank, (doc_id, _) in enumerate(ranking, 1):
+            fused[doc_id] += weight / (k + rank)
+    return _top(fused, top_n)
+
+
+def weighted_score_fusion(rankings: Sequence[Ranking], weights: Optional[Sequence[float]] = None,
+                          top_n: Optional[int] = None) -> Ranking:
+    """Fuse rankings by the weighted sum of their scores, each ranking min-max scaled to [0, 1] first"""
+    weights = weights or [1.0] * len(rankings)
+    fused: Dict[str, float] = defaultdict(float)
+    for ranking, weight in zip(rankings, weights):
+        if not ranking:
+            continue
+        scores = [score for _, score in ranking]
+        low, high = min(scores), max(scores)
+        for doc_id, score in ranking:
+            # a ranking of equal scores gives all its documents the full weight
+            fused[doc_id] += weight * ((score - low) / (high - low) if high > low else 1.0)
+    return _top(fused, top_n)
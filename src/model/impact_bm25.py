@@ -0,0 +1,86 @@
+import os
+from collections import Counter
+from typing import List, Tuple, Optional, Set, Dict
+
+import numpy as np
+
+from src.indexing.impact_index import ImpactIndex, IMPACT_BITS
+from src.indexing.inverted_index import InvertedIndex
+from src.model.bm25 import OkapiBM25
+from src.model.model import Model
+
+
+class ImpactOrderedBM25(Model):
+    """Approximate BM25 answered score-at-a-time from an impact-ordered, quantized copy of the postings.
+
+    Scores are BM25 contributions quantized to ``bits`` bits at build time, so rankings can differ slightly
+    from OkapiBM25; ``max_postings`` caps the work per query for predictable latency.
+    """
+    def __init__(self, inverted_index: InvertedIndex, k1: float = 1.5, b: float = 0.75, bits: int = IMPACT_BITS,
+                 max_postings: Optional[int] = None):
+        super().__init__()
+        self.index = inverted_index
+        self.k1 = k1
+        self.b = b
+        self.bits = bits
+        self.max_postings = max_postings  # postings read per query before stopping early, None for no budget
+        self.impact_index: Optional[ImpactIndex] = None
+    def _reset_caches(self) -> None:
+        self.impact_index = None
+    def search_params(self) -> Dict:
+        return {"k1": self.k1, "b": self.b, "bits": self.bits, "max_postings": self.max_postings}
+    def _fingerprint(self) -> Dict:
+        return {"num_docs": len(self.index.doc_ids), "total_docs": self.index.total_docs,
+                "total_length": self.index.total_length, "num_terms": len(self.index.merged_segment().terms),
+                "k1": self.k1, "b": self.b, "bits": self.bits}
+    def precompute(self) -> None:
+        """Compute the BM25 contribution of every posting and quantize it"""
+        self._sync_with_index()
+        bm25 = OkapiBM25(self.index, self.k1, self.b)
+        bm25.precompute()
+        segment = self.index.merged_segment()
+        tfs = segment.postings_tfs
+        idf = np.repeat(bm25.term_idf, segment.doc_frequencies())
+        scores = idf * tfs * (self.k1 + 1) / (tfs + bm25.doc_length_norms[segment.postings_doc_ids])
+        self.impact_index = ImpactIndex.from_scores(segment, scores, len(self.index.doc_lengths), self.bits)
+    def save(self, directory: str) -> None:
+        self._sync_with_index()
+        if self.impact_index is None:
+            self.precompute()
+        self.impact_index.save(directory, self._fingerprint())
+    def load(self, directory: str) -> bool:
+        """Attach a saved impact index. Returns False when it is missing or was built for other content."""
+        if not os.path.exists(os.path.join(directory, "meta.json")):
+            return False
+        self._sync_with_index()
+        impact_index, meta = ImpactIndex.load(directory)
+        if {key: meta.get(key) for key in self._fingerprint()} != self._fingerprint():
+            print(f"Ignoring stale impact index {directory}")
+            return False
+        self.impact_index = impact_index
+        return True
+    def search(self, query_terms: List[str], top_n: int = 10,
+               candidates: Optional[Set[str]] = None) -> List[Tuple[str, float]]:
+        """Search with quantized BM25 impacts, score-at-a-time"""
+        if not query_terms:
+            return []
+        self._sync_with_index()
+        if self.impact_index is None:
+            self.precompute()
+        term_ids = self.index.merged_segment().term_ids
+        term_weights = []
+        for term, count in Counter(query_terms).items():
+            term_id = term_ids.get(term)
+            if term_id is not None:
+                term_weights.append((term_id, count))
+        # a candidate filter may discard most of the top documents, so all of them are ranked in that case
+        k = top_n if candidates is None else len(self.index.doc_ids)
+        max_postings = self.max_postings if candidates is None else None
+        top, impacts, _ = self.impact_index.search(term_weights, k, max_postings)
+        results = [
+            (self.index.doc_ids[internal_id], impact / self.impact_index.scale)
+            for internal_id, impact in zip(top.tolist(), impacts.tolist()) if impact > 0
+        ]
+        if candidates is not None:
+            results = [(doc_id, score) for doc_id, score in results if doc_id in candidates]
+        return results[:top_n]
@@ -0,0 +1,185 @@
+import json
+import math
+import os
+from collections import Counter
+from pathlib import Path
+from typing import List, Tuple, Optional, Set, Dict
+
+import numpy as np
+
+from src.indexing.index_storage import save_array
+from src.indexing.inverted_index import InvertedIndex
+from src.indexing.ivf_index import IVFIndex
+from src.model.model import Model, top_k
+
+DEFAULT_DIMENSIONS = 256
+DEFAULT_N_PROBE = 8
+# extra random directions and power iterations of the randomized SVD; both improve the accuracy of the
+# leading singular vectors at the cost of more passes over the postings
+_OVERSAMPLING = 10
+_POWER_ITERATIONS = 2
+# sparse products gather this many postings at a time
+_PRODUCT_CHUNK = 1 << 16
+
+
+class LatentSemanticModel(Model):
+    """Latent semantic indexing: cosine similarity of TF-IDF vectors projected on their leading singular vectors.
+
+    Documents and queries meeting through correlated terms can match without sharing one. Document vectors
+    are float32 unit vectors, memory-mapped once saved, searched through an IVF index probing ``n_probe`` lists.
+    """
+    def __init__(self, inverted_index: InvertedIndex, dimensions: int = DEFAULT_DIMENSIONS,
+                 n_probe: int = DEFAULT_N_PROBE, num_lists: Optional[int] = None, seed: int = 0):
+        super().__init__()
+        self.index = inverted_index
+        self.dimensions = dimensions
+        self.n_probe = n_probe  # IVF lists scanned per query, more for recall and fewer for latency
+        self.num_lists = num_lists  # IVF lists, defaults to about 4 * sqrt(number of documents)
+        self.seed = seed
+        self.term_idf: Optional[np.ndarray] = None  # term id of the merged segment -> idf
+        self.term_vectors: Optional[np.ndarray] = None  # term id -> projection on the latent dimensions
+        self.doc_vectors: Optional[np.ndarray] = None  # internal doc id -> latent unit vector
+        self.ivf: Optional[IVFIndex] = None
+    def _reset_caches(self) -> None:
+        self.term_idf = None
+        self.term_vectors = None
+        self.doc_vectors = None
+        self.ivf = None
+    def search_params(self) -> Dict:
+        return {"dimensions": self.dimensions, "n_probe": self.n_probe, "num_lists": self.num_lists, "seed": self.seed}
+    def _fingerprint(self) -> Dict:
+        fingerprint = {"num_docs": len(self.index.doc_ids), "total_docs": self.index.total_docs,
+                       "total_length": self.index.total_length, "num_terms": len(self.index.merged_segment().terms),
+                       "dimensions": self.dimensions, "seed": self.seed}
+        if self.index.collection_stats is not None:
+            fingerprint["collection"] = self.index.collection_stats.fingerprint()
+        return fingerprint
+    def precompute(self) -> None:
+        """Project the length-normalized TF-IDF matrix on its leading singular vectors and index the documents"""
+        self._sync_with_index()
+        segment = self.index.merged_segment()
+        df = segment.doc_frequencies()
+        num_docs = len(self.index.doc_lengths)
+        # weighted like VectorSpaceModel: by the idf of the whole collection when the index holds a shard of it
+        collection_df = self.index.collection_doc_frequencies(segment)
+        self.term_idf = np.where(collection_df > 0,
+                                 np.log((self.index.collection_total_docs + 1) / (1 + collection_df)) + 1, 0.0)
+        weights = (1 + np.log(segment.postings_tfs)) * np.repeat(self.term_idf, df)
+        doc_norms = np.sqrt(np.bincount(segment.postings_doc_ids, weights=weights ** 2, minlength=num_docs))
+        weights = (weights / doc_norms[segment.postings_doc_ids]).astype(np.float32)
+        # the same matrix in both orders: term-major as stored, and document-major for products on the doc side
+        posting_terms = np.repeat(np.arange(len(df)), df)
+        by_doc = np.argsort(segment.postings_doc_ids, kind="stable")
+        matrix = (segment.postings_doc_ids[by_doc], posting_terms[by_doc], weights[by_doc], num_docs)
+        transposed = (posting_terms, segment.postings_doc_ids, weights, len(df))
+        singular_values, term_vectors, doc_vectors = randomized_svd(matrix, transposed, self.dimensions, self.seed)
+        self.term_vectors = term_vectors
+        norms = np.linalg.norm(doc_vectors, axis=1, keepdims=True)
+        self.doc_vectors = (doc_vectors / np.where(norms > 0, norms, 1)).astype(np.float32)
+        num_lists = self.num_lists or max(1, int(4 * math.sqrt(num_docs)))
+        self.ivf = IVFIndex.build(self.doc_vectors, num_lists, seed=self.seed)
+    def save(self, directory: str) -> None:
+        self._sync_with_index()
+        if self.doc_vectors is None:
+            self.precompute()
+        path = Path(directory)
+        path.mkdir(parents=True, exist_ok=True)
+        save_array(path / "term_idf.npy", self.term_idf)
+        save_array(path / "term_vectors.npy", self.term_vectors)
+        save_array(path / "doc_vectors.npy", self.doc_vectors)
+        self.ivf.save(directory)
+        (path / "meta.json").write_text(json.dumps(self._fingerprint()), encoding="utf-8")
+    def load(self, directory: str) -> bool:
+        """Memory-map saved vectors. Returns False when they are missing or were built for other content."""
+        path = Path(directory)
+        if not os.path.exists(path / "meta.json"):
+            return False
+        self._sync_with_index()
+        if json.loads((path / "meta.json").read_text(encoding="utf-8")) != self._fingerprint():
+            print(f"Ignoring stale LSI index {directory}")
+            return False
+        self.term_idf = np.load(path / "term_idf.npy")
+        self.term_vectors = np.load(path / "term_vectors.npy", mmap_mode="r")
+        self.doc_vectors = np.load(path / "doc_vectors.npy", mmap_mode="r")
+        self.ivf = IVFIndex.load(directory)
+        return True
+    def query_vector(self, query_terms: List[str]) -> Optional[np.ndarray]:
+        """Fold the query TF-IDF vector into the latent space, None when no query term is indexed"""
+        self._sync_with_index()
+        if self.doc_vectors is None:
+            self.precompute()
+        term_ids = self.index.merged_segment().term_ids
+        weighted = []
+        for term, count in Counter(query_terms).items():
+            term_id = term_ids.get(term)
+            if term_id is not None:
+                weighted.append((term_id, 1 + math.log(count)))
+        if not weighted:
+            return None
+        ids = np.array([term_id for term_id, _ in weighted])
+        weights = np.array([weight for _, weight in weighted]) * self.term_idf[ids]
+        vector = weights.astype(np.float32) @ np.asarray(self.term_vectors[ids])
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else None
+    def exact_top(self, query: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Brute-force (internal ids, similarities) of the k most similar documents"""
+        scores = np.asarray(self.doc_vectors) @ query
+        top = top_k(scores, np.arange(len(scores)), k)
+        return top, scores[top]
+    def search(self, query_terms: List[str], top_n: int = 10,
+               candidates: Optional[Set[str]] = None) -> List[Tuple[str, float]]:
+        """Search by cosine similarity in the latent space, through the IVF index"""
+        if not query_terms:
+            return []
+        query = self.query_vector(query_terms)
+        if query is None:
+            return []
+        if candidates is None:
+            top, scores = self.ivf.search(self.doc_vectors, query, top_n, self.n_probe)
+        else:
+            # candidates are few, so they are all scored exactly
+            doc_id_map = self.index.doc_id_map
+            eligible = np.array(sorted(doc_id_map[cid] for cid in candidates if cid in doc_id_map), dtype=np.int64)
+            candidate_scores = np.asarray(self.doc_vectors[eligible]) @ query
+            best = top_k(candidate_scores, np.arange(len(eligible)), top_n)
+            top, scores = eligible[best], candidate_scores[best]
+        # documents without an indexed term, deleted ones included, have a zero vector and never match
+        return [(self.index.doc_ids[internal_id], score) for internal_id, score in zip(top.tolist(), scores.tolist())
+                if score > 0]
+
+
+def sparse_product(matrix: Tuple[np.ndarray, np.ndarray, np.ndarray, int], dense: np.ndarray) -> np.ndarray:
+    """Multiply a sparse matrix given as (row ids sorted, column ids, values, number of rows) by a dense matrix"""
+    rows, columns, values, num_rows = matrix
+    product = np.zeros((num_rows, dense.shape[1]), dtype=np.float32)
+    for start in range(0, len(rows), _PRODUCT_CHUNK):
+        chunk_rows = rows[start:start + _PRODUCT_CHUNK]
+        block = dense[columns[start:start + _PRODUCT_CHUNK]] * values[start:start + _PRODUCT_CHUNK, None]
+        # rows are sorted, so each row of the chunk is a run and reduceat sums it in one call
+        row_starts = np.flatnonzero(np.concatenate(([True], chunk_rows[1:] != chunk_rows[:-1])))
+        product[chunk_rows[row_starts]] += np.add.reduceat(block, row_starts, axis=0)
+    return product
+
+
+def randomized_svd(matrix: Tuple[np.ndarray, np.ndarray, np.ndarray, int],
+                   transposed: Tuple[np.ndarray, np.ndarray, np.ndarray, int], rank: int,
+                   seed: int = 0) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Truncated SVD A ~ U S V^T of a sparse matrix, by randomized range finding (Halko, Martinsson and Tropp).
+
+    ``matrix`` and ``transposed`` are A and A^T in the form taken by sparse_product. Returns (S, V, U S), so the
+    rows of U S are the projections A V of the rows of A.
+    """
+    num_rows, num_columns = matrix[3], transposed[3]
+    rank = max(1, min(rank, num_rows, num_columns))
+    width = min(rank + _OVERSAMPLING, num_rows, num_columns)
+    rng = np.random.default_rng(seed)
+    range_basis, _ = np.linalg.qr(sparse_product(matrix, rng.standard_normal((num_columns, width), dtype=np.float32)))
+    for _ in range(_POWER_ITERATIONS):
+        # re-orthonormalize between products, otherwise the smaller singular directions are lost to rounding
+        co_range, _ = np.linalg.qr(sparse_product(transposed, range_basis))
+        range_basis, _ = np.linalg.qr(sparse_product(matrix, co_range))
+    # A^T Q is small enough for a dense SVD: A ~ Q (A^T Q)^T
+    projected = sparse_product(transposed, range_basis)
+    term_vectors, singular_values, small_vectors = np.linalg.svd(projected, full_matrices=False)
+    left = range_basis @ small_vectors.T[:, :rank]
+    return singular_values[:rank], term_vectors[:, :rank].astype(np.float32), left * singular_values[:rank]
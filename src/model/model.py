@@ -1,17 +1,103 @@
 from abc import abstractmethod, ABC
-from typing import List, Tuple
+from collections import defaultdict
+from typing import List, Tuple, Optional, Set, Dict, Callable, Iterator
+
+import numpy as np
+
+# dense (queries x documents) score blocks of a batch are capped at this many cells, i.e. 128 MB of float64
+QUERY_BATCH_CELLS = 1 << 24
 
 
 class Model(ABC):
     def __init__(self):
         self.index = None
+        self._index_version = None
+    def _sync_with_index(self) -> None:
+        """Drop cached statistics computed before the index last changed"""
+        if self._index_version != self.index.version:
+            self._reset_caches()
+            self._index_version = self.index.version
+    def _reset_caches(self) -> None:
+        pass
+    def precompute(self) -> None:
+        """Compute the statistics the model would otherwise compute lazily, e.g. before saving a sidecar"""
+        pass
+    def sidecar_state(self) -> Tuple[Dict, Dict[str, np.ndarray]]:
+        """Get the (parameters, precomputed arrays) persisted next to the index"""
+        return {}, {}
+    def attach_sidecar(self, params: Dict, arrays: Dict[str, np.ndarray]) -> None:
+        """Restore the state returned by sidecar_state() for the current index"""
+        pass
+    def search_params(self) -> Dict:
+        """Get the parameters that, besides the index and the query, determine the results"""
+        return {}
     @abstractmethod
-    def search(self, query_terms: List[str], top_n: int = 10) -> List[Tuple[str, float]]:
+    def search(self, query_terms: List[str], top_n: int = 10,
+               candidates: Optional[Set[str]] = None) -> List[Tuple[str, float]]:
         """Search using the model
         Args:
             query_terms (List[str]): list of query terms
             top_n (int, optional): top n results. Defaults to 10.
+            candidates (Set[str], optional): only rank these documents, e.g. the matches of a phrase query.
+                Defaults to every document containing a query term.
         Returns:
             List of (doc_id, score) tuples
         """
-        pass
\ No newline at end of file
+        pass
+    def search_batch(self, queries: List[List[str]], top_n: int = 10) -> List[List[Tuple[str, float]]]:
+        """Search several tokenized queries, returning the results of each in order"""
+        return [self.search(query_terms, top_n) for query_terms in queries]
+    def rank_all(self, query_terms: List[str],
+                 candidates: Optional[Set[str]] = None) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """Score every document search() could return, e.g. to page through the results without searching again.
+
+        Returns the ascending internal ids and their scores, ranked by search() with ties broken by internal id,
+        or None when search() only scores its top documents exactly.
+        """
+        return None
+
+
+def top_k(scores: np.ndarray, eligible: np.ndarray, k: int) -> np.ndarray:
+    """Get the k eligible internal ids with the highest scores, ties broken by ascending internal id"""
+    if k <= 0:
+        return eligible[:0]
+    if len(eligible) > k:
+        # a partial sort keeps an arbitrary subset of the ties at the cut, so every tied document is kept
+        threshold = np.partition(scores[eligible], len(eligible) - k)[len(eligible) - k]
+        eligible = eligible[scores[eligible] >= threshold]
+    order = np.lexsort((eligible, -scores[eligible]))
+    return eligible[order[:k]]
+
+
+def score_batch(weighted_queries: List[List[Tuple[float, str]]],
+                term_values: Callable[[str], Tuple[np.ndarray, np.ndarray]],
+                num_docs: int) -> Iterator[Tuple[int, np.ndarray]]:
+    """Score a batch of queries as a sparse (query x term) by (term x document) matrix product.
+
+    A query is a list of (weight, term) and scores weight * value summed over its terms, where ``term_values``
+    gives the internal doc ids and values of a term. Every distinct term of the batch is fetched once. Round r
+    adds the r-th term of every query, so each query sums its terms in its own order, exactly as scoring it alone.
+    Yields (index of the first query, dense score rows) for blocks of queries of at most QUERY_BATCH_CELLS cells.
+    """
+    values: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+    block_size = max(1, QUERY_BATCH_CELLS // max(num_docs, 1))
+    for block_start in range(0, len(weighted_queries), block_size):
+        block = weighted_queries[block_start:block_start + block_size]
+        scores = np.zeros((len(block), num_docs))
+        for rank in range(max((len(query) for query in block), default=0)):
+            rows_by_term = defaultdict(list)  # term -> [(row, weight)]
+            for row, query in enumerate(block):
+                if rank < len(query):
+                    weight, term = query[rank]
+                    rows_by_term[term].append((row, weight))
+            for term, rows in rows_by_term.items():
+                if term not in values:
+                    values[term] = term_values(term)
+                doc_ids, doc_values = values[term]
+                if len(doc_ids) == 0:
+                    continue
+                # doc ids are unique within a posting list, so fancy-index accumulation is safe
+                for row, weight in rows:
+                    row_scores = scores[row]
+                    row_scores[doc_ids] += weight * doc_values
+        yield block_start, scores
@@ -0,0 +1,57 @@
+import json
+import os
+from pathlib import Path
+from typing import Dict
+
+import numpy as np
+
+from src.indexing.inverted_index import InvertedIndex
+from src.model.model import Model
+
+# A sidecar is a small .npz next to the index holding one model's parameters and precomputed arrays. It
+# never embeds the index: models attach to the single shared index and only restore their own statistics.
+SIDECAR_VERSION = 1
+
+
+def _fingerprint(index: InvertedIndex) -> Dict:
+    """Describe the indexed content, so a sidecar saved for another index is never attached"""
+    fingerprint = {
+        "num_docs": len(index.doc_ids),
+        "num_terms": len(index.merged_segment().terms),
+        "total_docs": index.total_docs,
+        "total_length": index.total_length,
+    }
+    if index.collection_stats is not None:
+        # statistics computed for a shard depend on the whole collection
+        fingerprint["collection"] = index.collection_stats.fingerprint()
+    return fingerprint
+
+
+def save_sidecar(file_path: str, model: Model) -> None:
+    # statistics cached before the last index update must not be saved as those of the current index
+    model._sync_with_index()
+    params, arrays = model.sidecar_state()
+    meta = {"version": SIDECAR_VERSION, "model": type(model).__name__, "index": _fingerprint(model.index),
+            "params": params}
+    path = Path(file_path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(path.name + ".tmp")
+    with tmp_path.open("wb") as file:
+        np.savez(file, meta=np.array(json.dumps(meta)), **arrays)
+    os.replace(tmp_path, path)
+
+
+def load_sidecar(file_path: str, model: Model) -> bool:
+    """Attach a saved sidecar to a model. Returns False, leaving the model to compute its statistics
+    lazily, when the file is missing or was saved for other content."""
+    if not os.path.exists(file_path):
+        return False
+    with np.load(file_path) as sidecar:
+        meta = json.loads(str(sidecar["meta"]))
+        if (meta["version"] != SIDECAR_VERSION or meta["model"] != type(model).__name__
+                or meta["index"] != _fingerprint(model.index)):
+            print(f"Ignoring stale sidecar {file_path}")
+            return False
+        arrays = {name: sidecar[name] for name in sidecar.files if name != "meta"}
+    model.attach_sidecar(meta["params"], arrays)
+    return True
@@ -0,0 +1,124 @@
+import secrets
+from typing import Callable, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+from src.model.model import top_k
+
+DEFAULT_CURSORS = 256
+DEFAULT_CURSOR_BYTES = 256 << 20
+DEFAULT_CURSOR_TTL_SECONDS = 600.0
+# documents ranked at least at a time, a chunk grows with the ranked prefix so deep pages stay amortized
+DEFAULT_RANK_CHUNK = 1024
+# approximate bytes held per result of a DeepeningRanking: a tuple, a doc id string and a float
+_RESULT_BYTES = 160
+
+Results = List[Tuple[str, float]]
+
+
+class ResultPage(NamedTuple):
+    results: Results
+    next_cursor: Optional[str]  # None on the last page
+
+
+def new_cursor_id() -> str:
+    return secrets.token_urlsafe(12)
+
+
+def encode_cursor(cursor_id: str, offset: int) -> str:
+    return f"{cursor_id}.{offset}"
+
+
+def decode_cursor(cursor: str) -> Tuple[str, int]:
+    """Split a cursor into the id of its state and the offset of the page it points to"""
+    cursor_id, _, offset = cursor.rpartition(".")
+    if not cursor_id or not offset.isdigit():
+        raise ValueError(f"Malformed cursor: {cursor}")
+    return cursor_id, int(offset)
+
+
+class RankedCandidates:
+    """Every match of a query with its score, ranked a chunk at a time as pages reach it.
+
+    The order is that of top_k: descending score, ties by ascending internal id. Without scores the matches
+    are listed in index order. Ranking the next chunk costs a partial sort of the matches not ranked yet, so
+    a page of a ranked prefix is a slice and the first pages never sort the whole set.
+    """
+    def __init__(self, ids: np.ndarray, scores: Optional[np.ndarray], doc_ids: Sequence[str],
+                 chunk_size: int = DEFAULT_RANK_CHUNK):
+        """
+        :param ids: Ascending internal ids of the matches.
+        :param scores: Score of every match, or None to list them in index order.
+        :param doc_ids: Internal id -> doc id of the index the ids come from.
+        :param chunk_size: Minimum number of matches ranked at a time.
+        """
+        ids = np.asarray(ids)
+        # internal ids fit in 32 bits, which halves the state kept per cursor
+        self._ids = ids.astype(np.int32) if len(ids) and ids.max() < 2 ** 31 else ids
+        self._scores = None if scores is None else np.asarray(scores, dtype=np.float64)
+        self.doc_ids = doc_ids
+        self.chunk_size = chunk_size
+        self.total = len(ids)
+        self._ranked_ids = self._ids[:0] if scores is not None else self._ids
+        self._ranked_scores = np.zeros(0)
+    def __len__(self) -> int:
+        return self.total
+    def has_more(self, end: int) -> bool:
+        return end < self.total
+    @property
+    def nbytes(self) -> int:
+        scores = 0 if self._scores is None else self._scores.nbytes + self._ranked_scores.nbytes
+        ranked = self._ranked_ids.nbytes if self._scores is not None else 0
+        return self._ids.nbytes + ranked + scores
+    def _rank_more(self, count: int) -> None:
+        best = top_k(self._scores, np.arange(len(self._scores)), count)
+        self._ranked_ids = np.concatenate([self._ranked_ids, self._ids[best]])
+        self._ranked_scores = np.concatenate([self._ranked_scores, self._scores[best]])
+        # the rest stays in ascending internal id order, so ties keep being broken the same way
+        rest = np.ones(len(self._ids), dtype=bool)
+        rest[best] = False
+        self._ids, self._scores = self._ids[rest], self._scores[rest]
+    def page(self, offset: int, count: int) -> Results:
+        end = min(offset + count, self.total)
+        if self._scores is None:
+            return [(self.doc_ids[internal_id], 1.0) for internal_id in self._ranked_ids[offset:end].tolist()]
+        if end > len(self._ranked_ids):
+            self._rank_more(max(self.chunk_size, len(self._ranked_ids), end - len(self._ranked_ids)))
+        return [(self.doc_ids[internal_id], score) for internal_id, score
+                in zip(self._ranked_ids[offset:end].tolist(), self._ranked_scores[offset:end].tolist())]
+
+
+class DeepeningRanking:
+    """The results of a search that only ranks its top n, searched again at twice the depth once paged past.
+
+    Used for approximate models, whose top n is not a prefix of a complete ranking that could be kept instead.
+    A deeper search may keep other documents among ties at its cut, so only the documents not found yet are
+    appended and pages already served never change.
+    """
+    def __init__(self, search: Callable[[int], Results], depth: int = DEFAULT_RANK_CHUNK,
+                 results: Optional[Results] = None):
+        """
+        :param search: Gets the results of the query at a depth.
+        :param depth: Depth of the first search.
+        :param results: Results of the first search when already searched.
+        """
+        self.search = search
+        self.depth = depth
+        self.results = results if results is not None else search(depth)
+        self.exhausted = len(self.results) < depth
+    def __len__(self) -> int:
+        """Number of results found so far, all of them once exhausted"""
+        return len(self.results)
+    def has_more(self, end: int) -> bool:
+        return end < len(self.results) or not self.exhausted
+    @property
+    def nbytes(self) -> int:
+        return _RESULT_BYTES * len(self.results)
+    def page(self, offset: int, count: int) -> Results:
+        while offset + count > len(self.results) and not self.exhausted:
+            self.depth = max(2 * self.depth, offset + count)
+            deeper = self.search(self.depth)
+            found = {doc_id for doc_id, _ in self.results}
+            self.results += [result for result in deeper if result[0] not in found]
+            self.exhausted = len(deeper) < self.depth
+        return self.results[offset:offset + count]
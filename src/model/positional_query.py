@@ -0,0 +1,63 @@
+import re
+from typing import List, NamedTuple, Tuple, Union
+
+from src.preprocessing.text_processor import TextProcessor
+
+# A query may mix free text with quoted phrases ("thuế thu nhập cá nhân") and proximity operators
+# (hải_quan NEAR/5 "thuế nhập khẩu"). Operands of NEAR/k are the adjacent phrase or word.
+_QUERY_TOKEN_PATTERN = re.compile(r'"(?P<phrase>[^"]*)"|(?P<near>\bNEAR/(?P<distance>\d+)\b)|(?P<word>[^\s"]+)')
+
+
+class PhraseConstraint(NamedTuple):
+    terms: List[str]
+
+
+class ProximityConstraint(NamedTuple):
+    left: List[str]
+    right: List[str]
+    distance: int  # maximum number of positions between the end of one operand and the start of the other
+
+
+PositionalConstraint = Union[PhraseConstraint, ProximityConstraint]
+
+
+def has_positional_operators(query: str) -> bool:
+    return '"' in query or "NEAR/" in query
+
+
+def parse_positional_query(query: str, processor: TextProcessor) -> Tuple[List[PositionalConstraint], List[str]]:
+    """
+    Split a query into positional constraints and the terms used for ranking
+    :param query: Raw query string.
+    :param processor: Text processor applied to every phrase and word, as at indexing time.
+    :return: (constraints, query terms). Query terms include the terms of every constraint.
+    """
+    items = []  # ("phrase" | "word" | "near", text or distance)
+    for match in _QUERY_TOKEN_PATTERN.finditer(query):
+        if match.group("phrase") is not None:
+            items.append(("phrase", match.group("phrase")))
+        elif match.group("near") is not None:
+            items.append(("near", int(match.group("distance"))))
+        else:
+            items.append(("word", match.group("word")))
+
+    constraints: List[PositionalConstraint] = []
+    free_text: List[str] = []
+    operand_indexes = set()
+    for i, (kind, value) in enumerate(items):
+        if kind != "near":
+            continue
+        if 0 < i < len(items) - 1 and items[i - 1][0] != "near" and items[i + 1][0] != "near":
+            left = processor.process_text(items[i - 1][1])
+            right = processor.process_text(items[i + 1][1])
+            if left and right:
+                constraints.append(ProximityConstraint(left, right, value))
+            operand_indexes.update((i - 1, i + 1))
+    for i, (kind, value) in enumerate(items):
+        if kind == "phrase" and i not in operand_indexes:
+            terms = processor.process_text(value)
+            if terms:
+                constraints.append(PhraseConstraint(terms))
+        if kind != "near":
+            free_text.append(value)
+    return constraints, processor.process_text(" ".join(free_text))
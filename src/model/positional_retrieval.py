@@ -0,0 +1,87 @@
+from typing import List, Set
+
+import numpy as np
+
+from src.indexing.compression import PositionReader
+from src.indexing.inverted_index import InvertedIndex
+from src.indexing.roaring_bitmap import intersect_sorted
+from src.model.positional_query import PositionalConstraint, PhraseConstraint, ProximityConstraint
+
+
+class PositionalMatcher:
+    """Phrase and proximity matching over the positional index.
+
+    Candidates are narrowed by intersecting doc ids, rarest term first, and only the survivors have their
+    positions decoded and verified.
+    """
+    def __init__(self, inverted_index: InvertedIndex):
+        self.index = inverted_index
+    def _intersect_terms(self, terms: List[str]) -> np.ndarray:
+        postings = sorted((self.index.get_postings(term)[0] for term in set(terms)), key=len)
+        result = postings[0]
+        for doc_ids in postings[1:]:
+            if len(result) == 0:
+                break
+            result = intersect_sorted(result, doc_ids)
+        return result
+    def _readers(self, terms: List[str], internal_id: int) -> List[PositionReader]:
+        return [self.index.position_reader(term, internal_id) for term in terms]
+    @staticmethod
+    def _contains_phrase(readers: List[PositionReader]) -> bool:
+        start = 0
+        while True:
+            first = readers[0].skip_to(start)
+            if first is None:
+                return False
+            for offset, reader in enumerate(readers[1:], 1):
+                position = reader.skip_to(first + offset)
+                if position is None:
+                    return False
+                if position != first + offset:
+                    start = position - offset  # earliest start still compatible with this term
+                    break
+            else:
+                return True
+    def _phrase_starts(self, terms: List[str], internal_id: int) -> np.ndarray:
+        """Get every position where the phrase starts in a document"""
+        starts = self.index.position_reader(terms[0], internal_id).to_array()
+        for offset, term in enumerate(terms[1:], 1):
+            positions = self.index.position_reader(term, internal_id).to_array()
+            starts = np.intersect1d(starts, positions - offset, assume_unique=True)
+        return starts
+    @staticmethod
+    def _within(left_starts: np.ndarray, left_length: int, right_starts: np.ndarray, distance: int) -> bool:
+        """Check whether an occurrence of right starts at most ``distance`` positions after one of left ends"""
+        if len(left_starts) == 0 or len(right_starts) == 0:
+            return False
+        left_ends = left_starts + left_length - 1
+        following = np.searchsorted(right_starts, left_ends + 1)
+        valid = following < len(right_starts)
+        return bool(np.any(right_starts[following[valid]] - left_ends[valid] <= distance))
+    def match_internal(self, constraints: List[PositionalConstraint]) -> np.ndarray:
+        """Get the internal ids of documents satisfying every constraint"""
+        all_terms = [term for constraint in constraints for term in self._constraint_terms(constraint)]
+        candidates = self._intersect_terms(all_terms)
+        for constraint in constraints:
+            if isinstance(constraint, PhraseConstraint):
+                keep = [
+                    self._contains_phrase(self._readers(constraint.terms, internal_id))
+                    for internal_id in candidates.tolist()
+                ]
+            else:
+                keep = [self._matches_proximity(constraint, internal_id) for internal_id in candidates.tolist()]
+            candidates = candidates[np.array(keep, dtype=bool)] if len(candidates) else candidates
+        return candidates
+    def _matches_proximity(self, constraint: ProximityConstraint, internal_id: int) -> bool:
+        left = self._phrase_starts(constraint.left, internal_id)
+        right = self._phrase_starts(constraint.right, internal_id)
+        return (self._within(left, len(constraint.left), right, constraint.distance)
+                or self._within(right, len(constraint.right), left, constraint.distance))
+    @staticmethod
+    def _constraint_terms(constraint: PositionalConstraint) -> List[str]:
+        if isinstance(constraint, PhraseConstraint):
+            return constraint.terms
+        return constraint.left + constraint.right
+    def match(self, constraints: List[PositionalConstraint]) -> Set[str]:
+        """Get the ids of documents satisfying every constraint"""
+        return {self.index.doc_ids[internal_id] for internal_id in self.match_internal(constraints).tolist()}
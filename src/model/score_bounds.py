@@ -0,0 +1,53 @@
+from typing import NamedTuple, Tuple
+
+import numpy as np
+
+from src.indexing.index_segment import IndexSegment
+
+SCORE_BLOCK_SIZE = 128
+# bounds and exact scores are rounded differently, so comparisons against the threshold leave this much slack
+BOUND_SLACK = 1 + 1e-9
+
+
+class BlockMaxBounds(NamedTuple):
+    """Upper bounds of the saturated term frequency ``tf / (tf + length_norm)`` of every posting.
+
+    The postings of term id ``t`` are cut into blocks of ``SCORE_BLOCK_SIZE``; its blocks are
+    ``block_offsets[t]:block_offsets[t + 1]``. A block covers the internal doc ids from its
+    ``block_first_docs`` entry up to the next block's, and ``block_max`` bounds every posting in it.
+    Multiplied by a term's query weight, these bound its BM25 contribution.
+    """
+    block_offsets: np.ndarray
+    block_first_docs: np.ndarray
+    block_max: np.ndarray
+    term_max: np.ndarray
+    @classmethod
+    def compute(cls, segment: IndexSegment, length_norms: np.ndarray,
+                block_size: int = SCORE_BLOCK_SIZE) -> "BlockMaxBounds":
+        tfs = segment.postings_tfs
+        ratios = tfs / (tfs + length_norms[segment.postings_doc_ids])
+        df = segment.doc_frequencies()
+        num_blocks = -(-df // block_size)
+        block_offsets = np.zeros(len(df) + 1, dtype=np.int64)
+        np.cumsum(num_blocks, out=block_offsets[1:])
+        block_terms = np.repeat(np.arange(len(df)), num_blocks)
+        block_ranks = np.arange(block_offsets[-1]) - block_offsets[block_terms]
+        block_starts = segment.term_offsets[block_terms] + block_ranks * block_size
+        if len(block_starts) == 0:
+            empty = np.zeros(0)
+            return cls(block_offsets, empty.astype(np.int32), empty, np.zeros(len(df)))
+        # blocks tile the postings without gaps, so one reduceat computes every block maximum
+        block_max = np.maximum.reduceat(ratios, block_starts)
+        term_max = np.zeros(len(df))
+        has_blocks = num_blocks > 0
+        term_max[has_blocks] = np.maximum.reduceat(block_max, block_offsets[:-1][has_blocks])
+        return cls(block_offsets, segment.postings_doc_ids[block_starts], block_max, term_max)
+    def block_range(self, term_id: int) -> Tuple[int, int]:
+        return int(self.block_offsets[term_id]), int(self.block_offsets[term_id + 1])
+    def doc_bounds(self, term_id: int, doc_ids: np.ndarray) -> np.ndarray:
+        """Get the block bound of a term for every (sorted) internal doc id, 0 before its first posting"""
+        start, end = self.block_range(term_id)
+        blocks = np.searchsorted(self.block_first_docs[start:end], doc_ids, side="right") - 1
+        bounds = self.block_max[start + np.maximum(blocks, 0)]
+        bounds[blocks < 0] = 0
+        return bounds
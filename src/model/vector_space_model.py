@@ -1,9 +1,11 @@
 import math
 from collections import Counter
-from typing import List, Tuple
+from typing import List, Tuple, Optional, Set, Dict
+
+import numpy as np
 
 from src.indexing.inverted_index import InvertedIndex
-from src.model.model import Model
+from src.model.model import Model, top_k, score_batch
 
 
 class VectorSpaceModel(Model):
@@ -11,16 +13,48 @@ class VectorSpaceModel(Model):
         super().__init__()
         self.index = inverted_index
         self.idf_cache = {}
+        self.doc_norms: Optional[np.ndarray] = None  # internal doc id -> TF-IDF vector norm
+        self.term_idf: Optional[np.ndarray] = None  # term id of the merged segment -> idf, once precomputed
+    def _reset_caches(self) -> None:
+        self.idf_cache = {}
+        self.doc_norms = None
+        self.term_idf = None
+    def precompute(self) -> None:
+        self._sync_with_index()
+        segment = self.index.merged_segment()
+        term_idf = self._idf(self.index.collection_doc_frequencies(segment))
+        # the TF-IDF weights of the postings are only needed for the norms here: queries weigh the postings
+        # of their terms on the fly, so the weights never take 8 bytes per posting in memory or in the sidecar
+        weights = (1 + np.log(segment.postings_tfs)) * np.repeat(term_idf, segment.doc_frequencies())
+        squared = np.bincount(segment.postings_doc_ids, weights=weights ** 2, minlength=len(self.index.doc_lengths))
+        self.term_idf = term_idf
+        # published last: readers take doc_norms as the sign that every table is ready
+        self.doc_norms = np.sqrt(squared)
+    def sidecar_state(self) -> Tuple[Dict, Dict[str, np.ndarray]]:
+        if self.term_idf is None or self.doc_norms is None:
+            self.precompute()
+        return {}, {"term_idf": self.term_idf, "doc_norms": self.doc_norms}
+    def attach_sidecar(self, params: Dict, arrays: Dict[str, np.ndarray]) -> None:
+        self._sync_with_index()
+        self.term_idf = arrays["term_idf"]
+        self.doc_norms = arrays["doc_norms"]
     def compute_idf(self, term: str) -> float:
         """compute IDf for a term"""
+        self._sync_with_index()
+        if self.term_idf is not None:
+            term_id = self.index.merged_segment().term_ids.get(term)
+            if term_id is not None:
+                return float(self.term_idf[term_id])
+            # a term missing from a shard still weighs in the query norm with its collection idf
+            if self.index.collection_stats is None:
+                return 0
         if term not in self.idf_cache:
-            df = self.index.get_doc_frequency(term)
-            if df > 0:
-                # idf smoothing like in sklearn
-                self.idf_cache[term] = math.log((self.index.total_docs + 1) / (1 + df)) + 1
-            else:
-                self.idf_cache[term] = 0
+            self.idf_cache[term] = float(self._idf(np.array([self.index.collection_doc_frequency(term)]))[0])
         return self.idf_cache[term]
+    def _idf(self, df: np.ndarray) -> np.ndarray:
+        """idf smoothing like in sklearn, 0 for terms in no document. Every idf goes through the same vectorized
+        log, so shards of a collection compute bit-identical weights."""
+        return np.where(df > 0, np.log((self.index.collection_total_docs + 1) / (1 + df)) + 1, 0.0)
     def compute_tf_idf(self, term: str, doc_id: str) -> float:
         """Compute TF-IDF score for a term in a document"""
         tf = self.index.get_term_frequency(term, doc_id)
@@ -29,48 +63,79 @@ class VectorSpaceModel(Model):
         tf_normalized = 1 + math.log(tf)
         idf = self.compute_idf(term)
         return tf_normalized * idf
-    def search(self, query_terms: List[str], top_n: int = 10) -> List[Tuple[str, float]]:
-        """Search using cosine similarity with TF-IDF"""
-        if not query_terms:
+    def _ensure_weights(self) -> None:
+        self._sync_with_index()
+        if self.doc_norms is None:
+            self.precompute()
+    def _doc_tf_idf(self, term: str) -> Tuple[np.ndarray, np.ndarray]:
+        """Get the internal doc ids of a term and its TF-IDF weight (1 + log tf) * idf in each"""
+        segment = self.index.merged_segment()
+        term_id = segment.term_ids.get(term)
+        if term_id is None:
+            return segment.postings_doc_ids[:0], np.zeros(0)
+        start, end = segment.term_offsets[term_id], segment.term_offsets[term_id + 1]
+        weights = (1 + np.log(segment.postings_tfs[start:end])) * self.term_idf[term_id]
+        return segment.postings_doc_ids[start:end], weights
+    def _query_weights(self, query_terms: List[str]) -> List[Tuple[float, str]]:
+        """Get the TF-IDF weight of every distinct query term, in order of first occurrence"""
+        return [((1 + math.log(freq)) * self.compute_idf(term), term) for term, freq in Counter(query_terms).items()]
+    def _similarities(self, weighted: List[Tuple[float, str]], dot_products: np.ndarray,
+                      eligible: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Get the eligible documents that can match and their cosine similarity, given their dot products"""
+        query_norm = math.sqrt(sum(weight ** 2 for weight, _ in weighted))
+        # documents without any weight have no direction and are never returned
+        eligible = eligible[self.doc_norms[eligible] > 0]
+        if query_norm == 0:
+            eligible = eligible[:0]
+        return eligible, dot_products[eligible] / (query_norm * self.doc_norms[eligible])
+    def _cosine_top(self, weighted: List[Tuple[float, str]], dot_products: np.ndarray, eligible: np.ndarray,
+                    top_n: int) -> List[Tuple[str, float]]:
+        """Rank eligible documents by cosine similarity given their dot products with the query"""
+        eligible, eligible_similarities = self._similarities(weighted, dot_products, eligible)
+        if len(eligible) == 0:
             return []
-        # Get candidate documents (union of all documents containing any query term)
-        candidates = set()
-        for term in query_terms:
-            candidates.update(self.index.get_docs_contain_term(term))
-        if not candidates:
+        similarities = np.zeros(len(dot_products))
+        similarities[eligible] = eligible_similarities
+        top = top_k(similarities, eligible, top_n)
+        return [(self.index.doc_ids[internal_id], score) for internal_id, score in zip(top.tolist(), similarities[top].tolist())]
+    def search(self, query_terms: List[str], top_n: int = 10,
+               candidates: Optional[Set[str]] = None) -> List[Tuple[str, float]]:
+        """Search using cosine similarity with TF-IDF, as a sparse dot product over the query term postings"""
+        if not query_terms:
             return []
-        query_tf = Counter(query_terms)
-        query_vector = {} # term -> idf value
-        query_norm = 0
-
-        for term, freq in query_tf.items():
-            tf_normalized = 1 + math.log(freq)
-            idf = self.compute_idf(term)
-            tf_idf_value = tf_normalized * idf
-            query_vector[term] = tf_idf_value
-            query_norm += tf_idf_value ** 2
-        query_norm = math.sqrt(query_norm)
-        # compute cosine similarity for each candidate document
-        scores = []
-        for doc_id in candidates:
-            dot_product = 0
-            doc_norm = 0
-
-            # only consider terms appeared in both query and document
-            for term, query_tfidf in query_vector.items():
-                if term in self.index.term_docs:
-                    doc_tfidf = self.compute_tf_idf(term, doc_id)
-                    dot_product += query_tfidf * doc_tfidf
-            # compute document norm
-            for term in self.index.doc_terms[doc_id]:
-                doc_tfidf = self.compute_tf_idf(term, doc_id)
-                doc_norm += doc_tfidf ** 2
-            doc_norm = math.sqrt(doc_norm)
-
-            # cosine similarity
-            if doc_norm > 0 and query_norm > 0:
-                similarity = dot_product / (query_norm * doc_norm)
-                scores.append((doc_id, similarity))
-        # Sort by score and return the top n results
-        scores.sort(key = lambda x : x[1], reverse=True)
-        return scores[:top_n]
\ No newline at end of file
+        weighted, dot_products, eligible = self._dot_products(query_terms, candidates)
+        return self._cosine_top(weighted, dot_products, eligible, top_n)
+    def rank_all(self, query_terms: List[str],
+                 candidates: Optional[Set[str]] = None) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        if not query_terms:
+            return np.zeros(0, dtype=np.int64), np.zeros(0)
+        return self._similarities(*self._dot_products(query_terms, candidates))
+    def _dot_products(self, query_terms: List[str],
+                      candidates: Optional[Set[str]]) -> Tuple[List[Tuple[float, str]], np.ndarray, np.ndarray]:
+        """Get the query term weights, the dot product of the query with every document and the eligible ones"""
+        self._ensure_weights()
+        weighted = self._query_weights(query_terms)
+        dot_products = np.zeros(len(self.doc_norms))
+        touched = np.zeros(len(self.doc_norms), dtype=bool)
+        for weight, term in weighted:
+            doc_ids, doc_weights = self._doc_tf_idf(term)
+            # doc ids are unique within a posting list, so fancy-index accumulation is safe
+            dot_products[doc_ids] += weight * doc_weights
+            touched[doc_ids] = True
+        # candidate documents are the ones containing a query term, unless restricted by the caller
+        if candidates is None:
+            eligible = np.flatnonzero(touched)
+        else:
+            doc_id_map = self.index.doc_id_map
+            eligible = np.array(sorted(doc_id_map[cid] for cid in candidates if cid in doc_id_map), dtype=np.int64)
+        return weighted, dot_products, eligible
+    def search_batch(self, queries: List[List[str]], top_n: int = 10) -> List[List[Tuple[str, float]]]:
+        """Rank a batch of queries by cosine similarity, fetching the postings of every distinct term once"""
+        self._ensure_weights()
+        weighted_queries = [self._query_weights(query_terms) for query_terms in queries]
+        results = []
+        for block_start, scores in score_batch(weighted_queries, self._doc_tf_idf, len(self.doc_norms)):
+            for weighted, row in zip(weighted_queries[block_start:block_start + len(scores)], scores):
+                # every weight is positive, so the documents containing a query term are the non-zero dot products
+                results.append(self._cosine_top(weighted, row, np.flatnonzero(row), top_n))
+        return results
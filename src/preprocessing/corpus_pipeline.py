@@ -0,0 +1,74 @@
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator, List, Optional, Tuple
+
+from src.preprocessing.preprocessing import load_data_chunks
+from src.preprocessing.text_processor import TextProcessor
+from src.util.constant import CID_COLUMN, TEXT_COLUMN, TOKEN_CACHE_PATH
+
+DEFAULT_CHUNK_SIZE = 256
+
+# one TextProcessor per worker process, created by the pool initializer
+_worker_processor: Optional[TextProcessor] = None
+
+
+def _init_worker() -> None:
+    global _worker_processor
+    # unchanged documents are served from the shared on-disk token cache when the corpus is reprocessed
+    _worker_processor = TextProcessor(cache_path=TOKEN_CACHE_PATH)
+
+
+def _process_chunk(texts: List[Optional[str]]) -> List[List[str]]:
+    # missing texts fail with the same error as process_text, in the same place
+    if any(text is None for text in texts):
+        return [_worker_processor.process_text(text) for text in texts]
+    return _worker_processor.process_texts(texts)
+
+
+def _read_chunks(file_path: str, chunk_size: int) -> Iterator[Tuple[list, List[Optional[str]]]]:
+    import pandas as pd
+    for chunk in load_data_chunks(file_path, chunk_size):
+        texts = [str(text) if pd.notna(text) else None for text in chunk[TEXT_COLUMN].tolist()]
+        yield chunk[CID_COLUMN].tolist(), texts
+
+
+def _run_inline(chunks: Iterator[Tuple[list, List[Optional[str]]]]) -> Iterator[Tuple[list, list, list]]:
+    _init_worker()
+    for cids, texts in chunks:
+        yield cids, texts, _process_chunk(texts)
+
+
+def _run_pool(chunks: Iterator[Tuple[list, List[Optional[str]]]], workers: int) -> Iterator[Tuple[list, list, list]]:
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as executor:
+        # keep two chunks per worker in flight so workers never idle while results are consumed in order
+        pending = deque()
+        for cids, texts in chunks:
+            pending.append((cids, texts, executor.submit(_process_chunk, texts)))
+            if len(pending) >= 2 * workers:
+                cids, texts, future = pending.popleft()
+                yield cids, texts, future.result()
+        while pending:
+            cids, texts, future = pending.popleft()
+            yield cids, texts, future.result()
+
+
+def process_corpus(file_path: str, workers: Optional[int] = None,
+                   chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[Tuple[object, Optional[str], List[str]]]:
+    """Preprocess a corpus CSV on a pool of worker processes.
+
+    Chunks are read lazily with a bounded number in flight, and results are yielded in file order as
+    (cid, raw text, processed tokens). Progress and throughput are printed after every chunk.
+    """
+    workers = workers or os.cpu_count() or 1
+    chunks = _read_chunks(file_path, chunk_size)
+    results = _run_inline(chunks) if workers == 1 else _run_pool(chunks, workers)
+    started = time.perf_counter()
+    processed_count = 0
+    for cids, texts, processed in results:
+        yield from zip(cids, texts, processed)
+        processed_count += len(cids)
+        elapsed = time.perf_counter() - started
+        rate = processed_count / elapsed if elapsed > 0 else 0.0
+        print(f"Processed {processed_count} documents in {elapsed:.1f}s ({rate:.1f} docs/s)")
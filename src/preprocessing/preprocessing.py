@@ -1,10 +1,22 @@
-import pandas as pd
+from typing import Iterator, TYPE_CHECKING
+
 from src.util.constant import VIETNAMESE_STOPWORDS_FILE_PATH
 
+if TYPE_CHECKING:
+    import pandas as pd
+
 
-def load_data(file_path: str) -> pd.DataFrame:
+# pandas is imported on first use: searching a prebuilt index never reads a CSV
+def load_data(file_path: str) -> "pd.DataFrame":
+    import pandas as pd
     return pd.read_csv(file_path)
 
+def load_data_chunks(file_path: str, chunk_size: int) -> Iterator["pd.DataFrame"]:
+    """Stream a CSV file as DataFrames of at most chunk_size rows"""
+    import pandas as pd
+    with pd.read_csv(file_path, chunksize=chunk_size) as reader:
+        yield from reader
+
 def load_vietnamese_stopwords() -> set[str]:
     with open(VIETNAMESE_STOPWORDS_FILE_PATH, "r", encoding="utf-8") as f:
         return {
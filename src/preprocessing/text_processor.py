@@ -1,20 +1,51 @@
+import hashlib
 import re
-from typing import List
-
-from underthesea import text_normalize, word_tokenize
+import time
+from importlib.metadata import version
+from typing import List, Optional, Iterable
 
 from src.preprocessing.preprocessing import load_vietnamese_stopwords
+from src.preprocessing.token_cache import TokenCache, DEFAULT_CACHE_ENTRIES
+
+# bump whenever _clean_tokens changes, so cached tokens from the previous version are no longer used
+TOKENIZER_VERSION = 1
 
 
 class TextProcessor:
-    def __init__(self):
+    def __init__(self, cache_path: Optional[str] = None, cache_entries: int = DEFAULT_CACHE_ENTRIES):
+        """
+        :param cache_path: sqlite file persisting processed tokens across runs. Defaults to in-process caching only.
+        :param cache_entries: Number of texts kept in the in-process cache.
+        """
         self.stopwords = load_vietnamese_stopwords()
         self._valid_token_pattern = re.compile(
             r"^[a-z0-9_\u00E0-\u01FF\u1EA0-\u1EFF.-]+$"
         )
+        self.cache = TokenCache(self._cache_namespace(), cache_entries, cache_path)
+        # underthesea takes most of a cold start to import, so it is only loaded once a text misses the cache
+        self._tokenizer = None
+        self.tokenizer_load_seconds: Optional[float] = None
+    def _cache_namespace(self) -> str:
+        stopwords_digest = hashlib.blake2b("\n".join(sorted(self.stopwords)).encode("utf-8"), digest_size=8)
+        return f"{TOKENIZER_VERSION}:{version('underthesea')}:{stopwords_digest.hexdigest()}"
+    def _load_tokenizer(self):
+        if self._tokenizer is None:
+            start = time.perf_counter()
+            from underthesea import text_normalize, word_tokenize
+            self._tokenizer = (text_normalize, word_tokenize)
+            self.tokenizer_load_seconds = time.perf_counter() - start
+        return self._tokenizer
     def _clean_tokens(self, text: str) -> List[str]:
         if text is None:
             raise ValueError("Input text cannot be None")
+        cached = self.cache.get(text)
+        if cached is not None:
+            return cached
+        cleaned_tokens = self._tokenize(text)
+        self.cache.put(text, cleaned_tokens)
+        return cleaned_tokens
+    def _tokenize(self, text: str) -> List[str]:
+        text_normalize, word_tokenize = self._load_tokenizer()
         words = text_normalize(text)
         words = words.lower()
         # invalid token
@@ -32,5 +63,15 @@ class TextProcessor:
         return cleaned_tokens
     def process_text(self, text: str) -> List[str]:
         return self._clean_tokens(text)
+    def process_texts(self, texts: Iterable[str]) -> List[List[str]]:
+        """Process a batch of texts with a single cache lookup, then write the new entries through"""
+        texts = list(texts)
+        if any(text is None for text in texts):
+            raise ValueError("Input text cannot be None")
+        cached = self.cache.get_many(texts)
+        computed = {text: self._tokenize(text) for text in texts if text not in cached}
+        self.cache.put_many(computed.items())
+        self.cache.flush()
+        return [cached[text] if text in cached else list(computed[text]) for text in texts]
     def process_text_join_for_es(self, text: str) -> str:
-        return " ".join(self._clean_tokens(text))
\ No newline at end of file
+        return " ".join(self._clean_tokens(text))
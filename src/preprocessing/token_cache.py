@@ -0,0 +1,113 @@
+import atexit
+import hashlib
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+DEFAULT_CACHE_ENTRIES = 10_000
+# pending disk writes are committed in batches of this size, on flush() and at exit
+_FLUSH_EVERY = 256
+
+
+def content_key(text: str) -> str:
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+
+class TokenCache:
+    """Content-hash keyed cache of processed tokens: an in-process LRU in front of an optional sqlite store.
+
+    Entries live under a namespace that identifies the normalizer, tokenizer and stopword list, so changing
+    any of them simply stops matching old entries instead of serving stale tokens.
+    """
+    def __init__(self, namespace: str, max_entries: int = DEFAULT_CACHE_ENTRIES, disk_path: Optional[str] = None):
+        self.namespace = namespace
+        self.max_entries = max_entries
+        self.disk_path = disk_path
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, Tuple[str, ...]]" = OrderedDict()
+        self._pending: List[Tuple[str, str, str]] = []
+        self._lock = threading.Lock()
+        self._connection: Optional[sqlite3.Connection] = None
+        self._connection_pid: Optional[int] = None
+    def _connect(self) -> sqlite3.Connection:
+        # a connection must not cross a fork, so worker processes open their own
+        if self._connection is None or self._connection_pid != os.getpid():
+            directory = os.path.dirname(self.disk_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._connection = sqlite3.connect(self.disk_path, timeout=60, check_same_thread=False)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS tokens (namespace TEXT, key TEXT, tokens TEXT, "
+                "PRIMARY KEY (namespace, key)) WITHOUT ROWID"
+            )
+            self._connection_pid = os.getpid()
+            atexit.register(self.flush)
+        return self._connection
+    def _remember(self, key: str, tokens: Tuple[str, ...]) -> None:
+        self._entries[key] = tokens
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+    def get_many(self, texts: Iterable[str]) -> Dict[str, List[str]]:
+        """Get the cached tokens of every text found, keyed by text"""
+        found, missing = {}, {}
+        with self._lock:
+            for text in texts:
+                key = content_key(text)
+                tokens = self._entries.get(key)
+                if tokens is not None:
+                    self._entries.move_to_end(key)
+                    found[text] = list(tokens)
+                else:
+                    missing[key] = text
+            if missing and self.disk_path:
+                keys = list(missing)
+                connection = self._connect()
+                # stay well below sqlite's limit on bound parameters
+                for start in range(0, len(keys), 500):
+                    batch = keys[start:start + 500]
+                    rows = connection.execute(
+                        f"SELECT key, tokens FROM tokens WHERE namespace = ? AND key IN ({','.join('?' * len(batch))})",
+                        [self.namespace, *batch],
+                    ).fetchall()
+                    for key, joined in rows:
+                        # tokens never contain whitespace
+                        tokens = tuple(joined.split())
+                        self._remember(key, tokens)
+                        found[missing[key]] = list(tokens)
+            self.hits += len(found)
+            self.misses += len(set(missing.values()) - found.keys())
+        return found
+    def get(self, text: str) -> Optional[List[str]]:
+        return self.get_many([text]).get(text)
+    def put_many(self, items: Iterable[Tuple[str, List[str]]]) -> None:
+        with self._lock:
+            for text, tokens in items:
+                key = content_key(text)
+                self._remember(key, tuple(tokens))
+                if self.disk_path:
+                    self._pending.append((self.namespace, key, " ".join(tokens)))
+            if len(self._pending) >= _FLUSH_EVERY:
+                self._flush_pending()
+    def put(self, text: str, tokens: List[str]) -> None:
+        self.put_many([(text, tokens)])
+    def _flush_pending(self) -> None:
+        if not self._pending:
+            return
+        connection = self._connect()
+        with connection:
+            connection.executemany("INSERT OR REPLACE INTO tokens VALUES (?, ?, ?)", self._pending)
+        self._pending = []
+    def flush(self) -> None:
+        """Write pending entries to the on-disk store"""
+        with self._lock:
+            if self.disk_path:
+                self._flush_pending()
+    def clear(self) -> None:
+        """Drop the in-process entries; the on-disk store is kept"""
+        with self._lock:
+            self._entries.clear()
@@ -1,100 +1,475 @@
-from collections import defaultdict
+import logging
+import os
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
 from textwrap import dedent
-from typing import List, Tuple, Optional
+from typing import List, Tuple, Optional, Dict, Set, Union
 
-import pandas as pd
+import numpy as np
 
+from src.indexing.document_store import DocumentStore, DocumentStoreWriter, open_document_store, \
+    write_document_store
+from src.indexing.index_storage import save_index, load_index
 from src.indexing.inverted_index import InvertedIndex
+from src.indexing.sharding import build_shards
 from src.model.bm25 import OkapiBM25
+from src.model.boolean_query import parse_boolean_query, compile_boolean_tokens
 from src.model.boolean_retrieval import BooleanRetrieval
+from src.model.impact_bm25 import ImpactOrderedBM25
+from src.model.lsi_model import LatentSemanticModel
+from src.model.model_sidecar import save_sidecar, load_sidecar
+from src.model.paging import RankedCandidates, DeepeningRanking, ResultPage, DEFAULT_CURSORS, DEFAULT_CURSOR_BYTES, \
+    DEFAULT_CURSOR_TTL_SECONDS, new_cursor_id, encode_cursor, decode_cursor
+from src.model.positional_query import has_positional_operators, parse_positional_query
+from src.model.positional_retrieval import PositionalMatcher
 from src.model.vector_space_model import VectorSpaceModel
-from src.preprocessing.preprocessing import load_data
+from src.preprocessing.corpus_pipeline import process_corpus, DEFAULT_CHUNK_SIZE
 from src.preprocessing.text_processor import TextProcessor
 from src.util import constant
-from src.util.constant import CORPUS_PATH, CID_COLUMN, TEXT_COLUMN, RAW_CORPUS_DICT_PATH, PROCESSED_CORPUS_DICT_PATH, \
-    VSM_MODEL_INDEX_BUILT_PATH, BM25_MODEL_INDEX_BUILT_PATH, INVERTED_INDEX_BUILT_PATH
-from src.util.pickle_handling import save_to_pickle_file, load_pickle_file
+from src.util.result_cache import BoundedCache, ResultCache
+from src.util.constant import CORPUS_PATH, RAW_CORPUS_DICT_PATH, PROCESSED_CORPUS_DICT_PATH, \
+    INVERTED_INDEX_BUILT_PATH, TOKEN_CACHE_PATH, VSM_SIDECAR_PATH, BM25_SIDECAR_PATH, IMPACT_INDEX_PATH, LSI_INDEX_PATH, \
+    BITMAP_INDEX_PATH, RAW_DOCUMENT_STORE_PATH, PROCESSED_DOCUMENT_STORE_PATH, QUERY_LOG_PATH, \
+    SHARDS_PATH, GROUND_TRUTH_EVALUATION_DOCUMENT_PATH
+
+# method -> (model class, description)
+_MODELS = {
+    constant.BOOLEAN_RETRIEVAL_NAME: (BooleanRetrieval, "Boolean retrieval model"),
+    constant.VSM_MODEL_NAME: (VectorSpaceModel, "VSM model"),
+    constant.BM25_MODEL_NAME: (OkapiBM25, "BM25 model"),
+    constant.BM25_IMPACT_MODEL_NAME: (ImpactOrderedBM25, "Impact-ordered BM25 model"),
+    constant.LSI_MODEL_NAME: (LatentSemanticModel, "LSI model"),
+}
 
 
 class SearchEngine:
-    def __init__(self):
-        self.processor = TextProcessor()
+    """Search over the inverted index with several retrieval models.
+
+    Everything is loaded on demand: the text processor and its tokenizer on the first query that needs them,
+    each corpus on first access, and each model with its sidecar the first time it is used, so a process
+    searching with one method never pays for the others. startup_report() shows where the time went.
+    """
+    def __init__(self, import_seconds: Optional[float] = None):
+        """
+        :param import_seconds: Time the caller took to import this module, the first step of the startup report.
+        """
+        self._processor: Optional[TextProcessor] = None
         self.inverted_index = InvertedIndex()
-        self.boolean_retrieval: Optional[BooleanRetrieval] = None
-        self.vsm: Optional[VectorSpaceModel] = None
-        self.bm25: Optional[OkapiBM25] = None
-        self.raw_documents = defaultdict(str)
-        self.processed_documents = defaultdict(list)
-    def process_documents(self):
-        corpus = load_data(CORPUS_PATH)
-        for _, row in corpus.iterrows():
-            cid = row[CID_COLUMN]
-            text_value = row[TEXT_COLUMN]
-            raw_document = str(text_value) if pd.notna(text_value) else None
-            self.raw_documents[cid] = raw_document
-            processed = self.processor.process_text(raw_document)
-            self.processed_documents[cid] = processed
-        save_to_pickle_file(RAW_CORPUS_DICT_PATH, self.raw_documents)
-        save_to_pickle_file(PROCESSED_CORPUS_DICT_PATH, self.processed_documents)
+        self._models: Optional[Dict] = None  # None until the index is built or loaded
+        self._sidecars_on_disk = False
+        self.positional_matcher: Optional[PositionalMatcher] = None
+        # a corpus is a dict while built in memory, or a DocumentStore opened on first access when set to None
+        self._raw_documents: Optional[Dict] = defaultdict(str)
+        self._processed_documents: Optional[Dict] = defaultdict(list)
+        self.load_timings: List[Tuple[str, float]] = [] if import_seconds is None else [
+            ("import search_engine", import_seconds)]
+        # results by (query, method, top_n, model parameters), dropped whenever the index changes
+        self.result_cache = ResultCache()
+        # rankings of the queries being paged through, see search_page()
+        self.cursors = BoundedCache(DEFAULT_CURSORS, DEFAULT_CURSOR_BYTES, DEFAULT_CURSOR_TTL_SECONDS)
+    @contextmanager
+    def _timed(self, step: str):
+        start = time.perf_counter()
+        yield
+        self.load_timings.append((step, time.perf_counter() - start))
+    @property
+    def processor(self) -> TextProcessor:
+        if self._processor is None:
+            with self._timed("text processor"):
+                self._processor = TextProcessor(cache_path=TOKEN_CACHE_PATH)
+        return self._processor
+    @processor.setter
+    def processor(self, processor: TextProcessor) -> None:
+        self._processor = processor
+    @property
+    def raw_documents(self) -> Dict:
+        if self._raw_documents is None:
+            with self._timed("raw corpus"):
+                self._raw_documents = open_document_store(RAW_DOCUMENT_STORE_PATH, RAW_CORPUS_DICT_PATH)
+        return self._raw_documents
+    @raw_documents.setter
+    def raw_documents(self, documents: Dict) -> None:
+        self._raw_documents = documents
+    @property
+    def processed_documents(self) -> Dict:
+        if self._processed_documents is None:
+            with self._timed("processed corpus"):
+                self._processed_documents = open_document_store(PROCESSED_DOCUMENT_STORE_PATH,
+                                                                PROCESSED_CORPUS_DICT_PATH, tokenized=True)
+        return self._processed_documents
+    @processed_documents.setter
+    def processed_documents(self, documents: Dict) -> None:
+        self._processed_documents = documents
+    @property
+    def boolean_retrieval(self) -> Optional[BooleanRetrieval]:
+        return self._model(constant.BOOLEAN_RETRIEVAL_NAME)
+    @property
+    def vsm(self) -> Optional[VectorSpaceModel]:
+        return self._model(constant.VSM_MODEL_NAME)
+    @property
+    def bm25(self) -> Optional[OkapiBM25]:
+        return self._model(constant.BM25_MODEL_NAME)
+    @property
+    def bm25_impact(self) -> Optional[ImpactOrderedBM25]:
+        return self._model(constant.BM25_IMPACT_MODEL_NAME)
+    @property
+    def lsi(self) -> Optional[LatentSemanticModel]:
+        return self._model(constant.LSI_MODEL_NAME)
+    def process_documents(self, workers: Optional[int] = None, chunk_size: int = DEFAULT_CHUNK_SIZE):
+        """
+        Preprocess the corpus in parallel and stream the raw and processed documents to their document stores
+        :param workers: Number of worker processes. Defaults to the number of CPUs.
+        :param chunk_size: Number of documents read and dispatched to a worker at a time.
+        """
+        with DocumentStoreWriter(RAW_DOCUMENT_STORE_PATH) as raw_writer, \
+                DocumentStoreWriter(PROCESSED_DOCUMENT_STORE_PATH, tokenized=True) as processed_writer:
+            for cid, raw_document, processed in process_corpus(CORPUS_PATH, workers, chunk_size):
+                raw_writer.add(cid, raw_document)
+                processed_writer.add(cid, processed)
+        self._load_processed_documents()
 
     def _load_processed_documents(self):
-        try:
-            self.raw_documents = load_pickle_file(RAW_CORPUS_DICT_PATH)
-            self.processed_documents = load_pickle_file(PROCESSED_CORPUS_DICT_PATH)
-        except FileNotFoundError as e:
-            raise FileNotFoundError(
-                "Processed documents not found. Run process_documents() first."
-            ) from e
+        self._raw_documents = None
+        self._processed_documents = None
+        # the stores are opened on first access, but missing files are reported right away; pickled corpora
+        # of older versions are converted when opened
+        for store_path, pickle_path in ((RAW_DOCUMENT_STORE_PATH, RAW_CORPUS_DICT_PATH),
+                                        (PROCESSED_DOCUMENT_STORE_PATH, PROCESSED_CORPUS_DICT_PATH)):
+            if not os.path.exists(store_path) and not os.path.exists(pickle_path):
+                raise FileNotFoundError("Processed documents not found. Run process_documents() first.")
     def _build_index(self):
         self._load_processed_documents()
         self.inverted_index.build(self.processed_documents)
-        save_to_pickle_file(INVERTED_INDEX_BUILT_PATH, self.inverted_index)
-        self.vsm = VectorSpaceModel(self.inverted_index)
-        save_to_pickle_file(VSM_MODEL_INDEX_BUILT_PATH, self.vsm)
-        self.bm25 = OkapiBM25(self.inverted_index)
-        save_to_pickle_file(BM25_MODEL_INDEX_BUILT_PATH, self.bm25)
+        save_index(INVERTED_INDEX_BUILT_PATH, self.inverted_index)
+        self._init_models(sidecars_on_disk=False)
+        self._save_sidecars()
+        self._report_impact_quality()
+    def _report_impact_quality(self) -> None:
+        """Report the ranking-quality loss of the impact-ordered BM25 just built against exact BM25"""
+        if not os.path.exists(GROUND_TRUTH_EVALUATION_DOCUMENT_PATH):
+            logging.warning("No ground truth to report the quality loss of the impact index against BM25. "
+                            "Run EvaluatorService.build_ground_truth() first.")
+            return
+        # the evaluator searches with this engine, so it is only imported once needed
+        from src.evaluation.evaluator_service import EvaluatorService
+        try:
+            evaluator = EvaluatorService(self)
+            evaluator.load_ground_truth()
+            evaluator.report_quality_loss()
+        except Exception:
+            # the index is built and saved either way
+            logging.exception("Could not report the quality loss of the impact index")
+    def _init_models(self, sidecars_on_disk: bool):
+        # models share the one index and only own small precomputed tables, persisted as sidecars.
+        # They are created the first time they are used
+        self._models = {}
+        self.result_cache.clear()
+        self.cursors.clear()
+        self._sidecars_on_disk = sidecars_on_disk
+        self.positional_matcher = PositionalMatcher(self.inverted_index)
+    def _model(self, method: str):
+        if self._models is None:
+            return None
+        if method not in self._models:
+            with self._timed(f"model {method}"):
+                model = _MODELS[method][0](self.inverted_index)
+                if self._sidecars_on_disk:
+                    self._load_sidecar(method, model)
+                self._models[method] = model
+        return self._models[method]
+    def _save_sidecars(self):
+        for method in _MODELS:
+            self._save_sidecar(method, self._model(method))
+    @staticmethod
+    def _save_sidecar(method: str, model) -> None:
+        if method == constant.VSM_MODEL_NAME:
+            save_sidecar(VSM_SIDECAR_PATH, model)
+        elif method == constant.BM25_MODEL_NAME:
+            save_sidecar(BM25_SIDECAR_PATH, model)
+        elif method == constant.BM25_IMPACT_MODEL_NAME:
+            model.save(IMPACT_INDEX_PATH)
+        elif method == constant.LSI_MODEL_NAME:
+            model.save(LSI_INDEX_PATH)
+        else:
+            model.save(BITMAP_INDEX_PATH)
+    @staticmethod
+    def _load_sidecar(method: str, model) -> None:
+        # a missing or stale sidecar only means the statistics are computed on first use
+        if method == constant.VSM_MODEL_NAME:
+            load_sidecar(VSM_SIDECAR_PATH, model)
+        elif method == constant.BM25_MODEL_NAME:
+            load_sidecar(BM25_SIDECAR_PATH, model)
+        elif method == constant.BM25_IMPACT_MODEL_NAME:
+            model.load(IMPACT_INDEX_PATH)
+        elif method == constant.LSI_MODEL_NAME:
+            model.load(LSI_INDEX_PATH)
+        else:
+            model.load(BITMAP_INDEX_PATH)
+    def add_document(self, cid, text: str) -> None:
+        """Index a new document without rebuilding the whole index"""
+        processed = self.processor.process_text(text)
+        self.inverted_index.add_document(cid, processed)
+        self.raw_documents[cid] = text
+        self.processed_documents[cid] = processed
+    def update_document(self, cid, text: str) -> None:
+        processed = self.processor.process_text(text)
+        self.inverted_index.update_document(cid, processed)
+        self.raw_documents[cid] = text
+        self.processed_documents[cid] = processed
+    def delete_document(self, cid) -> None:
+        self.inverted_index.delete_document(cid)
+        self.raw_documents.pop(cid, None)
+        self.processed_documents.pop(cid, None)
+    def persist_index(self) -> None:
+        """Save the index and corpora after incremental updates, with the sidecars of the models in use"""
+        save_index(INVERTED_INDEX_BUILT_PATH, self.inverted_index)
+        # the other sidecars no longer match the index, so they are recomputed the first time they are used
+        # rather than all rebuilt here
+        for method, model in list((self._models or {}).items()):
+            self._save_sidecar(method, model)
+        self._save_corpus(self.raw_documents, RAW_DOCUMENT_STORE_PATH, tokenized=False)
+        self._save_corpus(self.processed_documents, PROCESSED_DOCUMENT_STORE_PATH, tokenized=True)
+    def build_shards(self, num_shards: Optional[int] = None, directory: str = SHARDS_PATH) -> None:
+        """
+        Partition the processed corpus into shards by doc id and save one index per shard with the statistics of
+        the whole collection, to be searched by ShardedSearchEngine
+        :param num_shards: Number of shards, one worker process each. Defaults to the number of CPUs.
+        :param directory: Directory of the sharded index.
+        """
+        if self._processed_documents is not None and not self._processed_documents:
+            # nothing built in memory: shard the processed corpus on disk, as _build_index() indexes it
+            self._load_processed_documents()
+        build_shards(self.processed_documents.items(), num_shards or os.cpu_count() or 1, directory)
+    @staticmethod
+    def _save_corpus(documents: Dict, file_path: str, tokenized: bool) -> None:
+        if isinstance(documents, DocumentStore):
+            documents.save(file_path)
+        else:
+            write_document_store(file_path, documents.items(), tokenized=tokenized)
     def load_prebuilt_index(self):
+        """Open the index. The corpora, the models and their sidecars are loaded the first time they are used."""
         try:
-
             self._load_processed_documents()
-            self.inverted_index = load_pickle_file(INVERTED_INDEX_BUILT_PATH)
-            self.boolean_retrieval = BooleanRetrieval(self.inverted_index)
-            self.vsm = load_pickle_file(VSM_MODEL_INDEX_BUILT_PATH)
-            self.bm25 = load_pickle_file(BM25_MODEL_INDEX_BUILT_PATH)
+            with self._timed("index"):
+                self.inverted_index = load_index(INVERTED_INDEX_BUILT_PATH)
+            self._init_models(sidecars_on_disk=True)
         except FileNotFoundError as e:
             raise FileNotFoundError(
                 "Relevant model files not found. Run process_documents() and _build_index() first."
             ) from e
+    def startup_report(self) -> List[Tuple[str, float]]:
+        """Print and return the (step, seconds) of every load so far, in order"""
+        timings = list(self.load_timings)
+        if self._processor is not None and self._processor.tokenizer_load_seconds is not None:
+            timings.append(("tokenizer (underthesea)", self._processor.tokenizer_load_seconds))
+        print(f"{'step':<30}{'seconds':>10}")
+        for step, seconds in timings:
+            print(f"{step:<30}{seconds:>10.3f}")
+        print(f"{'total':<30}{sum(seconds for _, seconds in timings):>10.3f}")
+        return timings
     def search(self, query: str, method: str = 'bm25', top_n: int = 10) -> List[Tuple[str, float]]:
         """
         Search for documents matching the query
-        :param query: Search query string.
-        :param method: 'boolean', 'vsm', 'bm25'. Defaults to 'bm25'
+        :param query: Search query string. Quoted phrases ("thuế thu nhập") and proximity operators
+            (hải_quan NEAR/5 "thuế nhập khẩu") restrict the results to documents satisfying them. Boolean
+            queries take AND, OR, NOT and parentheses, e.g. thuế (nhập_khẩu OR xuất_khẩu) NOT hoàn.
+        :param method: 'boolean', 'vsm', 'bm25', 'bm25_impact' (quantized, impact-ordered BM25), 'lsi' (latent semantic).
+            Defaults to 'bm25'
         :param top_n: Top n results to return. Defaults to 10.
-        :return: List of (doc_id, score) tuples.
+        :return: List of (doc_id, score) tuples. Recurring queries are answered from result_cache.
         """
-        query_terms = self.processor.process_text(query)
-        if not query_terms:
+        model = self._require_model(method)
+        generation = self.inverted_index.version
+        self.result_cache.sync(generation)
+        key = self._result_key(self._normalize_query(query, method), method, top_n, model)
+        results = self.result_cache.get(key)
+        if results is None:
+            results = self._search(query, method, top_n, model)
+            self.result_cache.put(key, results, generation)
+        return results
+    def _search(self, query: str, method: str, top_n: int, model) -> List[Tuple[str, float]]:
+        if method == constant.BOOLEAN_RETRIEVAL_NAME and not has_positional_operators(query):
+            # operators and parentheses are parsed from the raw query, and matches come in index order
+            return [(doc_id, 1.0) for doc_id in model.evaluate(parse_boolean_query(query, self.processor), top_n)]
+        query_terms, candidates = self._parse_query(query)
+        if not query_terms or (candidates is not None and not candidates):
             return []
 
         # search using correct method
-        match method:
-            case constant.BOOLEAN_RETRIEVAL_NAME:
-                if self.boolean_retrieval is None:
-                    raise RuntimeError("Boolean retrieval model not loaded. Call load_prebuilt_index() or _build_index() first.")
-                doc_ids = self.boolean_retrieval.search(query_terms)
-                return [(doc_id, 1.0) for doc_id in doc_ids[:top_n]]
-            case constant.VSM_MODEL_NAME:
-                if self.vsm is None:
-                    raise RuntimeError("VSM model not loaded. Call load_prebuilt_index() or _build_index() first.")
-                return self.vsm.search(query_terms, top_n)
-            case constant.BM25_MODEL_NAME:
-                if self.bm25 is None:
-                    raise RuntimeError("BM25 model not loaded. Call load_prebuilt_index() or _build_index() first.")
-                return self.bm25.search(query_terms, top_n)
-            case _:
-                raise ValueError(f"Unknown method: {method}")
+        if method == constant.BOOLEAN_RETRIEVAL_NAME:
+            doc_ids = model.evaluate(compile_boolean_tokens(query_terms))
+            if candidates is not None:
+                doc_ids = [doc_id for doc_id in doc_ids if doc_id in candidates]
+            return [(doc_id, 1.0) for doc_id in doc_ids[:top_n]]
+        return model.search(query_terms, top_n, candidates)
+    def _parse_query(self, query: str) -> Tuple[List[str], Optional[Set[str]]]:
+        """Get the terms of a query and, when it has phrases or proximity operators, the documents satisfying them"""
+        if not has_positional_operators(query):
+            return self.processor.process_text(query), None
+        constraints, query_terms = parse_positional_query(query, self.processor)
+        if not constraints:
+            return query_terms, None
+        if self.positional_matcher is None:
+            raise RuntimeError("Index not loaded. Call load_prebuilt_index() or _build_index() first.")
+        return query_terms, self.positional_matcher.match(constraints)
+    def search_page(self, query: str, method: str = 'bm25', page_size: int = 10,
+                    cursor: Optional[str] = None) -> ResultPage:
+        """
+        Get a page of the results of a query. The first page is a search(), so it is cached and pruned like
+        one. Going past it ranks the query once and keeps the ranking under the cursor for the next pages,
+        so a deep page only costs ranking down to it instead of searching again.
+        :param query: Search query string, as for search().
+        :param method: 'boolean', 'vsm', 'bm25', 'bm25_impact', 'lsi'. Defaults to 'bm25'
+        :param page_size: Number of results per page. Defaults to 10.
+        :param cursor: next_cursor of the previous page of the same query. Defaults to the first page.
+        :return: The results of the page and the cursor of the next one. When the ranking of a cursor expired or
+            the index changed since, the query is ranked again and the page resumes at the same offset.
+        """
+        if page_size <= 0:
+            raise ValueError("page_size must be positive")
+        model = self._require_model(method)
+        generation = self.inverted_index.version
+        self.cursors.sync(generation)
+        key = self._result_key(self._normalize_query(query, method), method, None, model)
+        if cursor is None:
+            # most searches stop at the first page, which needs neither a complete ranking nor a cursor
+            results = self.search(query, method, page_size + 1)
+            if len(results) <= page_size:
+                return ResultPage(results, None)
+            cursor_id = new_cursor_id()
+            # the served results are kept until the ranking is needed, as they are the ones to continue from
+            served = DeepeningRanking(lambda top_n: self._search(query, method, top_n, model), page_size + 1, results)
+            self.cursors.put(cursor_id, (key, served, False), served.nbytes, generation)
+            return ResultPage(results[:page_size], encode_cursor(cursor_id, page_size))
+        cursor_id, offset = decode_cursor(cursor)
+        # cursor id -> (result key, ranking, whether the ranking is the one to page through)
+        state = self.cursors.get(cursor_id)
+        if state is not None and state[0] != key:
+            raise ValueError("The cursor belongs to another query")
+        if state is not None and state[2]:
+            ranking = state[1]
+        else:
+            ranking = self._ranking(query, method, model, offset + page_size, state[1] if state is not None else None)
+        results = ranking.page(offset, page_size)
+        end = offset + len(results)
+        if not ranking.has_more(end):
+            self.cursors.pop(cursor_id)
+            return ResultPage(results, None)
+        self.cursors.put(cursor_id, (key, ranking, True), ranking.nbytes, generation)
+        return ResultPage(results, encode_cursor(cursor_id, end))
+    def _ranking(self, query: str, method: str, model, depth: int,
+                 served: Optional[DeepeningRanking]) -> Union[RankedCandidates, DeepeningRanking]:
+        """Get every result of a query to page through. For approximate models, whose rankings of different
+        depths may disagree on ties, the ranking continues from the results ``served`` so far when known."""
+        doc_ids = self.inverted_index.doc_ids
+        if method == constant.BOOLEAN_RETRIEVAL_NAME and not has_positional_operators(query):
+            return RankedCandidates(model.match_ids(parse_boolean_query(query, self.processor)), None, doc_ids)
+        query_terms, candidates = self._parse_query(query)
+        if not query_terms or (candidates is not None and not candidates):
+            return RankedCandidates(np.zeros(0, dtype=np.int64), None, doc_ids)
+        if method == constant.BOOLEAN_RETRIEVAL_NAME:
+            matches = model.match_ids(compile_boolean_tokens(query_terms))
+            if candidates is not None:
+                matches = matches[[doc_ids[internal_id] in candidates for internal_id in matches.tolist()]]
+            return RankedCandidates(matches, None, doc_ids)
+        ranked = model.rank_all(query_terms, candidates)
+        if ranked is not None:
+            return RankedCandidates(*ranked, doc_ids)
+        if served is not None:
+            return served
+        return DeepeningRanking(lambda top_n: self._search(query, method, top_n, model), depth)
+    def search_batch(self, queries: List[Optional[str]], method: str = 'bm25',
+                     top_n: int = 10) -> List[List[Tuple[str, float]]]:
+        """
+        Search many queries at once: they are tokenized in bulk and scored together, so the posting list of a
+        term shared by several queries is fetched once
+        :param queries: Search query strings. Queries with phrase or proximity operators are searched one by one.
+        :param method: 'boolean', 'vsm', 'bm25', 'bm25_impact', 'lsi'. Defaults to 'bm25'
+        :param top_n: Top n results to return per query. Defaults to 10.
+        :return: List of (doc_id, score) tuples for every query, in order. A missing query has no results.
+        """
+        model = self._require_model(method)
+        generation = self.inverted_index.version
+        self.result_cache.sync(generation)
+        results: List[List[Tuple[str, float]]] = [[] for _ in queries]
+        plain = []
+        for position, query in enumerate(queries):
+            if query is None:
+                continue
+            if has_positional_operators(query):
+                results[position] = self.search(query, method, top_n)
+            else:
+                plain.append(position)
+        if method == constant.BOOLEAN_RETRIEVAL_NAME:
+            normalized = [self._normalize_query(queries[position], method) for position in plain]
+        else:
+            processed = self.processor.process_texts([queries[position] for position in plain])
+            normalized = [tuple(query_terms) for query_terms in processed]
+        # only the queries missing from the cache are searched, together
+        missing = []
+        for i, position in enumerate(plain):
+            cached = self.result_cache.get(self._result_key(normalized[i], method, top_n, model))
+            if cached is None:
+                missing.append(i)
+            else:
+                results[position] = cached
+        if method == constant.BOOLEAN_RETRIEVAL_NAME:
+            nodes = [parse_boolean_query(queries[plain[i]], self.processor) for i in missing]
+            batch = [[(doc_id, 1.0) for doc_id in doc_ids] for doc_ids in model.evaluate_batch(nodes, top_n)]
+        else:
+            batch = model.search_batch([processed[i] for i in missing], top_n)
+        for i, query_results in zip(missing, batch):
+            results[plain[i]] = query_results
+            self.result_cache.put(self._result_key(normalized[i], method, top_n, model), query_results, generation)
+        return results
+    @staticmethod
+    def log_query(query: str, method: str, top_n: int, query_log_path: str = QUERY_LOG_PATH) -> None:
+        """Append a search to the query log that warm_result_cache() replays"""
+        with open(query_log_path, "a", encoding="utf-8") as f:
+            f.write(f"{method}\t{top_n}\t{' '.join(query.split())}\n")
+    def warm_result_cache(self, query_log_path: str = QUERY_LOG_PATH, max_queries: Optional[int] = None) -> int:
+        """
+        Search the most frequent searches of the query log ahead of time, so they are answered from result_cache
+        :param query_log_path: Log written by log_query(), one 'method<TAB>top_n<TAB>query' line per search.
+        :param max_queries: Number of distinct searches to warm. Defaults to the capacity of the cache.
+        :return: Number of searches warmed
+        """
+        if not os.path.exists(query_log_path):
+            return 0
+        with open(query_log_path, encoding="utf-8") as f:
+            searches = Counter(tuple(line.rstrip("\n").split("\t", 2)) for line in f if line.count("\t") >= 2)
+        most_frequent = [search for search, _ in searches.most_common(max_queries or self.result_cache.max_entries)]
+        by_setting = defaultdict(list)
+        # the most frequent searches are cached last, so they are the last evicted
+        for method, top_n, query in reversed(most_frequent):
+            if method in _MODELS and top_n.isdigit() and query:
+                by_setting[method, int(top_n)].append(query)
+        with self._timed("result cache warm-up"):
+            for (method, top_n), queries in by_setting.items():
+                self.search_batch(queries, method, top_n)
+        return sum(len(queries) for queries in by_setting.values())
+    def _normalize_query(self, query: str, method: str):
+        """Get what the results of a query depend on: its processed terms, or its text when operators matter"""
+        if method == constant.BOOLEAN_RETRIEVAL_NAME or has_positional_operators(query):
+            return " ".join(query.split())
+        return tuple(self.processor.process_text(query))
+    @staticmethod
+    def _result_key(normalized_query, method: str, top_n: int, model) -> Tuple:
+        return normalized_query, method, top_n, tuple(sorted(model.search_params().items()))
+    def _require_model(self, method: str):
+        if method not in _MODELS:
+            raise ValueError(f"Unknown method: {method}")
+        model = self._model(method)
+        if model is None:
+            raise RuntimeError(f"{_MODELS[method][1]} not loaded. Call load_prebuilt_index() or _build_index() first.")
+        return model
 
+    def get_raw_documents(self, doc_ids: List) -> List[Optional[str]]:
+        """Get the raw texts of several documents, None for unknown ids, reading each stored block once"""
+        if isinstance(self.raw_documents, DocumentStore):
+            return self.raw_documents.get_many(doc_ids)
+        return [self.raw_documents.get(doc_id) for doc_id in doc_ids]
     def display_results(self, results: List[Tuple[str, float]], query: str, method: str, max_length: int = 200):
         """Display search results"""
         print(dedent(f"""
@@ -103,8 +478,9 @@ class SearchEngine:
                 Method: '{method}'
                 Found {len(results)} documents
                 {'=' * 80}"""))
+        raw_texts = self.get_raw_documents([doc_id for doc_id, _ in results])
         for rank, (doc_id, score) in enumerate(results, 1):
-            raw_text = self.raw_documents.get(doc_id) or ""
+            raw_text = raw_texts[rank - 1] or ""
             processed_text = self.processed_documents.get(doc_id) or []
             preview = raw_text[:max_length].replace('\n', ' ')
             if len(raw_text) > max_length:
@@ -0,0 +1,363 @@
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Set, Tuple
+from urllib.parse import unquote, urlsplit
+
+from src.search_engine import SearchEngine
+from src.util.latency_histogram import LatencyHistogram
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8000
+# concurrent searches are collected this long, then scored together by search_batch
+DEFAULT_BATCH_WINDOW_SECONDS = 0.003
+DEFAULT_MAX_BATCH_SIZE = 64
+# requests admitted at once per worker process, the next ones are turned away with 503 until one finishes
+DEFAULT_MAX_IN_FLIGHT = 256
+MAX_TOP_N = 1000
+MAX_BATCH_QUERIES = 1000
+MAX_BODY_BYTES = 1 << 20
+MAX_HEADER_LINES = 100
+
+Results = List[Tuple[str, float]]
+
+
+class HttpError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+# served whatever the load, and left out of the latency histograms
+_UNMETERED_ROUTES = ("/metrics", "/health")
+_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 413: "Payload Too Large",
+            500: "Internal Server Error", 503: "Service Unavailable"}
+
+
+class MicroBatcher:
+    """Collect concurrent searches of the same method and depth for a short window and score them as one batch.
+
+    A window opens with the first search of a (method, top_n) and is flushed once it ends or holds max_batch_size
+    searches. Batches run on the executor, so the event loop keeps accepting requests while they are scored.
+    """
+    def __init__(self, engine: SearchEngine, executor: ThreadPoolExecutor,
+                 window_seconds: float = DEFAULT_BATCH_WINDOW_SECONDS, max_batch_size: int = DEFAULT_MAX_BATCH_SIZE):
+        """
+        :param engine: Loaded search engine.
+        :param executor: Executor running the scoring, off the event loop.
+        :param window_seconds: How long searches are collected after the first one of a batch.
+        :param max_batch_size: Number of searches that flushes a batch before its window ends.
+        """
+        self.engine = engine
+        self.executor = executor
+        self.window_seconds = window_seconds
+        self.max_batch_size = max_batch_size
+        self.batches = 0
+        self.searches = 0
+        # (method, top_n) -> searches waiting for their batch, and the timer flushing it
+        self._pending: Dict[Tuple[str, int], List[Tuple[str, asyncio.Future]]] = defaultdict(list)
+        self._timers: Dict[Tuple[str, int], asyncio.TimerHandle] = {}
+        self._running: Set[asyncio.Task] = set()  # the event loop only keeps weak references to tasks
+    async def search(self, query: str, method: str, top_n: int) -> Results:
+        loop = asyncio.get_running_loop()
+        key = (method, top_n)
+        future = loop.create_future()
+        pending = self._pending[key]
+        pending.append((query, future))
+        if len(pending) >= self.max_batch_size:
+            self._flush(key)
+        elif len(pending) == 1:
+            self._timers[key] = loop.call_later(self.window_seconds, self._flush, key)
+        return await future
+    def _flush(self, key: Tuple[str, int]) -> None:
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        batch = self._pending.pop(key, [])
+        if batch:
+            task = asyncio.ensure_future(self._run(key, batch))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+    async def _run(self, key: Tuple[str, int], batch: List[Tuple[str, asyncio.Future]]) -> None:
+        method, top_n = key
+        self.batches += 1
+        self.searches += len(batch)
+        try:
+            results = await asyncio.get_running_loop().run_in_executor(
+                self.executor, self.engine.search_batch, [query for query, _ in batch], method, top_n)
+        except Exception as e:
+            # every search of a batch shares its method, so an invalid one fails them all alike
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), query_results in zip(batch, results):
+            # a search whose client went away was cancelled meanwhile
+            if not future.done():
+                future.set_result(query_results)
+    def stats(self) -> Dict:
+        return {"batches": self.batches, "searches": self.searches,
+                "mean_batch_size": self.searches / self.batches if self.batches else None}
+
+
+class AdmissionController:
+    """Bound the requests in progress, rejecting the ones beyond the limit instead of queueing them unboundedly"""
+    def __init__(self, max_in_flight: int = DEFAULT_MAX_IN_FLIGHT):
+        self.max_in_flight = max_in_flight
+        self.in_flight = 0
+        self.admitted = 0
+        self.rejected = 0
+    def try_acquire(self) -> bool:
+        # only called from the event loop thread, so the counters need no lock
+        if self.in_flight >= self.max_in_flight:
+            self.rejected += 1
+            return False
+        self.in_flight += 1
+        self.admitted += 1
+        return True
+    def release(self) -> None:
+        self.in_flight -= 1
+    def stats(self) -> Dict:
+        return {"max_in_flight": self.max_in_flight, "in_flight": self.in_flight, "admitted": self.admitted,
+                "rejected": self.rejected}
+
+
+class SearchService:
+    """JSON over HTTP/1.1 front-end of a SearchEngine, on asyncio.
+
+    Endpoints:
+        POST /search          {"query": str, "method": "bm25", "top_n": 10} -> {"results": [{"doc_id", "score"}]}
+        POST /search/batch    {"queries": [str], "method": "bm25", "top_n": 10} -> {"results": [[{"doc_id", "score"}]]}
+        GET  /documents/<id>  -> {"doc_id", "text"}
+        GET  /metrics         -> latency histogram of every endpoint, admission, batching and result cache counters
+        GET  /health          -> {"status": "ok"}
+
+    Scoring runs on a single executor thread: the engine is not shared between threads, and searches arriving
+    together are micro-batched onto it. Throughput scales by running worker processes, see serve().
+    """
+    def __init__(self, engine: SearchEngine, window_seconds: float = DEFAULT_BATCH_WINDOW_SECONDS,
+                 max_batch_size: int = DEFAULT_MAX_BATCH_SIZE, max_in_flight: int = DEFAULT_MAX_IN_FLIGHT):
+        self.engine = engine
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="search-service")
+        self.batcher = MicroBatcher(engine, self.executor, window_seconds, max_batch_size)
+        self.admission = AdmissionController(max_in_flight)
+        self.latencies: Dict[str, LatencyHistogram] = defaultdict(LatencyHistogram)
+        self.routes = {
+            ("POST", "/search"): self._search,
+            ("POST", "/search/batch"): self._search_batch,
+            ("GET", "/documents"): self._document,
+            ("GET", "/metrics"): self._metrics,
+            ("GET", "/health"): self._health,
+        }
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """Serve the requests of one connection, kept alive until the client closes it or asks to"""
+        try:
+            while True:
+                try:
+                    request = await _read_request(reader)
+                except HttpError as e:
+                    _write_response(writer, e.status, {"error": str(e)}, keep_alive=False)
+                    await writer.drain()
+                    return
+                if request is None:
+                    return
+                method, target, headers, body = request
+                status, payload = await self.dispatch(method, target, body)
+                keep_alive = headers.get("connection", "").lower() != "close"
+                _write_response(writer, status, payload, keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    return
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+    async def dispatch(self, method: str, target: str, body: bytes) -> Tuple[int, Dict]:
+        """Route a request and turn its errors into statuses. Returns (status, JSON payload)."""
+        path = urlsplit(target).path.rstrip("/") or "/"
+        route = "/documents" if path.startswith("/documents/") else path
+        handler = self.routes.get((method, route))
+        if handler is None:
+            if any(route_path == route for _, route_path in self.routes):
+                return 405, {"error": f"{method} not allowed on {route}"}
+            return 404, {"error": f"Unknown endpoint {path}"}
+        if route in _UNMETERED_ROUTES:
+            return 200, await handler(path, body)
+        if not self.admission.try_acquire():
+            return 503, {"error": "Too many requests in progress, retry later"}
+        start = time.perf_counter()
+        try:
+            return 200, await handler(path, body)
+        except HttpError as e:
+            return e.status, {"error": str(e)}
+        except ValueError as e:
+            return 400, {"error": str(e)}
+        except Exception as e:
+            logging.exception(f"{method} {path} failed")
+            return 500, {"error": f"{type(e).__name__}: {e}"}
+        finally:
+            self.admission.release()
+            self.latencies[route].record(time.perf_counter() - start)
+    async def _search(self, path: str, body: bytes) -> Dict:
+        request = _parse_json(body)
+        query, method, top_n = _search_params(request, "query", str)
+        results = await self.batcher.search(query, method, top_n)
+        return {"results": _results_json(results)}
+    async def _search_batch(self, path: str, body: bytes) -> Dict:
+        request = _parse_json(body)
+        queries, method, top_n = _search_params(request, "queries", list)
+        if len(queries) > MAX_BATCH_QUERIES or not all(query is None or isinstance(query, str) for query in queries):
+            raise HttpError(400, f"'queries' must be a list of at most {MAX_BATCH_QUERIES} strings")
+        # already a batch: scored as it is rather than through the micro-batcher
+        results = await asyncio.get_running_loop().run_in_executor(
+            self.executor, self.engine.search_batch, queries, method, top_n)
+        return {"results": [_results_json(query_results) for query_results in results]}
+    async def _document(self, path: str, body: bytes) -> Dict:
+        doc_id = unquote(path[len("/documents/"):])
+        texts = await asyncio.get_running_loop().run_in_executor(
+            self.executor, self.engine.get_raw_documents, [doc_id])
+        if texts[0] is None:
+            raise HttpError(404, f"Unknown document {doc_id}")
+        return {"doc_id": doc_id, "text": texts[0]}
+    async def _metrics(self, path: str, body: bytes) -> Dict:
+        cache = self.engine.result_cache.stats()
+        return {
+            "pid": os.getpid(),
+            "latency": {route: histogram.snapshot() for route, histogram in self.latencies.items()},
+            "admission": self.admission.stats(),
+            "batching": self.batcher.stats(),
+            "result_cache": dict(cache._asdict(), hit_rate=cache.hit_rate),
+        }
+    async def _health(self, path: str, body: bytes) -> Dict:
+        return {"status": "ok"}
+    async def serve(self, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT, reuse_port: bool = False) -> None:
+        server = await asyncio.start_server(self.handle_connection, host, port, reuse_port=reuse_port)
+        print(f"Search service {os.getpid()} listening on {host}:{port}")
+        async with server:
+            await server.serve_forever()
+    def close(self) -> None:
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+async def _read_request(reader: asyncio.StreamReader) -> Optional[Tuple[str, str, Dict[str, str], bytes]]:
+    """Read one request as (method, target, lower-cased headers, body), None once the client closed"""
+    line = await reader.readline()
+    if not line:
+        return None
+    parts = line.decode("latin-1").split()
+    if len(parts) != 3 or not parts[2].startswith("HTTP/"):
+        raise HttpError(400, "Malformed request line")
+    headers = {}
+    for _ in range(MAX_HEADER_LINES):
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    else:
+        raise HttpError(400, "Too many headers")
+    length = headers.get("content-length", "0")
+    if not length.isdigit():
+        raise HttpError(400, "Invalid Content-Length")
+    if int(length) > MAX_BODY_BYTES:
+        raise HttpError(413, f"Body larger than {MAX_BODY_BYTES} bytes")
+    body = await reader.readexactly(int(length)) if int(length) else b""
+    return parts[0].upper(), parts[1], headers, body
+
+
+def _write_response(writer: asyncio.StreamWriter, status: int, payload: Dict, keep_alive: bool) -> None:
+    body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    headers = [f"HTTP/1.1 {status} {_REASONS.get(status, '')}", "Content-Type: application/json; charset=utf-8",
+               f"Content-Length: {len(body)}", f"Connection: {'keep-alive' if keep_alive else 'close'}"]
+    if status == 503:
+        headers.append("Retry-After: 1")
+    writer.write(("\r\n".join(headers) + "\r\n\r\n").encode("latin-1") + body)
+
+
+def _parse_json(body: bytes) -> Dict:
+    try:
+        request = json.loads(body or b"{}")
+    except ValueError:
+        raise HttpError(400, "Body is not valid JSON")
+    if not isinstance(request, dict):
+        raise HttpError(400, "Body must be a JSON object")
+    return request
+
+
+def _search_params(request: Dict, query_field: str, query_type: type) -> Tuple:
+    """Get (query or queries, method, top_n) of a search request, validated"""
+    query = request.get(query_field)
+    if not isinstance(query, query_type):
+        raise HttpError(400, f"'{query_field}' must be a {query_type.__name__}")
+    method = request.get("method", "bm25")
+    top_n = request.get("top_n", 10)
+    if not isinstance(method, str):
+        raise HttpError(400, "'method' must be a string")
+    if not isinstance(top_n, int) or isinstance(top_n, bool) or not 1 <= top_n <= MAX_TOP_N:
+        raise HttpError(400, f"'top_n' must be an integer between 1 and {MAX_TOP_N}")
+    return query, method, top_n
+
+
+def _results_json(results: Results) -> List[Dict]:
+    return [{"doc_id": doc_id, "score": score} for doc_id, score in results]
+
+
+def _run_worker(host: str, port: int, reuse_port: bool, options: Dict) -> None:
+    # every worker maps the same index files read-only, so the operating system shares their pages
+    engine = SearchEngine()
+    engine.load_prebuilt_index()
+    engine.warm_result_cache()
+    service = SearchService(engine, **options)
+    try:
+        asyncio.run(service.serve(host, port, reuse_port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.close()
+
+
+def serve(host: str = DEFAULT_HOST, port: int = DEFAULT_PORT, workers: int = 1, **options) -> None:
+    """
+    Run the search service on the prebuilt index
+    :param host: Address to listen on.
+    :param port: Port to listen on.
+    :param workers: Worker processes, each with its own event loop and engine, sharing the port: the kernel spreads
+        connections over them. Needs SO_REUSEPORT (Linux, BSD) when more than one.
+    :param options: window_seconds, max_batch_size and max_in_flight of every SearchService.
+    """
+    if workers <= 1:
+        _run_worker(host, port, False, options)
+        return
+    processes = [multiprocessing.Process(target=_run_worker, args=(host, port, True, options), daemon=True)
+                 for _ in range(workers)]
+    for process in processes:
+        process.start()
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.terminate()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the search engine over HTTP")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--workers", type=int, default=1, help="worker processes sharing the port")
+    parser.add_argument("--batch-window-ms", type=float, default=DEFAULT_BATCH_WINDOW_SECONDS * 1000)
+    parser.add_argument("--max-batch-size", type=int, default=DEFAULT_MAX_BATCH_SIZE)
+    parser.add_argument("--max-in-flight", type=int, default=DEFAULT_MAX_IN_FLIGHT)
+    args = parser.parse_args()
+    serve(args.host, args.port, args.workers, window_seconds=args.batch_window_ms / 1000,
+          max_batch_size=args.max_batch_size, max_in_flight=args.max_in_flight)
+
+
+if __name__ == "__main__":
+    main()
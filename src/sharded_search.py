@@ -0,0 +1,149 @@
+import heapq
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Sequence, Tuple
+
+from src.indexing.sharding import read_shards_meta, load_shard
+from src.model.bm25 import OkapiBM25
+from src.model.positional_query import has_positional_operators, parse_positional_query, PositionalConstraint
+from src.model.positional_retrieval import PositionalMatcher
+from src.model.vector_space_model import VectorSpaceModel
+from src.preprocessing.text_processor import TextProcessor
+from src.util import constant
+from src.util.constant import SHARDS_PATH, TOKEN_CACHE_PATH
+
+# (corpus position, doc id, score): the position breaks ties across shards as internal ids do in one index
+ShardResults = List[Tuple[int, str, float]]
+
+
+class _Shard:
+    """One shard of the index with its models, searched in a worker process"""
+    def __init__(self, directory: str, shard: int):
+        self.index, self.order = load_shard(directory, shard)
+        self.models = {constant.BM25_MODEL_NAME: OkapiBM25(self.index),
+                       constant.VSM_MODEL_NAME: VectorSpaceModel(self.index)}
+        for model in self.models.values():
+            model.precompute()
+        self.positional_matcher = PositionalMatcher(self.index)
+    def search(self, method: str, query_terms: List[str], constraints: Optional[List[PositionalConstraint]],
+               top_n: int) -> ShardResults:
+        candidates = self.positional_matcher.match(constraints) if constraints else None
+        if candidates is not None and not candidates:
+            return []
+        return self._positioned(self.models[method].search(query_terms, top_n, candidates))
+    def search_batch(self, method: str, queries: List[List[str]], top_n: int) -> List[ShardResults]:
+        return [self._positioned(results) for results in self.models[method].search_batch(queries, top_n)]
+    def _positioned(self, results: List[Tuple[str, float]]) -> ShardResults:
+        doc_id_map = self.index.doc_id_map
+        return [(int(self.order[doc_id_map[doc_id]]), doc_id, score) for doc_id, score in results]
+
+
+# the shard of a worker process, opened by the pool initializer
+_worker_shard: Optional[_Shard] = None
+
+
+def _init_worker(directory: str, shard: int) -> None:
+    global _worker_shard
+    _worker_shard = _Shard(directory, shard)
+
+
+def _search_shard(method: str, query_terms: List[str], constraints: Optional[List[PositionalConstraint]],
+                  top_n: int) -> ShardResults:
+    return _worker_shard.search(method, query_terms, constraints, top_n)
+
+
+def _search_shard_batch(method: str, queries: List[List[str]], top_n: int) -> List[ShardResults]:
+    return _worker_shard.search_batch(method, queries, top_n)
+
+
+def merge_shard_results(shard_results: Sequence[ShardResults], top_n: int) -> List[Tuple[str, float]]:
+    """Merge the top n of every shard into the top n of the collection: by descending score, ties by corpus
+    position. Every shard list is already in that order, so only the heads are compared."""
+    merged = heapq.merge(*shard_results, key=lambda result: (-result[2], result[0]))
+    return [(doc_id, score) for _, (_, doc_id, score) in zip(range(top_n), merged)]
+
+
+class ShardedSearchEngine:
+    """BM25 and VSM search over an index partitioned into shards by doc id, each searched by its own process.
+
+    A query is scattered to every shard, which scores its documents with the document frequencies, number of
+    documents and average length of the whole collection, and the per-shard top n are merged. Results and scores
+    are those of SearchEngine on the unsharded index. Shards search in parallel on separate cores, and calls from
+    several threads keep every worker busy. Build the shards with SearchEngine.build_shards().
+    """
+    methods = (constant.BM25_MODEL_NAME, constant.VSM_MODEL_NAME)
+    def __init__(self, directory: str = SHARDS_PATH, processor: Optional[TextProcessor] = None):
+        """
+        :param directory: Directory of the sharded index.
+        :param processor: Text processor of the queries. Created on the first query when not given.
+        """
+        meta = read_shards_meta(directory)
+        self.num_shards = meta["num_shards"]
+        self._processor = processor
+        # a single-worker pool per shard pins every shard to one process, opened once by its initializer
+        self.executors = [ProcessPoolExecutor(max_workers=1, initializer=_init_worker, initargs=(directory, shard))
+                          for shard in range(self.num_shards)]
+    @property
+    def processor(self) -> TextProcessor:
+        if self._processor is None:
+            self._processor = TextProcessor(cache_path=TOKEN_CACHE_PATH)
+        return self._processor
+    def search(self, query: str, method: str = 'bm25', top_n: int = 10) -> List[Tuple[str, float]]:
+        """
+        Search every shard and merge their results
+        :param query: Search query string, with quoted phrases and proximity operators as in SearchEngine.search.
+        :param method: 'bm25' or 'vsm'. Defaults to 'bm25'
+        :param top_n: Top n results to return. Defaults to 10.
+        :return: List of (doc_id, score) tuples.
+        """
+        self._check_method(method)
+        query_terms, constraints = self._parse_query(query)
+        if not query_terms:
+            return []
+        futures = [executor.submit(_search_shard, method, query_terms, constraints, top_n)
+                   for executor in self.executors]
+        return merge_shard_results([future.result() for future in futures], top_n)
+    def search_batch(self, queries: List[Optional[str]], method: str = 'bm25',
+                     top_n: int = 10) -> List[List[Tuple[str, float]]]:
+        """
+        Search many queries at once: the plain ones are tokenized in bulk and sent to every shard as one batch
+        :param queries: Search query strings. Queries with phrase or proximity operators are searched one by one.
+        :param method: 'bm25' or 'vsm'. Defaults to 'bm25'
+        :param top_n: Top n results to return per query. Defaults to 10.
+        :return: List of (doc_id, score) tuples for every query, in order. A missing query has no results.
+        """
+        self._check_method(method)
+        results: List[List[Tuple[str, float]]] = [[] for _ in queries]
+        plain = []
+        for position, query in enumerate(queries):
+            if query is None:
+                continue
+            if has_positional_operators(query):
+                results[position] = self.search(query, method, top_n)
+            else:
+                plain.append(position)
+        processed = self.processor.process_texts([queries[position] for position in plain]) if plain else []
+        batch = [(position, query_terms) for position, query_terms in zip(plain, processed) if query_terms]
+        if not batch:
+            return results
+        futures = [executor.submit(_search_shard_batch, method, [query_terms for _, query_terms in batch], top_n)
+                   for executor in self.executors]
+        per_shard = [future.result() for future in futures]
+        for i, (position, _) in enumerate(batch):
+            results[position] = merge_shard_results([shard_results[i] for shard_results in per_shard], top_n)
+        return results
+    def _parse_query(self, query: str) -> Tuple[List[str], Optional[List[PositionalConstraint]]]:
+        """Get the terms of a query and its phrase and proximity constraints, which every shard matches itself"""
+        if not has_positional_operators(query):
+            return self.processor.process_text(query), None
+        constraints, query_terms = parse_positional_query(query, self.processor)
+        return query_terms, constraints or None
+    def _check_method(self, method: str) -> None:
+        if method not in self.methods:
+            raise ValueError(f"Sharded search supports {', '.join(self.methods)}, not {method}")
+    def close(self) -> None:
+        for executor in self.executors:
+            executor.shutdown(cancel_futures=True)
+    def __enter__(self) -> "ShardedSearchEngine":
+        return self
+    def __exit__(self, *exc_info) -> None:
+        self.close()
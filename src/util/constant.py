@@ -13,12 +13,23 @@ TRAIN_TEST_MERGED_PATH = str(BASE / "data" / "train_test_merged.csv")
 VIETNAMESE_STOPWORDS_FILE_PATH = str(BASE / "util_file" / "vietnamese-stopwords.txt")
 RAW_CORPUS_DICT_PATH = str(BASE / "util_file" / "raw_corpus.pkl")
 PROCESSED_CORPUS_DICT_PATH = str(BASE / "util_file" / "processed_corpus.pkl")
+RAW_DOCUMENT_STORE_PATH = str(BASE / "util_file" / "raw_corpus.store")
+PROCESSED_DOCUMENT_STORE_PATH = str(BASE / "util_file" / "processed_corpus.store")
 RAW_EVALUATION_DOCUMENT_PATH = str(BASE / "util_file" / "raw_evaluation_document.pkl")
 GROUND_TRUTH_EVALUATION_DOCUMENT_PATH = str(BASE / "util_file" / "ground_truth_evaluation_document.pkl")
-INVERTED_INDEX_BUILT_PATH = str(BASE / "util_file" / "inverted_index.pkl")
-VSM_MODEL_INDEX_BUILT_PATH = str(BASE / "util_file" / "vsm_model_built.pkl")
-BM25_MODEL_INDEX_BUILT_PATH = str(BASE / "util_file" / "bm25_model_built.pkl")
+INVERTED_INDEX_BUILT_PATH = str(BASE / "util_file" / "inverted_index.bin")
+VSM_SIDECAR_PATH = str(BASE / "util_file" / "vsm_sidecar.npz")
+BM25_SIDECAR_PATH = str(BASE / "util_file" / "bm25_sidecar.npz")
+IMPACT_INDEX_PATH = str(BASE / "util_file" / "impact_index")
+LSI_INDEX_PATH = str(BASE / "util_file" / "lsi_index")
+BITMAP_INDEX_PATH = str(BASE / "util_file" / "bitmap_index")
 EVALUATION_RESULT_FILE_PATH = str(BASE / "util_file" / "evaluation_result.csv")
+IMPACT_QUALITY_REPORT_PATH = str(BASE / "util_file" / "impact_quality_report.csv")
+BM25_SWEEP_RESULT_FILE_PATH = str(BASE / "util_file" / "bm25_sweep_result.csv")
+LSI_ANN_BENCHMARK_FILE_PATH = str(BASE / "util_file" / "lsi_ann_benchmark.csv")
+TOKEN_CACHE_PATH = str(BASE / "util_file" / "token_cache.sqlite")
+QUERY_LOG_PATH = str(BASE / "util_file" / "query_log.tsv")
+SHARDS_PATH = str(BASE / "util_file" / "shards")
 # COlUMN
 CID_COLUMN = "cid"
 TEXT_COLUMN = "text"
@@ -29,6 +40,8 @@ QUESTION_COLUMN = "question"
 BOOLEAN_RETRIEVAL_NAME = "boolean"
 VSM_MODEL_NAME = "vsm"
 BM25_MODEL_NAME = "bm25"
+BM25_IMPACT_MODEL_NAME = "bm25_impact"
+LSI_MODEL_NAME = "lsi"
 
 # BOOLEAN_OPERATOR
 AND_OPERATOR = "and"
@@ -39,4 +52,7 @@ NOT_OPERATOR = "not"
 # ELastic search
 PROCESSED_INDEX_NAME = "processed_text_index"
 NORMAL_INDEX_NAME = "normal_index"
+ES_MSEARCH_BATCH_SIZE = 200
+# how long a point in time stays open between two pages of search_page
+ES_PIT_KEEP_ALIVE = "2m"
 EVALUATION_ES_RESULT_FILE_PATH = str(BASE / "util_file" / "evaluation_result_es.csv")
\ No newline at end of file
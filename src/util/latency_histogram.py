@@ -0,0 +1,51 @@
+import bisect
+import threading
+from typing import Dict, Optional, Sequence
+
+# upper bounds of the buckets in milliseconds, roughly 1-2-5 steps; slower requests fall in a last open bucket
+DEFAULT_BUCKETS_MS = (0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+
+
+class LatencyHistogram:
+    """Counts of latencies in fixed buckets, cheap enough to record every request.
+
+    Quantiles are estimated as the upper bound of the bucket they fall in, so they are exact to a bucket.
+    """
+    def __init__(self, buckets_ms: Sequence[float] = DEFAULT_BUCKETS_MS):
+        self.buckets_ms = tuple(buckets_ms)
+        self.counts = [0] * (len(self.buckets_ms) + 1)
+        self.count = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self._lock = threading.Lock()
+    def record(self, seconds: float) -> None:
+        with self._lock:
+            self.counts[bisect.bisect_left(self.buckets_ms, seconds * 1000)] += 1
+            self.count += 1
+            self.total_seconds += seconds
+            self.max_seconds = max(self.max_seconds, seconds)
+    def quantile(self, q: float) -> Optional[float]:
+        """Get the upper bound in milliseconds of the bucket holding the q-quantile, None before any record"""
+        with self._lock:
+            if not self.count:
+                return None
+            rank, seen = q * self.count, 0
+            for bound, count in zip(self.buckets_ms, self.counts):
+                seen += count
+                if seen >= rank:
+                    return bound
+            return self.max_seconds * 1000
+    def snapshot(self) -> Dict:
+        """Describe the histogram as JSON-serializable values, latencies in milliseconds"""
+        p50, p90, p99 = self.quantile(0.5), self.quantile(0.9), self.quantile(0.99)
+        with self._lock:
+            bounds = [str(bound) for bound in self.buckets_ms] + ["+Inf"]
+            return {
+                "count": self.count,
+                "mean_ms": 1000 * self.total_seconds / self.count if self.count else None,
+                "max_ms": 1000 * self.max_seconds,
+                "p50_ms": p50,
+                "p90_ms": p90,
+                "p99_ms": p99,
+                "buckets_ms": dict(zip(bounds, self.counts)),
+            }
@@ -12,8 +12,5 @@ def save_to_pickle_file(file_path: str, data) -> None:
 
 def load_pickle_file(file_path: Path):
     with open(file_path, "rb") as file:
-        contents = file.read()
-        try:
-            return pickle.loads(contents)
-        except pickle.UnpicklingError as e:
-            raise
\ No newline at end of file
+        # stream from the file instead of reading it into one bytes object first
+        return pickle.load(file)
\ No newline at end of file
@@ -0,0 +1,136 @@
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, List, NamedTuple, Optional, Tuple
+
+DEFAULT_RESULT_CACHE_ENTRIES = 4096
+DEFAULT_RESULT_CACHE_BYTES = 64 << 20
+DEFAULT_RESULT_TTL_SECONDS = 3600.0
+
+Results = List[Tuple[str, float]]
+
+
+class CacheStats(NamedTuple):
+    hits: int
+    misses: int
+    evictions: int  # dropped to stay within max_entries and max_bytes
+    expirations: int  # found older than the time to live
+    invalidations: int  # entries dropped because the generation changed
+    entries: int
+    bytes: int
+    @property
+    def hit_rate(self) -> float:
+        return self.hits / (self.hits + self.misses) if self.hits + self.misses else 0.0
+
+
+def _estimate_bytes(key: Hashable, results: Tuple[Tuple[str, float], ...]) -> int:
+    """Approximate memory held by an entry: its key, result tuples, doc id strings and scores"""
+    size = sys.getsizeof(key) + sys.getsizeof(results)
+    if isinstance(key, tuple):
+        size += sum(sys.getsizeof(part) for part in key)
+    for result in results:
+        size += sys.getsizeof(result) + sum(sys.getsizeof(value) for value in result)
+    return size
+
+
+class BoundedCache:
+    """LRU cache bounded by entries and by the estimated bytes of its values, with a time to live.
+
+    Entries belong to a generation, e.g. the version of the index they were computed on: syncing to another
+    generation drops them all, so values computed on an index that changed since are never served.
+    """
+    def __init__(self, max_entries: int = DEFAULT_RESULT_CACHE_ENTRIES, max_bytes: int = DEFAULT_RESULT_CACHE_BYTES,
+                 ttl_seconds: Optional[float] = DEFAULT_RESULT_TTL_SECONDS, clock: Callable[[], float] = time.monotonic):
+        """
+        :param max_entries: Number of values kept. 0 disables the cache.
+        :param max_bytes: Estimated memory of the kept values, least recently used ones are dropped beyond it.
+        :param ttl_seconds: Age after which a value expires, counted from its last put. None keeps values until
+            evicted.
+        :param clock: Time source in seconds, monotonic by default.
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.clock = clock
+        self.generation: Optional[Hashable] = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        self.bytes = 0
+        # key -> (stored at, estimated bytes, value), least recently used first
+        self._entries: "OrderedDict[Hashable, Tuple[float, int, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+    def sync(self, generation: Hashable) -> None:
+        """Drop every entry computed in another generation"""
+        with self._lock:
+            if generation != self.generation:
+                self.invalidations += len(self._entries)
+                self._drop_all()
+                self.generation = generation
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Get the cached value, or None when it is missing or expired"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self.ttl_seconds is not None and self.clock() - entry[0] > self.ttl_seconds:
+                self._drop(key)
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+    def put(self, key: Hashable, value: Any, size: int, generation: Optional[Hashable] = None) -> None:
+        """Cache a value of ``size`` estimated bytes, unless it was computed in a generation other than the current
+        one. Putting a key again replaces its value and size, e.g. once a cached object has grown."""
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            if self.max_entries <= 0 or size > self.max_bytes:
+                return
+            if generation is not None and generation != self.generation:
+                return
+            self._entries[key] = (self.clock(), size, value)
+            self.bytes += size
+            while len(self._entries) > self.max_entries or self.bytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+    def __contains__(self, key: Hashable) -> bool:
+        """Whether a value is cached for the key, expired or not, without counting a lookup"""
+        with self._lock:
+            return key in self._entries
+    def __len__(self) -> int:
+        return len(self._entries)
+    def pop(self, key: Hashable) -> Optional[Any]:
+        """Remove and return a value, None when it is missing"""
+        with self._lock:
+            return self._drop(key) if key in self._entries else None
+    def _drop(self, key: Hashable) -> Any:
+        _, size, value = self._entries.pop(key)
+        self.bytes -= size
+        return value
+    def _drop_all(self) -> None:
+        self._entries.clear()
+        self.bytes = 0
+    def clear(self) -> None:
+        """Drop every entry, keeping the counters"""
+        with self._lock:
+            self._drop_all()
+    def stats(self) -> CacheStats:
+        with self._lock:
+            return CacheStats(self.hits, self.misses, self.evictions, self.expirations, self.invalidations,
+                              len(self._entries), self.bytes)
+
+
+class ResultCache(BoundedCache):
+    """Cache of search results, returned as copies so callers may modify them"""
+    def get(self, key: Hashable) -> Optional[Results]:
+        results = super().get(key)
+        return list(results) if results is not None else None
+    def put(self, key: Hashable, results: Results, generation: Optional[Hashable] = None) -> None:
+        results = tuple(results)
+        super().put(key, results, _estimate_bytes(key, results), generation)
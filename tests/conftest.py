@@ -0,0 +1,23 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+# Add the project root to sys.path to handle 'src' imports
+root_path = Path(__file__).resolve().parent.parent
+if str(root_path) not in sys.path:
+    sys.path.insert(0, str(root_path))
+
+
+class SplitProcessor:
+    """Lowercases and splits on whitespace, standing in for the TextProcessor and its tokenizer"""
+    tokenizer_load_seconds = None
+    def process_text(self, text):
+        return text.lower().split()
+    def process_texts(self, texts):
+        return [self.process_text(text) for text in texts]
+
+
+@pytest.fixture(scope="session")
+def processor():
+    return SplitProcessor()
@@ -0,0 +1,91 @@
+import random
+from typing import Dict, List
+
+import numpy as np
+import pytest
+
+from src.indexing.inverted_index import InvertedIndex
+from src.model.bm25 import OkapiBM25
+from src.model.model import top_k
+
+VOCAB = [f"t{i}" for i in range(60)]
+
+
+def _documents(seed: int) -> Dict[str, List[str]]:
+    rng = random.Random(seed)
+    # a few frequent terms and a long tail, as in natural text
+    documents = {f"d{i}": [VOCAB[min(int(rng.expovariate(0.08)), len(VOCAB) - 1)] for _ in range(rng.randint(1, 40))]
+                 for i in range(500)}
+    # identical documents tie on every query
+    documents.update({f"copy{i}": list(documents["d0"]) for i in range(5)})
+    return documents
+
+
+def _baseline_scores(model: OkapiBM25, query_terms: List[str]) -> Dict[str, float]:
+    """Score every document containing a query term one term at a time, with the per-document formula"""
+    candidates = set()
+    for term in query_terms:
+        candidates.update(model.index.get_docs_contain_term(term))
+    return {doc_id: sum(model.compute_bm25_score(term, doc_id) for term in query_terms) for doc_id in candidates}
+
+
+def _queries(documents: Dict[str, List[str]], seed: int) -> List[List[str]]:
+    rng = random.Random(seed)
+    queries = [[rng.choice(VOCAB) for _ in range(rng.randint(1, 5))] for _ in range(30)]
+    # repeated terms, a term in no document and the terms of the tied documents
+    return queries + [["t0", "t0", "t3"], ["missing"], ["missing", "t7"], documents["d0"][:3]]
+
+
+@pytest.mark.parametrize("seed", [0, 1])
+@pytest.mark.parametrize("top_n", [1, 10, 10_000])
+def test_vectorized_scores_match_per_document_formula(seed, top_n):
+    documents = _documents(seed)
+    index = InvertedIndex()
+    index.build(documents)
+    model = OkapiBM25(index)
+    order = {doc_id: position for position, doc_id in enumerate(documents)}
+    for query_terms in _queries(documents, seed):
+        baseline = _baseline_scores(model, query_terms)
+        results = model.search(query_terms, top_n)
+        assert len(results) == min(top_n, len(baseline))
+        expected = sorted(baseline.values(), reverse=True)[:top_n]
+        assert [score for _, score in results] == pytest.approx(expected)
+        for doc_id, score in results:
+            assert score == pytest.approx(baseline[doc_id])
+        # exact ties are ranked in index order
+        for (first, first_score), (second, second_score) in zip(results, results[1:]):
+            if first_score == second_score:
+                assert order[first] < order[second]
+
+
+def test_tied_documents_are_ranked_in_index_order():
+    documents = _documents(0)
+    index = InvertedIndex()
+    index.build(documents)
+    results = OkapiBM25(index).search(documents["d0"], 20)
+    tied = [doc_id for doc_id, score in results if score == dict(results)["d0"]]
+    assert tied == ["d0"] + [f"copy{i}" for i in range(5)]
+
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_pruned_top_k_matches_exhaustive(seed):
+    rng = random.Random(seed)
+    documents = _documents(seed)
+    index = InvertedIndex()
+    index.build(documents)
+    # more segments and tombstones, which the bounds are computed over
+    for i in range(50):
+        index.add_document(f"new{i}", [rng.choice(VOCAB[:10]) for _ in range(rng.randint(1, 30))])
+    for doc_id in rng.sample(sorted(documents), 40):
+        index.delete_document(doc_id)
+    index.wait_for_merges()
+    model = OkapiBM25(index, k1=rng.uniform(0.5, 2.0), b=rng.uniform(0.2, 1.0))
+    model.precompute()
+    for query_terms in _queries(documents, seed) + [VOCAB[:12], VOCAB[:3] * 3]:
+        scores, touched = model.score_all(query_terms)
+        for k in (1, 5, 10, 100):
+            pruned = model.search_pruned(query_terms, k)
+            assert pruned is not None
+            exhaustive = top_k(scores, np.flatnonzero(touched), k)
+            assert pruned[0].tolist() == exhaustive.tolist()
+            assert pruned[1].tolist() == scores[exhaustive].tolist()
@@ -0,0 +1,116 @@
+import os
+
+import pytest
+
+from src.indexing.document_store import DocumentStore, open_document_store, write_document_store
+from src.util.pickle_handling import save_to_pickle_file
+
+
+@pytest.mark.parametrize("tokenized", [False, True])
+def test_ids_keep_their_type(tmp_path, tokenized):
+    path = str(tmp_path / "store.bin")
+    documents = {1: "one", "2": "two", 3: None, "x": ""}
+    if tokenized:
+        documents = {doc_id: document.split() if document is not None else None
+                     for doc_id, document in documents.items()}
+    write_document_store(path, documents.items(), tokenized=tokenized)
+    store = DocumentStore(path)
+    assert list(store) == [1, "2", 3, "x"]
+    assert [type(doc_id) for doc_id in store] == [int, str, int, str]
+    assert dict(store.items()) == documents
+    # ids are looked up by their string form whatever their type
+    assert store["1"] == store[1] and store[2] == store["2"]
+    store[4] = documents[1]
+    store["5"] = documents["2"]
+    assert list(store)[-2:] == [4, "5"]
+    store.save()
+    assert list(DocumentStore(path)) == [1, "2", 3, "x", 4, "5"]
+
+
+def _store(tmp_path, count: int = 50, **kwargs) -> DocumentStore:
+    path = str(tmp_path / "store.bin")
+    # small blocks, so that the documents span many of them
+    write_document_store(path, ((f"d{i}", f"text {i}") for i in range(count)), block_size=64, **kwargs)
+    return DocumentStore(path, cached_blocks=2)
+
+
+def test_get_many_reads_stored_and_changed_documents(tmp_path):
+    store = _store(tmp_path)
+    store["d3"] = "changed"
+    store["new"] = "added"
+    del store["d5"]
+    doc_ids = ["d40", "d3", "unknown", "d0", "new", "d5", "d40", "d1"]
+    assert store.get_many(doc_ids) == ["text 40", "changed", None, "text 0", "added", None, "text 40", "text 1"]
+    assert store.get_many(doc_ids) == [store.get(doc_id) for doc_id in doc_ids]
+    assert store.get_many([]) == []
+
+
+def test_delete(tmp_path):
+    store = _store(tmp_path, count=5)
+    del store["d1"]
+    assert "d1" not in store and len(store) == 4
+    with pytest.raises(KeyError):
+        store["d1"]
+    with pytest.raises(KeyError):
+        del store["d1"]
+    with pytest.raises(KeyError):
+        del store["unknown"]
+    # a deleted document can be added again
+    store["d1"] = "back"
+    assert store["d1"] == "back" and len(store) == 5
+    # deleting an added document forgets it, deleting a replaced one deletes the stored one too
+    store["new"] = "added"
+    del store["new"]
+    assert "new" not in store and list(store) == ["d0", "d1", "d2", "d3", "d4"]
+    store["d2"] = "replaced"
+    del store["d2"]
+    assert "d2" not in store and len(store) == 4
+    with pytest.raises(KeyError):
+        del store["new"]
+
+
+@pytest.mark.parametrize("tokenized", [False, True])
+def test_save_writes_the_changes(tmp_path, tokenized):
+    path = str(tmp_path / "store.bin")
+    documents = {f"d{i}": f"text {i}" for i in range(20)}
+    if tokenized:
+        documents = {doc_id: document.split() for doc_id, document in documents.items()}
+    write_document_store(path, documents.items(), block_size=64, tokenized=tokenized)
+    store = DocumentStore(path)
+    replaced = ["replaced"] if tokenized else "replaced"
+    store["d2"] = replaced
+    store["new"] = replaced
+    store["missing"] = None
+    del store["d7"]
+    expected = dict(store.items())
+    store.save()
+    # the open store keeps reading the old file and its in-memory changes
+    assert dict(store.items()) == expected
+    saved = DocumentStore(path)
+    assert saved.tokenized == tokenized
+    assert dict(saved.items()) == expected
+    assert list(saved)[-2:] == ["new", "missing"] and "d7" not in saved
+    copy = str(tmp_path / "copy.bin")
+    saved.save(copy)
+    assert dict(DocumentStore(copy).items()) == expected
+
+
+@pytest.mark.parametrize("tokenized", [False, True])
+def test_legacy_pickle_is_converted_once(tmp_path, tokenized):
+    path, pickle_path = str(tmp_path / "store.bin"), str(tmp_path / "documents.pkl")
+    documents = {1: "one", "2": "two", 3: None}
+    if tokenized:
+        documents = {doc_id: document.split() if document is not None else None
+                     for doc_id, document in documents.items()}
+    save_to_pickle_file(pickle_path, documents)
+    store = open_document_store(path, pickle_path, tokenized=tokenized)
+    assert os.path.exists(path)
+    assert dict(store.items()) == documents
+    # once converted, the store is opened without reading the pickle again
+    save_to_pickle_file(pickle_path, {"stale": "stale"})
+    assert dict(open_document_store(path, pickle_path, tokenized=tokenized).items()) == documents
+
+
+def test_missing_store_without_pickle_is_an_error(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        open_document_store(str(tmp_path / "store.bin"), str(tmp_path / "documents.pkl"))
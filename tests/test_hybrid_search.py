@@ -0,0 +1,85 @@
+import random
+import threading
+import time
+
+import pytest
+
+from src.hybrid_search import HybridSearch, BACKEND_OK, BACKEND_TIMEOUT
+from src.search_engine import SearchEngine
+
+VOCAB = [f"w{i}" for i in range(300)]
+BACKEND_SECONDS = 0.3
+
+
+@pytest.fixture
+def engine(processor):
+    rng = random.Random(0)
+    documents = {str(cid): [rng.choice(VOCAB) for _ in range(30)] for cid in range(2000)}
+    engine = SearchEngine()
+    engine.processor = processor
+    engine.inverted_index.build(documents)
+    engine._init_models(sidecars_on_disk=False)
+    return engine
+
+
+def _slow_search(engine, delays):
+    """Make every search of the engine sleep first, for the next of ``delays`` or BACKEND_SECONDS once used up"""
+    search = engine.search
+    lock = threading.Lock()
+    def slow_search(query, method='bm25', top_n=10):
+        with lock:
+            delay = delays.pop(0) if delays else BACKEND_SECONDS
+        time.sleep(delay)
+        return search(query, method, top_n)
+    engine.search = slow_search
+
+
+def test_backends_search_in_parallel(engine):
+    _slow_search(engine, [])
+    hybrid = HybridSearch.from_engines(engine, timeout_seconds=10)
+    try:
+        start = time.perf_counter()
+        results, reports = hybrid.search_with_report("w1 w2 w3", 10)
+        seconds = time.perf_counter() - start
+    finally:
+        hybrid.close()
+    assert [report.status for report in reports] == [BACKEND_OK, BACKEND_OK]
+    assert len(results) == 10
+    # about the slowest backend, well below both in a row
+    assert seconds < 1.5 * BACKEND_SECONDS
+
+
+def test_timed_out_search_does_not_hold_up_later_queries(engine):
+    _slow_search(engine, [5 * BACKEND_SECONDS, 0.0])
+    hybrid = HybridSearch.from_engines(engine, timeout_seconds=2 * BACKEND_SECONDS)
+    try:
+        _, reports = hybrid.search_with_report("w1 w2", 10)
+        assert sorted(report.status for report in reports) == [BACKEND_OK, BACKEND_TIMEOUT]
+        start = time.perf_counter()
+        _, reports = hybrid.search_with_report("w3 w4", 10)
+        seconds = time.perf_counter() - start
+    finally:
+        hybrid.close()
+    assert [report.status for report in reports] == [BACKEND_OK, BACKEND_OK]
+    assert seconds < 2 * BACKEND_SECONDS
+
+
+def test_concurrent_queries_match_sequential_ones(engine):
+    hybrid = HybridSearch.from_engines(engine, timeout_seconds=10)
+    rng = random.Random(1)
+    queries = [" ".join(rng.sample(VOCAB, 3)) for _ in range(40)]
+    try:
+        expected = [hybrid.search(query) for query in queries]
+        engine.result_cache.clear()
+        results = [None] * len(queries)
+        def run(offset):
+            for position in range(offset, len(queries), 8):
+                results[position] = hybrid.search(queries[position])
+        threads = [threading.Thread(target=run, args=(offset,)) for offset in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        hybrid.close()
+    assert results == expected
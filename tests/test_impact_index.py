@@ -0,0 +1,37 @@
+import numpy as np
+import pytest
+
+from src.indexing.impact_index import ImpactIndex
+from src.indexing.index_segment import IndexSegment
+
+NUM_TERMS = 30
+
+
+def _exact_scores(impact_index: ImpactIndex, term_weights, num_docs: int) -> np.ndarray:
+    """Sum the weighted impact of every posting of the query terms, reading all of them"""
+    scores = np.zeros(num_docs, dtype=np.int64)
+    for term_id, weight in term_weights:
+        for block in range(impact_index.block_offsets[term_id], impact_index.block_offsets[term_id + 1]):
+            start, end = impact_index.block_starts[block], impact_index.block_starts[block + 1]
+            scores[impact_index.postings_doc_ids[start:end]] += weight * int(impact_index.block_impacts[block])
+    return scores
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_early_terminated_top_k_is_exact(seed):
+    rng = np.random.default_rng(seed)
+    # skewed term frequencies, so some terms are frequent and early termination kicks in
+    documents = [[f"t{term}" for term in rng.zipf(1.3, rng.integers(5, 40)) % NUM_TERMS] for _ in range(3000)]
+    segment = IndexSegment.from_documents(documents)
+    scores = rng.random(len(segment.postings_doc_ids)) * rng.integers(1, 5, len(segment.postings_doc_ids))
+    impact_index = ImpactIndex.from_scores(segment, scores, len(documents))
+    for _ in range(20):
+        terms = rng.choice(len(segment.terms), rng.integers(1, 5), replace=False).tolist()
+        term_weights = [(term_id, int(rng.integers(1, 3))) for term_id in terms]
+        exact = _exact_scores(impact_index, term_weights, len(documents))
+        for k in (1, 10, 100):
+            top, top_scores, _ = impact_index.search(term_weights, k, batch_size=64)
+            # the documents tied with the k-th one may be any of them, their scores may not
+            assert top_scores.tolist() == sorted(exact[exact > 0].tolist(), reverse=True)[:k]
+            assert top_scores.tolist() == exact[top].tolist()
+            assert top.tolist() == sorted(top.tolist(), key=lambda internal_id: (-exact[internal_id], internal_id))
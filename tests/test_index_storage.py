@@ -0,0 +1,75 @@
+import random
+import struct
+
+import pytest
+
+from src.indexing.index_storage import save_index, load_index, MAGIC, FORMAT_VERSION
+from src.indexing.inverted_index import InvertedIndex
+
+VOCAB = [f"t{i}" for i in range(30)]
+
+
+def _index(cids, seed: int = 0) -> InvertedIndex:
+    rng = random.Random(seed)
+    index = InvertedIndex()
+    index.build({cid: [rng.choice(VOCAB) for _ in range(rng.randint(1, 20))] for cid in cids})
+    return index
+
+
+def _assert_same_index(loaded: InvertedIndex, index: InvertedIndex) -> None:
+    assert list(loaded.doc_ids) == list(index.doc_ids)
+    assert [type(cid) for cid in loaded.doc_ids] == [type(cid) for cid in index.doc_ids]
+    assert loaded.deleted.tolist() == index.deleted.tolist()
+    assert loaded.doc_lengths.tolist() == index.doc_lengths.tolist()
+    assert (loaded.total_docs, loaded.total_length, loaded.num_deleted) == (
+        index.total_docs, index.total_length, index.num_deleted)
+    assert loaded.avg_doc_length == pytest.approx(index.avg_doc_length)
+    assert loaded.get_all_docs() == index.get_all_docs()
+    for term in VOCAB:
+        doc_ids, tfs = loaded.get_postings(term)
+        expected_doc_ids, expected_tfs = index.get_postings(term)
+        assert doc_ids.tolist() == expected_doc_ids.tolist() and tfs.tolist() == expected_tfs.tolist()
+        for internal_id in doc_ids.tolist():
+            cid = index.doc_ids[internal_id]
+            assert loaded.get_positions(term, cid).tolist() == index.get_positions(term, cid).tolist()
+
+
+@pytest.mark.parametrize("cids", [list(range(50)), [f"d{i}" for i in range(50)],
+                                  [i if i % 3 else f"d{i}" for i in range(50)], ["7", 7, "x", 8]],
+                         ids=["int", "str", "mixed", "int-like str"])
+def test_round_trip(tmp_path, cids):
+    index = _index(cids)
+    path = str(tmp_path / "index.bin")
+    save_index(path, index)
+    _assert_same_index(load_index(path), index)
+
+
+def test_round_trip_keeps_tombstones_and_accepts_updates(tmp_path):
+    index = _index([i if i % 2 else f"d{i}" for i in range(60)])
+    index.add_document(100, ["t1", "t2", "t1"])
+    index.update_document(3, ["t5", "t6"])
+    index.delete_document("d10")
+    index.delete_document(7)
+    index.wait_for_merges()
+    path = str(tmp_path / "index.bin")
+    save_index(path, index)
+    loaded = load_index(path)
+    _assert_same_index(loaded, index)
+    assert 7 not in loaded.get_all_docs() and "d10" not in loaded.get_all_docs()
+    # a loaded index takes further updates like the one it was saved from
+    for target in (index, loaded):
+        target.add_document("new", ["t1", "t3"])
+        target.update_document(1, ["t4"] * 3)
+        target.delete_document("d20")
+        target.wait_for_merges()
+    _assert_same_index(loaded, index)
+
+
+def test_rejects_other_files(tmp_path):
+    path = tmp_path / "index.bin"
+    path.write_bytes(b"NOTINDEX" + bytes(8))
+    with pytest.raises(ValueError, match="not a valid index file"):
+        load_index(str(path))
+    path.write_bytes(struct.pack("<8sII", MAGIC, FORMAT_VERSION + 1, 2) + b"{}")
+    with pytest.raises(ValueError, match="Unsupported index format version"):
+        load_index(str(path))
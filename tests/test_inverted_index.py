@@ -0,0 +1,75 @@
+import random
+from typing import Dict, List
+
+import pytest
+
+from src.indexing.inverted_index import InvertedIndex
+from src.indexing.merge_policy import TieredMergePolicy
+
+VOCAB = [f"t{i}" for i in range(40)]
+
+
+def _random_terms(rng: random.Random) -> List[str]:
+    return [rng.choice(VOCAB) for _ in range(rng.randint(1, 30))]
+
+
+def _postings_by_cid(index: InvertedIndex, term: str) -> Dict:
+    """cid -> (tf, positions) of a term, comparable across indexes whatever their internal ids"""
+    doc_ids, tfs = index.get_postings(term)
+    return {index.doc_ids[internal_id]: (tf, index.get_positions(term, index.doc_ids[internal_id]).tolist())
+            for internal_id, tf in zip(doc_ids.tolist(), tfs.tolist())}
+
+
+def _assert_same_content(index: InvertedIndex, rebuilt: InvertedIndex) -> None:
+    assert index.total_docs == rebuilt.total_docs
+    assert index.total_length == rebuilt.total_length
+    assert index.avg_doc_length == pytest.approx(rebuilt.avg_doc_length)
+    assert index.get_all_docs() == rebuilt.get_all_docs()
+    for cid in rebuilt.get_all_docs():
+        assert index.get_doc_length(cid) == rebuilt.get_doc_length(cid)
+    for term in VOCAB:
+        assert index.get_doc_frequency(term) == rebuilt.get_doc_frequency(term)
+        assert _postings_by_cid(index, term) == _postings_by_cid(rebuilt, term)
+    merged = index.merged_segment()
+    for term in VOCAB:
+        start, end = merged.term_range(term)
+        assert end - start == rebuilt.get_doc_frequency(term)
+
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_incremental_updates_match_rebuild(seed):
+    rng = random.Random(seed)
+    documents = {cid: _random_terms(rng) for cid in range(50)}
+    index = InvertedIndex(TieredMergePolicy(max_segments=3, merge_factor=2))
+    index.build(documents)
+    next_cid = len(documents)
+    for _ in range(200):
+        operation = rng.random()
+        if operation < 0.4 or not documents:
+            documents[next_cid] = _random_terms(rng)
+            index.add_document(next_cid, documents[next_cid])
+            next_cid += 1
+        elif operation < 0.7:
+            cid = rng.choice(list(documents))
+            documents[cid] = _random_terms(rng)
+            index.update_document(cid, documents[cid])
+        else:
+            cid = rng.choice(list(documents))
+            del documents[cid]
+            index.delete_document(cid)
+    index.wait_for_merges()
+    rebuilt = InvertedIndex()
+    rebuilt.build(documents)
+    _assert_same_content(index, rebuilt)
+    index.force_merge()
+    assert len(index.segments) == 1
+    _assert_same_content(index, rebuilt)
+
+
+def test_add_existing_document_is_rejected():
+    index = InvertedIndex()
+    index.build({1: ["a"]})
+    with pytest.raises(ValueError):
+        index.add_document(1, ["b"])
+    with pytest.raises(KeyError):
+        index.delete_document(2)
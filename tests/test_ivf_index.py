@@ -0,0 +1,42 @@
+import numpy as np
+
+from src.indexing.inverted_index import InvertedIndex
+from src.indexing.ivf_index import IVFIndex
+from src.model.lsi_model import LatentSemanticModel
+
+
+def _unit_vectors(rng: np.random.Generator, count: int, dimensions: int) -> np.ndarray:
+    vectors = rng.standard_normal((count, dimensions)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def test_probing_every_list_is_exact():
+    rng = np.random.default_rng(0)
+    vectors = _unit_vectors(rng, 2000, 16)
+    ivf = IVFIndex.build(vectors, 20)
+    assert sorted(ivf.list_ids.tolist()) == list(range(len(vectors)))
+    for query in _unit_vectors(rng, 10, 16):
+        ids, scores = ivf.search(vectors, query, 10, ivf.num_lists)
+        exact = vectors @ query
+        assert ids.tolist() == np.argsort(-exact, kind="stable")[:10].tolist()
+        assert np.allclose(scores, exact[ids])
+
+
+def test_empty_index_has_no_lists(tmp_path):
+    ivf = IVFIndex.build(np.zeros((0, 16), dtype=np.float32), 8)
+    assert ivf.num_lists == 0
+    ids, scores = ivf.search(np.zeros((0, 16), dtype=np.float32), np.ones(16, dtype=np.float32), 10, 4)
+    assert len(ids) == 0 and len(scores) == 0
+    ivf.save(str(tmp_path))
+    assert IVFIndex.load(str(tmp_path)).num_lists == 0
+
+
+def test_lsi_over_an_empty_index_saves_and_finds_nothing(tmp_path):
+    index = InvertedIndex()
+    index.build({})
+    model = LatentSemanticModel(index)
+    model.save(str(tmp_path))
+    assert model.search(["term"]) == []
+    reloaded = LatentSemanticModel(index)
+    assert reloaded.load(str(tmp_path))
+    assert reloaded.search(["term"]) == []
@@ -0,0 +1,65 @@
+import random
+
+import pytest
+
+from src.search_engine import SearchEngine
+
+VOCAB = [f"w{i}" for i in range(30)]
+QUERIES = ["w1 w2", "w3", "w0 w29 w5", '"w1 w2" w3', "w2 NEAR/3 w4", "zzz"]
+
+
+@pytest.fixture(scope="module")
+def engine(processor):
+    rng = random.Random(0)
+    documents = {str(cid): [rng.choice(VOCAB[:rng.randint(3, 30)]) for _ in range(rng.randint(3, 20))]
+                 for cid in range(2000)}
+    engine = SearchEngine()
+    engine.processor = processor
+    engine.inverted_index.build(documents)
+    engine._init_models(sidecars_on_disk=False)
+    return engine
+
+
+def _all_pages(engine, query, method, page_size):
+    results, cursor = [], None
+    while True:
+        page = engine.search_page(query, method, page_size, cursor)
+        results += page.results
+        cursor = page.next_cursor
+        if cursor is None:
+            return results
+
+
+@pytest.mark.parametrize("method", ["bm25", "vsm", "lsi"])
+@pytest.mark.parametrize("page_size", [7, 100, 5000])
+def test_pages_concatenate_to_full_search(engine, method, page_size):
+    for query in QUERIES:
+        assert engine.search_page(query, method, page_size).results == engine.search(query, method, page_size)
+        assert _all_pages(engine, query, method, page_size) == engine.search(query, method, 5000)
+
+
+@pytest.mark.parametrize("page_size", [7, 100])
+def test_boolean_pages_cover_every_match_once(engine, page_size):
+    for query in ["w1 AND NOT w2", "w1 OR w7", "w3"]:
+        results = _all_pages(engine, query, "boolean", page_size)
+        assert len(set(results)) == len(results)
+        assert sorted(results) == sorted(engine.search(query, "boolean", 5000))
+
+
+def test_replayed_cursor_returns_same_page(engine):
+    first = engine.search_page("w1", "bm25", 10)
+    second = engine.search_page("w1", "bm25", 10, first.next_cursor)
+    assert engine.search_page("w1", "bm25", 10, first.next_cursor).results == second.results
+    engine.cursors.clear()
+    # an expired ranking is computed again and the page resumes at the same offset
+    assert engine.search_page("w1", "bm25", 10, first.next_cursor).results == second.results
+
+
+def test_invalid_cursors_are_rejected(engine):
+    cursor = engine.search_page("w1", "bm25", 10).next_cursor
+    with pytest.raises(ValueError):
+        engine.search_page("w2", "bm25", 10, cursor)
+    with pytest.raises(ValueError):
+        engine.search_page("w1", "bm25", 10, "garbage")
+    with pytest.raises(ValueError):
+        engine.search_page("w1", "bm25", 0)
@@ -0,0 +1,118 @@
+import pytest
+
+from src.search_engine import SearchEngine
+from src.util.result_cache import BoundedCache, CacheStats, ResultCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_entries_expire_after_their_time_to_live():
+    clock = FakeClock()
+    cache = BoundedCache(ttl_seconds=10, clock=clock)
+    cache.put("a", 1, 1)
+    clock.now = 10
+    assert cache.get("a") == 1
+    clock.now = 10.5
+    assert cache.get("a") is None and "a" not in cache
+    # putting a value again restarts its time to live
+    cache.put("b", 2, 1)
+    clock.now = 15
+    cache.put("b", 3, 1)
+    clock.now = 24
+    assert cache.get("b") == 3
+    assert cache.stats() == CacheStats(hits=2, misses=1, evictions=0, expirations=1, invalidations=0, entries=1,
+                                       bytes=1)
+
+
+def test_entries_without_time_to_live_never_expire():
+    clock = FakeClock()
+    cache = BoundedCache(ttl_seconds=None, clock=clock)
+    cache.put("a", 1, 1)
+    clock.now = 1e9
+    assert cache.get("a") == 1
+
+
+def test_least_recently_used_entries_are_evicted_beyond_max_entries():
+    cache = BoundedCache(max_entries=2)
+    cache.put("a", 1, 1)
+    cache.put("b", 2, 1)
+    assert cache.get("a") == 1
+    cache.put("c", 3, 1)
+    assert "b" not in cache and cache.get("a") == 1 and cache.get("c") == 3
+    assert cache.stats().evictions == 1 and len(cache) == 2
+
+
+def test_least_recently_used_entries_are_evicted_beyond_max_bytes():
+    cache = BoundedCache(max_bytes=100)
+    cache.put("a", 1, 40)
+    cache.put("b", 2, 40)
+    cache.put("c", 3, 40)
+    assert "a" not in cache and cache.bytes == 80
+    # a value growing past the bound evicts the others first
+    cache.put("b", 2, 90)
+    assert len(cache) == 1 and "b" in cache and cache.bytes == 90
+    # a value larger than the bound is not cached at all
+    cache.put("d", 4, 101)
+    assert "d" not in cache and cache.bytes == 90
+    assert cache.pop("b") == 2 and cache.bytes == 0 and cache.pop("b") is None
+    assert cache.stats().evictions == 2
+
+
+def test_zero_entries_disables_the_cache():
+    cache = BoundedCache(max_entries=0)
+    cache.put("a", 1, 1)
+    assert cache.get("a") is None and len(cache) == 0
+
+
+def test_a_new_generation_drops_every_entry():
+    cache = BoundedCache()
+    cache.sync(1)
+    cache.put("a", 1, 1, generation=1)
+    cache.put("b", 2, 1, generation=1)
+    cache.sync(1)
+    assert cache.get("a") == 1
+    cache.sync(2)
+    assert cache.get("a") is None and cache.bytes == 0
+    # values computed on an older generation are not cached
+    cache.put("a", 1, 1, generation=1)
+    assert "a" not in cache
+    cache.put("a", 1, 1, generation=2)
+    assert cache.get("a") == 1
+    stats = cache.stats()
+    assert stats.invalidations == 2 and stats.entries == 1
+    assert stats.hit_rate == pytest.approx(2 / 3)
+
+
+def test_results_are_returned_as_copies():
+    cache = ResultCache()
+    results = [("d1", 1.0), ("d2", 0.5)]
+    cache.put("q", results)
+    results.append(("d3", 0.1))
+    cached = cache.get("q")
+    assert cached == [("d1", 1.0), ("d2", 0.5)]
+    cached.clear()
+    assert cache.get("q") == [("d1", 1.0), ("d2", 0.5)]
+    assert cache.bytes > 0
+
+
+@pytest.mark.parametrize("method", ["boolean", "vsm", "bm25", "bm25_impact", "lsi"])
+def test_index_updates_invalidate_cached_results(processor, method):
+    engine = SearchEngine()
+    engine.processor = processor
+    engine.raw_documents, engine.processed_documents = {}, {}
+    engine.inverted_index.build({f"d{i}": [f"w{i % 7}", f"w{i % 5}", "common"] for i in range(40)})
+    engine._init_models(sidecars_on_disk=False)
+    before = engine.search("w1 w2", method, 100)
+    assert engine.search("w1 w2", method, 100) == before
+    assert engine.result_cache.stats().hits == 1
+    engine.add_document("new", "w1 w2 w1 w2")
+    after = engine.search("w1 w2", method, 100)
+    assert "new" in [doc_id for doc_id, _ in after]
+    assert engine.result_cache.stats().invalidations == 1
+    engine.delete_document("new")
+    assert engine.search_batch(["w1 w2"], method, 100) == [before]
@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+
+from src.indexing.roaring_bitmap import RoaringBitmap, flatten_bitmaps, read_bitmap, intersect_sorted, \
+    subtract_sorted, union_sorted, CONTAINER_SIZE, ARRAY_CONTAINER_LIMIT
+
+UNIVERSE = 4 * CONTAINER_SIZE
+
+
+def _random_ids(rng: np.random.Generator) -> np.ndarray:
+    """Sorted unique ids mixing empty, sparse (array) and dense (bitmap) containers"""
+    parts = []
+    for key in range(UNIVERSE // CONTAINER_SIZE):
+        count = rng.choice([0, 1, rng.integers(2, ARRAY_CONTAINER_LIMIT), ARRAY_CONTAINER_LIMIT + 1,
+                            rng.integers(ARRAY_CONTAINER_LIMIT + 1, CONTAINER_SIZE), CONTAINER_SIZE])
+        parts.append(key * CONTAINER_SIZE + rng.choice(CONTAINER_SIZE, int(count), replace=False))
+    return np.unique(np.concatenate(parts)).astype(np.int64)
+
+
+def _mask(ids: np.ndarray) -> np.ndarray:
+    mask = np.zeros(UNIVERSE, dtype=bool)
+    mask[ids] = True
+    return mask
+
+
+@pytest.mark.parametrize("seed", range(8))
+def test_set_operations_match_numpy(seed):
+    rng = np.random.default_rng(seed)
+    first_ids, second_ids = _random_ids(rng), _random_ids(rng)
+    first, second = RoaringBitmap.from_sorted(first_ids), RoaringBitmap.from_sorted(second_ids)
+    assert np.array_equal(first.to_array(), first_ids)
+    assert np.array_equal(RoaringBitmap.from_mask(_mask(first_ids)).to_array(), first_ids)
+    assert len(first) == len(first_ids)
+    assert np.array_equal((first & second).to_array(), np.intersect1d(first_ids, second_ids))
+    assert np.array_equal((first | second).to_array(), np.union1d(first_ids, second_ids))
+    assert np.array_equal((first - second).to_array(), np.setdiff1d(first_ids, second_ids))
+    assert len(first & second) == len(np.intersect1d(first_ids, second_ids))
+    limit = int(rng.integers(0, len(first_ids) + 2))
+    assert np.array_equal(first.to_array(limit), first_ids[:limit])
+    probes = rng.integers(0, UNIVERSE + CONTAINER_SIZE, 200).tolist()
+    expected = set(first_ids.tolist())
+    assert [probe in first for probe in probes] == [probe in expected for probe in probes]
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_flattened_bitmaps_read_back(seed):
+    rng = np.random.default_rng(seed)
+    ids = [_random_ids(rng) for _ in range(3)] + [np.zeros(0, dtype=np.int64)]
+    arrays = flatten_bitmaps([RoaringBitmap.from_sorted(values) for values in ids])
+    for position, values in enumerate(ids):
+        assert np.array_equal(read_bitmap(arrays, position).to_array(), values)
+
+
+@pytest.mark.parametrize("seed", range(8))
+def test_sorted_array_operations_match_numpy(seed):
+    rng = np.random.default_rng(seed)
+    # lengths far apart take the binary-search path, similar lengths the merge
+    first = np.unique(rng.integers(0, 10000, int(rng.integers(0, 50))))
+    second = np.unique(rng.integers(0, 10000, int(rng.integers(0, 5000))))
+    for a, b in ((first, second), (second, first)):
+        assert np.array_equal(intersect_sorted(a, b), np.intersect1d(a, b))
+        assert np.array_equal(subtract_sorted(a, b), np.setdiff1d(a, b))
+        assert np.array_equal(union_sorted(a, b), np.union1d(a, b))
@@ -0,0 +1,59 @@
+import random
+
+import pytest
+
+from src.search_engine import SearchEngine
+
+VOCAB = [f"w{i}" for i in range(120)]
+METHODS = ["boolean", "vsm", "bm25", "bm25_impact", "lsi"]
+
+
+@pytest.fixture(scope="module")
+def engine(processor):
+    rng = random.Random(0)
+    documents = {cid: [rng.choice(VOCAB[:rng.randint(5, 120)]) for _ in range(rng.randint(3, 40))]
+                 for cid in range(1500)}
+    engine = SearchEngine()
+    engine.processor = processor
+    engine.inverted_index.build(documents)
+    engine._init_models(sidecars_on_disk=False)
+    return engine
+
+
+def _queries():
+    rng = random.Random(1)
+    queries = [" ".join(rng.choice(VOCAB) for _ in range(rng.randint(1, 5))) for _ in range(40)]
+    # repeated and missing queries, unknown terms, boolean operators, phrases and proximity
+    return queries + [queries[0], None, "", "zzz", "w1 zzz", "w1 AND w2", "w3 OR (w4 AND NOT w5)", '"w1 w2" w3',
+                      "w2 NEAR/3 w4", "w1 w1 w2"]
+
+
+@pytest.mark.parametrize("method", METHODS)
+@pytest.mark.parametrize("top_n", [1, 10, 200])
+def test_batch_matches_single_queries(engine, method, top_n):
+    queries = _queries()
+    expected = [engine.search(query, method, top_n) if query is not None else [] for query in queries]
+    engine.result_cache.clear()
+    assert engine.search_batch(queries, method, top_n) == expected
+    # the second time round every query is answered from the cache
+    hits = engine.result_cache.stats().hits
+    assert engine.search_batch(queries, method, top_n) == expected
+    assert engine.result_cache.stats().hits > hits
+
+
+def test_batch_matches_single_queries_with_proximity_boost(engine):
+    engine.bm25.proximity_weight = 0.5
+    try:
+        queries = _queries()
+        engine.result_cache.clear()
+        expected = [engine.search(query, "bm25", 10) if query is not None else [] for query in queries]
+        engine.result_cache.clear()
+        assert engine.search_batch(queries, "bm25", 10) == expected
+    finally:
+        engine.bm25.proximity_weight = 0.0
+        engine.result_cache.clear()
+
+
+def test_unknown_method_is_rejected(engine):
+    with pytest.raises(ValueError):
+        engine.search_batch(["w1"], "unknown")
@@ -0,0 +1,79 @@
+import random
+from typing import Dict, List
+
+import pytest
+
+import src.search_engine as search_engine_module
+from src.indexing.document_store import write_document_store
+from src.model.lsi_model import LatentSemanticModel
+from src.search_engine import SearchEngine
+
+VOCAB = [f"w{i}" for i in range(80)]
+_PATHS = ("RAW_CORPUS_DICT_PATH", "PROCESSED_CORPUS_DICT_PATH", "INVERTED_INDEX_BUILT_PATH", "VSM_SIDECAR_PATH",
+          "BM25_SIDECAR_PATH", "IMPACT_INDEX_PATH", "LSI_INDEX_PATH", "BITMAP_INDEX_PATH", "RAW_DOCUMENT_STORE_PATH",
+          "PROCESSED_DOCUMENT_STORE_PATH", "QUERY_LOG_PATH", "GROUND_TRUTH_EVALUATION_DOCUMENT_PATH")
+
+
+def _documents(seed: int, count: int) -> Dict[str, List[str]]:
+    rng = random.Random(seed)
+    return {str(cid): [rng.choice(VOCAB) for _ in range(rng.randint(3, 30))] for cid in range(count)}
+
+
+@pytest.fixture
+def engine_files(monkeypatch, tmp_path):
+    """Point every file of the search engine into a temporary directory"""
+    for name in _PATHS:
+        monkeypatch.setattr(search_engine_module, name, str(tmp_path / name.lower()))
+
+
+def _write_corpus(documents: Dict) -> None:
+    write_document_store(search_engine_module.RAW_DOCUMENT_STORE_PATH,
+                         ((cid, " ".join(terms)) for cid, terms in documents.items()))
+    write_document_store(search_engine_module.PROCESSED_DOCUMENT_STORE_PATH, documents.items(), tokenized=True)
+
+
+def _open_engine(processor) -> SearchEngine:
+    engine = SearchEngine()
+    engine.processor = processor
+    engine.load_prebuilt_index()
+    return engine
+
+
+def test_persist_saves_only_the_models_in_use(engine_files, processor, monkeypatch):
+    documents = _documents(0, 400)
+    _write_corpus(documents)
+    SearchEngine()._build_index()
+
+    engine = _open_engine(processor)
+    engine.search("w1 w2", "bm25")
+    engine.add_document("new", "w1 w1 w2 w3")
+    # only BM25 is in use: the latent semantic model must not be rebuilt to persist the update
+    precompute = LatentSemanticModel.precompute
+    monkeypatch.setattr(LatentSemanticModel, "precompute", lambda model: pytest.fail("LSI rebuilt"))
+    engine.persist_index()
+    monkeypatch.setattr(LatentSemanticModel, "precompute", precompute)
+
+    reloaded = _open_engine(processor)
+    assert reloaded.bm25.term_idf is not None  # attached from the saved sidecar
+    assert reloaded.lsi.doc_vectors is None  # stale, computed on first use
+    updated = SearchEngine()
+    updated.processor = processor
+    updated.inverted_index.build(dict(documents, new=["w1", "w1", "w2", "w3"]))
+    updated._init_models(sidecars_on_disk=False)
+    for method in ("bm25", "vsm", "lsi", "bm25_impact", "boolean"):
+        assert reloaded.search("w1 w2", method, 20) == updated.search("w1 w2", method, 20)
+
+
+def test_built_index_keeps_the_cid_type_of_the_corpus(engine_files, processor):
+    documents = {int(cid) if int(cid) % 2 else cid: terms for cid, terms in _documents(1, 200).items()}
+    _write_corpus(documents)
+    built = SearchEngine()
+    built.processor = processor
+    built._build_index()
+    reloaded = _open_engine(processor)
+    for engine in (built, reloaded):
+        results = engine.search("w1 w2 w3", "bm25", 50)
+        assert results
+        assert all(cid in documents and isinstance(cid, int if int(cid) % 2 else str) for cid, _ in results)
+        assert engine.get_raw_documents([cid for cid, _ in results]) == [
+            " ".join(documents[cid]) for cid, _ in results]
@@ -0,0 +1,192 @@
+import asyncio
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from src.search_engine import SearchEngine
+from src.search_service import AdmissionController, MicroBatcher, SearchService
+
+
+class RecordingEngine:
+    """Engine stub recording the batches it scores, each search returning its own query"""
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.batches = []
+    def search_batch(self, queries, method="bm25", top_n=10):
+        if method not in ("bm25", "vsm"):
+            raise ValueError(f"Unknown method: {method}")
+        time.sleep(self.delay)
+        self.batches.append((list(queries), method, top_n))
+        return [[(query, float(top_n))] for query in queries]
+
+
+@pytest.fixture(scope="module")
+def service(processor):
+    engine = SearchEngine()
+    engine.processor = processor
+    documents = {f"d{i}": f"w{i % 7} w{i % 5} common" for i in range(40)}
+    engine.raw_documents = documents
+    engine.processed_documents = {cid: processor.process_text(text) for cid, text in documents.items()}
+    engine.inverted_index.build(engine.processed_documents)
+    engine._init_models(sidecars_on_disk=False)
+    service = SearchService(engine)
+    yield service
+    service.close()
+
+
+def _dispatch(service, method, target, payload=None):
+    body = payload if isinstance(payload, bytes) else json.dumps(payload).encode() if payload is not None else b""
+    return asyncio.run(service.dispatch(method, target, body))
+
+
+@pytest.mark.parametrize("method, target, payload, status", [
+    ("POST", "/search", {"query": "w1 w2"}, 200),
+    ("POST", "/search/", {"query": "w1", "method": "vsm", "top_n": 3}, 200),
+    ("POST", "/search/batch", {"queries": ["w1", None, ""], "method": "boolean"}, 200),
+    ("GET", "/documents/d1", None, 200),
+    ("GET", "/health", None, 200),
+    ("GET", "/metrics", None, 200),
+    ("POST", "/search", b"{not json", 400),
+    ("POST", "/search", [1, 2], 400),
+    ("POST", "/search", {}, 400),
+    ("POST", "/search", {"query": 1}, 400),
+    ("POST", "/search", {"query": "w1", "method": 1}, 400),
+    ("POST", "/search", {"query": "w1", "method": "unknown"}, 400),
+    ("POST", "/search", {"query": "w1", "top_n": 0}, 400),
+    ("POST", "/search", {"query": "w1", "top_n": 1001}, 400),
+    ("POST", "/search", {"query": "w1", "top_n": True}, 400),
+    ("POST", "/search/batch", {"queries": "w1"}, 400),
+    ("POST", "/search/batch", {"queries": ["w1", 2]}, 400),
+    ("GET", "/documents/unknown", None, 404),
+    ("GET", "/unknown", None, 404),
+    ("GET", "/search", None, 405),
+    ("POST", "/health", None, 405),
+])
+def test_dispatch_status(service, method, target, payload, status):
+    code, response = _dispatch(service, method, target, payload)
+    assert code == status
+    assert ("error" in response) == (status != 200)
+
+
+def test_search_responses_match_the_engine(service):
+    engine = service.engine
+    _, response = _dispatch(service, "POST", "/search", {"query": "w1 w2", "method": "vsm", "top_n": 5})
+    assert [(result["doc_id"], result["score"]) for result in response["results"]] == engine.search("w1 w2", "vsm", 5)
+    _, response = _dispatch(service, "POST", "/search/batch", {"queries": ["w1", None, "w3 common"]})
+    assert [[(result["doc_id"], result["score"]) for result in results] for results in response["results"]] == \
+        engine.search_batch(["w1", None, "w3 common"])
+    _, response = _dispatch(service, "GET", "/documents/d3")
+    assert response == {"doc_id": "d3", "text": engine.raw_documents["d3"]}
+
+
+def test_unexpected_errors_are_internal_server_errors(service, monkeypatch):
+    def fail(*args):
+        raise RuntimeError("broken")
+    monkeypatch.setattr(service.engine, "search_batch", fail)
+    code, response = _dispatch(service, "POST", "/search/batch", {"queries": ["w1"]})
+    assert code == 500 and "broken" in response["error"]
+    assert service.admission.in_flight == 0
+
+
+def _search_all(batcher, queries, method="bm25", top_n=10):
+    async def search_all():
+        return await asyncio.gather(*(batcher.search(query, method, top_n) for query in queries))
+    return asyncio.run(search_all())
+
+
+def test_concurrent_searches_are_scored_as_one_batch():
+    engine = RecordingEngine()
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        batcher = MicroBatcher(engine, executor, window_seconds=0.05)
+        queries = [f"q{i}" for i in range(10)]
+        assert _search_all(batcher, queries) == [[(query, 10.0)] for query in queries]
+    assert engine.batches == [(queries, "bm25", 10)]
+    assert batcher.stats() == {"batches": 1, "searches": 10, "mean_batch_size": 10}
+
+
+def test_full_batches_are_flushed_before_their_window_ends():
+    engine = RecordingEngine()
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        batcher = MicroBatcher(engine, executor, window_seconds=60, max_batch_size=4)
+        queries = [f"q{i}" for i in range(8)]
+        start = time.perf_counter()
+        assert _search_all(batcher, queries) == [[(query, 10.0)] for query in queries]
+        assert time.perf_counter() - start < 10
+    assert [batch for batch, _, _ in engine.batches] == [queries[:4], queries[4:]]
+
+
+def test_searches_of_different_methods_and_depths_are_batched_apart():
+    engine = RecordingEngine()
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        batcher = MicroBatcher(engine, executor, window_seconds=0.05)
+        async def search_all():
+            return await asyncio.gather(batcher.search("a", "bm25", 10), batcher.search("b", "vsm", 10),
+                                        batcher.search("c", "bm25", 5), batcher.search("d", "bm25", 10))
+        assert asyncio.run(search_all()) == [[("a", 10.0)], [("b", 10.0)], [("c", 5.0)], [("d", 10.0)]]
+    assert sorted(engine.batches) == [(["a", "d"], "bm25", 10), (["b"], "vsm", 10), (["c"], "bm25", 5)]
+
+
+def test_a_failed_batch_fails_each_of_its_searches():
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        batcher = MicroBatcher(RecordingEngine(), executor, window_seconds=0.01)
+        async def search_all():
+            return await asyncio.gather(*(batcher.search(query, "unknown", 10) for query in "ab"),
+                                        return_exceptions=True)
+        errors = asyncio.run(search_all())
+    assert [type(error) for error in errors] == [ValueError, ValueError]
+
+
+def test_admission_rejects_requests_beyond_the_limit():
+    admission = AdmissionController(max_in_flight=2)
+    assert admission.try_acquire() and admission.try_acquire()
+    assert not admission.try_acquire()
+    admission.release()
+    assert admission.try_acquire()
+    assert admission.stats() == {"max_in_flight": 2, "in_flight": 2, "admitted": 3, "rejected": 1}
+
+
+def test_requests_beyond_the_limit_are_turned_away():
+    service = SearchService(RecordingEngine(delay=0.3), window_seconds=0.001, max_in_flight=1)
+    async def overload():
+        slow = asyncio.ensure_future(service.dispatch("POST", "/search", b'{"query": "slow"}'))
+        await asyncio.sleep(0.1)
+        rejected = await service.dispatch("POST", "/search", b'{"query": "rejected"}')
+        # health checks are served whatever the load
+        health = await service.dispatch("GET", "/health", b"")
+        return await slow, rejected, health
+    try:
+        slow, rejected, health = asyncio.run(overload())
+        assert slow == (200, {"results": [{"doc_id": "slow", "score": 10.0}]})
+        assert rejected[0] == 503 and health[0] == 200
+        assert service.admission.stats()["rejected"] == 1
+        assert _dispatch(service, "POST", "/search", {"query": "again"})[0] == 200
+    finally:
+        service.close()
+
+
+def test_requests_are_served_over_keep_alive_connections(service):
+    async def exchange():
+        server = await asyncio.start_server(service.handle_connection, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        async with server:
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            responses = []
+            for request in (b"GET /health HTTP/1.1\r\n\r\n",
+                            b'POST /search HTTP/1.1\r\nContent-Length: 15\r\n\r\n{"query": "w1"}',
+                            b"BROKEN\r\n\r\n"):
+                writer.write(request)
+                status = (await reader.readline()).split()[1]
+                headers = {}
+                while (line := await reader.readline()) != b"\r\n":
+                    name, _, value = line.decode().partition(":")
+                    headers[name.lower()] = value.strip()
+                body = json.loads(await reader.readexactly(int(headers["content-length"])))
+                responses.append((int(status), headers["connection"], body))
+            writer.close()
+            return responses
+    health, search, broken = asyncio.run(exchange())
+    assert health == (200, "keep-alive", {"status": "ok"})
+    assert search[0] == 200 and search[2]["results"]
+    assert broken[:2] == (400, "close")
@@ -0,0 +1,59 @@
+import random
+
+import pytest
+
+from src.search_engine import SearchEngine
+from src.sharded_search import ShardedSearchEngine, merge_shard_results
+
+VOCAB = [f"w{i}" for i in range(500)]
+
+
+@pytest.fixture(scope="module")
+def engines(tmp_path_factory, processor):
+    rng = random.Random(1)
+    documents = {cid if cid % 2 else str(cid): [rng.choice(VOCAB[:50] if rng.random() < 0.5 else VOCAB)
+                                                for _ in range(rng.randint(3, 60))]
+                 for cid in range(1500)}
+    # identical documents tie on every query and are ordered by corpus position
+    documents.update({str(cid): list(documents[1]) for cid in range(1500, 1520)})
+    engine = SearchEngine()
+    engine.processor = processor
+    engine.processed_documents = documents
+    engine.inverted_index.build(documents)
+    engine._init_models(sidecars_on_disk=False)
+    directory = str(tmp_path_factory.mktemp("shards"))
+    engine.build_shards(3, directory)
+    with ShardedSearchEngine(directory, processor) as sharded:
+        yield engine, sharded
+
+
+def _queries():
+    rng = random.Random(2)
+    return [" ".join(rng.choice(VOCAB[:100]) for _ in range(rng.randint(1, 4))) for _ in range(50)] + [
+        "w1 zzz", "zzz", ""]
+
+
+def _comparable(results):
+    return [(str(doc_id), score) for doc_id, score in results]
+
+
+@pytest.mark.parametrize("method", ["bm25", "vsm"])
+def test_sharded_top_n_matches_unsharded(engines, method):
+    engine, sharded = engines
+    queries = _queries() + ['"w1 w2" w3', "w1 NEAR/3 w5 w7", '"zz yy" w1',
+                            " ".join(engine.processed_documents[1][:3])]
+    for query in queries:
+        assert _comparable(sharded.search(query, method, 10)) == _comparable(engine.search(query, method, 10))
+    batched = sharded.search_batch(queries + [None], method, 10)
+    assert batched == [sharded.search(query, method, 10) for query in queries] + [[]]
+
+
+def test_unsupported_method_is_rejected(engines):
+    with pytest.raises(ValueError):
+        engines[1].search("w1", "lsi")
+
+
+def test_merge_orders_by_score_then_corpus_position():
+    shard_results = [[(4, "d", 3.0), (0, "a", 1.0)], [(2, "c", 3.0), (1, "b", 1.0)], []]
+    assert merge_shard_results(shard_results, 3) == [("c", 3.0), ("d", 3.0), ("a", 1.0)]
+    assert merge_shard_results(shard_results, 10) == [("c", 3.0), ("d", 3.0), ("a", 1.0), ("b", 1.0)]
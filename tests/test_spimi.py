@@ -0,0 +1,28 @@
+import random
+
+import numpy as np
+import pytest
+
+from src.indexing.index_segment import IndexSegment
+from src.indexing.spimi import build_segment_external
+
+_ARRAYS = ("term_offsets", "postings_doc_ids", "postings_tfs", "position_offsets", "positions")
+
+
+@pytest.mark.parametrize("memory_budget", [1, 2048, 1 << 30])
+def test_external_build_is_identical_to_in_memory_build(memory_budget, tmp_path):
+    rng = random.Random(memory_budget)
+    vocab = [f"t{i}" for i in range(300)] + ["thuế", "hải_quan"]
+    documents = [(f"d{i}", [rng.choice(vocab) for _ in range(rng.randint(0, 60))]) for i in range(400)]
+    segment, doc_ids, doc_lengths = build_segment_external(iter(documents), memory_budget, str(tmp_path))
+    expected = IndexSegment.from_documents(terms for _, terms in documents)
+    assert [segment.terms[i] for i in range(len(segment.terms))] == list(expected.terms)
+    for name in _ARRAYS:
+        actual, wanted = getattr(segment, name), getattr(expected, name)
+        assert actual.dtype == wanted.dtype, name
+        assert np.asarray(actual).tobytes() == np.asarray(wanted).tobytes(), name
+    assert doc_ids == [cid for cid, _ in documents]
+    assert doc_lengths.tolist() == [len(terms) for _, terms in documents]
+    assert segment.doc_range == expected.doc_range
+    # the sorted runs are removed once merged
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,85 @@
+import math
+import random
+from collections import Counter
+from typing import Dict, List
+
+import pytest
+
+from src.indexing.inverted_index import InvertedIndex
+from src.model.vector_space_model import VectorSpaceModel
+
+VOCAB = [f"t{i}" for i in range(60)]
+
+
+def _documents(seed: int) -> Dict[str, List[str]]:
+    rng = random.Random(seed)
+    documents = {f"d{i}": [VOCAB[min(int(rng.expovariate(0.08)), len(VOCAB) - 1)] for _ in range(rng.randint(1, 40))]
+                 for i in range(400)}
+    # identical documents tie on every query
+    documents.update({f"copy{i}": list(documents["d0"]) for i in range(3)})
+    return documents
+
+
+def _baseline_scores(model: VectorSpaceModel, documents: Dict[str, List[str]],
+                     query_terms: List[str]) -> Dict[str, float]:
+    """Cosine similarity of the query with every document containing a query term, one document at a time"""
+    query = {term: (1 + math.log(freq)) * model.compute_idf(term) for term, freq in Counter(query_terms).items()}
+    query_norm = math.sqrt(sum(weight ** 2 for weight in query.values()))
+    scores = {}
+    for doc_id, terms in documents.items():
+        if not set(query) & set(terms):
+            continue
+        doc = {term: model.compute_tf_idf(term, doc_id) for term in set(terms)}
+        doc_norm = math.sqrt(sum(weight ** 2 for weight in doc.values()))
+        scores[doc_id] = sum(weight * doc.get(term, 0) for term, weight in query.items()) / (query_norm * doc_norm)
+    return scores
+
+
+def _queries(documents: Dict[str, List[str]], seed: int) -> List[List[str]]:
+    rng = random.Random(seed)
+    queries = [[rng.choice(VOCAB) for _ in range(rng.randint(1, 5))] for _ in range(25)]
+    # repeated terms, a term in no document and the terms of the tied documents
+    return queries + [["t0", "t0", "t3"], ["missing"], ["missing", "t7"], documents["d0"][:3]]
+
+
+@pytest.mark.parametrize("seed", [0, 1])
+@pytest.mark.parametrize("top_n", [1, 10, 10_000])
+def test_sparse_cosine_matches_per_document_cosine(seed, top_n):
+    documents = _documents(seed)
+    index = InvertedIndex()
+    index.build(documents)
+    model = VectorSpaceModel(index)
+    queries = _queries(documents, seed)
+    for query_terms in queries:
+        baseline = _baseline_scores(model, documents, query_terms)
+        results = model.search(query_terms, top_n)
+        assert len(results) == min(top_n, len(baseline))
+        assert [score for _, score in results] == pytest.approx(sorted(baseline.values(), reverse=True)[:top_n])
+        for doc_id, score in results:
+            assert score == pytest.approx(baseline[doc_id])
+    assert model.search_batch(queries, top_n) == [model.search(query_terms, top_n) for query_terms in queries]
+
+
+def test_candidates_restrict_the_ranking():
+    documents = _documents(2)
+    index = InvertedIndex()
+    index.build(documents)
+    model = VectorSpaceModel(index)
+    baseline = _baseline_scores(model, documents, ["t1", "t5"])
+    candidates = set(list(baseline)[::3]) | {"unknown"}
+    results = model.search(["t1", "t5"], 10_000, candidates)
+    assert {doc_id for doc_id, _ in results} == candidates & set(baseline)
+    for doc_id, score in results:
+        assert score == pytest.approx(baseline[doc_id])
+
+
+def test_sidecar_restores_the_same_ranking():
+    documents = _documents(3)
+    index = InvertedIndex()
+    index.build(documents)
+    model = VectorSpaceModel(index)
+    params, arrays = model.sidecar_state()
+    restored = VectorSpaceModel(index)
+    restored.attach_sidecar(params, arrays)
+    for query_terms in _queries(documents, 3):
+        assert restored.search(query_terms, 20) == model.search(query_terms, 20)